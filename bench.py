@@ -0,0 +1,528 @@
+#
+# Performance benchmarks for uFBT bootstrap.
+# Usage: python bench.py [benchmark ...] [--json <output file>]
+#   [--sdk-files <count>] [--sdk-libs <count>] [--sdk-lib-size <KB>]
+#
+
+import argparse
+import filecmp
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from ufbt.bootstrap import (
+    BaseSdkLoader,
+    HttpConnectionPool,
+    Timings,
+    UrlSdkLoader,
+    bootstrap_cli,
+    extract_zip,
+)
+
+# Regression threshold for import of ufbt entry point, run on every build
+IMPORT_TIME_BUDGET_MS = 20
+# make_sdk_zip arguments for benchmarks serving SDK archives, set from command line
+SDK_ZIP_OPTIONS = {}
+
+
+# Synthetic SDK archive: mix of many small headers and a few large libraries
+def make_sdk_zip(
+    zip_path, file_count=2000, large_file_count=20, large_file_size=1 << 20
+):
+    rng = random.Random(0)
+    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+        for i in range(file_count):
+            header = "".join(
+                f"#define SDK_DEFINE_{i}_{j} {rng.randrange(1 << 30)}\n"
+                for j in range(rng.randrange(10, 200))
+            )
+            zip_file.writestr(f"sdk_headers/f7_sdk/dir{i % 50}/header{i}.h", header)
+        for i in range(large_file_count):
+            # Half-compressible data, like object code
+            data = os.urandom(large_file_size // 2) + bytes(large_file_size // 2)
+            zip_file.writestr(f"lib/lib{i}.a", data)
+        zip_file.writestr("scripts/ufbt/SConstruct", "# SConstruct\n")
+
+
+def _timed(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def _trees_equal(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.diff_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(
+        left, right, comparison.common_files, shallow=False
+    )
+    if mismatch or errors:
+        return False
+    return all(
+        _trees_equal(os.path.join(left, d), os.path.join(right, d))
+        for d in comparison.common_dirs
+    )
+
+
+def bench_extract(tmpdir):
+    """Parallel ZIP extraction against ZipFile.extractall, by worker count"""
+    zip_path = Path(tmpdir) / "sdk.zip"
+    make_sdk_zip(zip_path)
+    reference_dir = Path(tmpdir) / "reference"
+    target_dir = Path(tmpdir) / "target"
+
+    def extractall():
+        shutil.rmtree(reference_dir, ignore_errors=True)
+        with ZipFile(zip_path) as zip_file:
+            zip_file.extractall(reference_dir)
+
+    results = {
+        "archive_size": zip_path.stat().st_size,
+        "cpu_count": os.cpu_count(),
+        "extractall": _timed(extractall),
+        "workers": {},
+    }
+    worker_counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    for workers in worker_counts:
+
+        def parallel():
+            shutil.rmtree(target_dir, ignore_errors=True)
+            extract_zip(str(zip_path), str(target_dir), workers)
+
+        results["workers"][workers] = _timed(parallel)
+        if not _trees_equal(reference_dir, target_dir):
+            raise RuntimeError(f"Extraction with {workers} workers differs")
+    return results
+
+
+def _import_times(module):
+    # Cumulative import times of all modules, in us, in a fresh interpreter
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    import_times = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+def bench_import(tmpdir):
+    """Import time of ufbt entry point against IMPORT_TIME_BUDGET_MS"""
+    samples = [_import_times("ufbt") for _ in range(5)]
+    bootstrap_samples = [_import_times("ufbt.bootstrap") for _ in range(5)]
+    results = {
+        "import_time_ms": min(sample["ufbt"] for sample in samples) / 1000,
+        "budget_ms": IMPORT_TIME_BUDGET_MS,
+        "bootstrap_import_time_ms": min(
+            sample["ufbt.bootstrap"] for sample in bootstrap_samples
+        )
+        / 1000,
+    }
+    if "ufbt.bootstrap" in samples[0]:
+        raise RuntimeError("ufbt entry point imports ufbt.bootstrap")
+    if results["import_time_ms"] > IMPORT_TIME_BUDGET_MS:
+        raise RuntimeError(
+            f"ufbt import takes {results['import_time_ms']} ms, "
+            f"over budget of {IMPORT_TIME_BUDGET_MS} ms"
+        )
+    return results
+
+
+def bench_noop(tmpdir, source_count=200):
+    """Latency of `ufbt` on an unchanged app, with and without no-op check"""
+    if importlib.util.find_spec("SCons") is None:
+        raise RuntimeError("SCons is not installed for this interpreter")
+    from ufbt_testing import make_stand_in_sdk
+
+    state_dir = Path(tmpdir) / "home"
+    make_stand_in_sdk(state_dir)
+    app_dir = Path(tmpdir) / "app"
+    (app_dir / "src").mkdir(parents=True)
+    (app_dir / "in.txt").write_text("app")
+    for i in range(source_count):
+        (app_dir / "src" / f"file{i}.c").write_text(f"int value{i} = {i};\n" * 50)
+
+    def ufbt(noop_check=True):
+        subprocess.run(
+            ["ufbt"],
+            cwd=app_dir,
+            env=dict(
+                os.environ,
+                UFBT_HOME=str(state_dir),
+                UFBT_NOOP_CHECK="1" if noop_check else "0",
+            ),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    ufbt()
+    # Files modified less than 2s before the build are hashed on next check
+    time.sleep(2)
+    ufbt()
+    results = {
+        "source_files": source_count,
+        "scons_up_to_date_ms": _timed(lambda: ufbt(noop_check=False), 5) * 1000,
+        "noop_ms": _timed(ufbt, 5) * 1000,
+    }
+
+    def touch_and_build():
+        for source_path in (app_dir / "src").iterdir():
+            os.utime(source_path)
+        ufbt()
+
+    # Content hash fallback, when mtimes changed but content did not
+    results["noop_touched_ms"] = _timed(touch_and_build, 5) * 1000
+    return results
+
+
+def _make_update_server_files(tmpdir, server_url):
+    # directory.json with release and rc channels, and a branch index page,
+    # for f7 and f18 targets
+    from ufbt_testing import make_index
+
+    zip_path = Path(tmpdir) / "sdk.zip"
+    make_sdk_zip(zip_path, **SDK_ZIP_OPTIONS)
+    sdk_data = zip_path.read_bytes()
+    files = {}
+    channels = {}
+    for channel in ("release", "release-candidate"):
+        channel_files = {}
+        for target in ("f7", "f18"):
+            path = f"/firmware/{channel}/flipper-z-{target}-sdk-{channel}.zip"
+            files[path] = sdk_data
+            channel_files[target] = server_url + path
+        channels[channel] = {channel: channel_files}
+    files["/firmware/directory.json"] = make_index(channels)
+    links = []
+    for target in ("f7", "f18"):
+        file_name = f"flipper-z-{target}-sdk-dev-1.zip"
+        files[f"/builds/dev/{file_name}"] = sdk_data
+        links.append(f'<a href="{file_name}">{file_name}</a>')
+    files["/builds/dev/"] = f"<html><body>{''.join(links)}</body></html>".encode()
+    return files, len(sdk_data)
+
+
+def _phase_durations(timings):
+    # Total duration of spans by name, in ms, for last run of an operation
+    phases = {}
+    for span in timings["spans"]:
+        if span["duration_ms"] is not None:
+            phases[span["name"]] = phases.get(span["name"], 0) + span["duration_ms"]
+    return phases
+
+
+def bench_update(tmpdir):
+    """SDK update, target switch, status and dotenv_create against local server"""
+    from ufbt_testing import StandInServer
+
+    store_dir = Path(tmpdir) / "store"
+    home_ids = itertools.count()
+    # Log output would dominate timings of fast operations
+    logging.basicConfig(level=logging.WARNING)
+
+    with StandInServer() as server:
+        server.files, archive_size = _make_update_server_files(tmpdir, server.url)
+        index_url = f"{server.url}/firmware/directory.json"
+
+        def bootstrap(home_dir, *args, store=False):
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = bootstrap_cli(
+                    ["--ufbt-home", str(home_dir)]
+                    + ["--store-dir", str(store_dir) if store else ""]
+                    + list(args)
+                )
+            if result != 0:
+                raise RuntimeError(f"bootstrap {' '.join(args)} failed: {result}")
+
+        def new_home():
+            return Path(tmpdir) / f"home{next(home_ids)}"
+
+        def update(home_dir, *args, store=False, force=False):
+            bootstrap(
+                home_dir,
+                *(["--force"] if force else []),
+                "update",
+                "--index-url",
+                index_url,
+                *args,
+                store=store,
+            )
+
+        def cold_update():
+            update(new_home(), "-c", "release")
+
+        results = {
+            "archive_size": archive_size,
+            "cold_update_ms": _timed(cold_update) * 1000,
+            "cold_update_phases_ms": _phase_durations(Timings.to_dict()),
+        }
+
+        def cold_branch_update():
+            bootstrap(
+                new_home(), "update", "-b", "dev", "--index-url", f"{server.url}/builds"
+            )
+
+        results["cold_branch_update_ms"] = _timed(cold_branch_update) * 1000
+
+        # New state dir, with SDK already imported into store by another one
+        update(new_home(), "-c", "release", store=True)
+        results["store_update_ms"] = (
+            _timed(lambda: update(new_home(), "-c", "release", store=True)) * 1000
+        )
+
+        home_dir = new_home()
+        update(home_dir, "-c", "release", "-t", "f7")
+        results["warm_update_ms"] = _timed(lambda: update(home_dir), 5) * 1000
+        # Index is fetched again, SDK archive is served from download cache
+        results["forced_update_ms"] = (
+            _timed(lambda: update(home_dir, force=True)) * 1000
+        )
+        results["forced_update_phases_ms"] = _phase_durations(Timings.to_dict())
+
+        update(home_dir, "-t", "f18")
+        targets = itertools.cycle(("f7", "f18"))
+        results["target_switch_ms"] = (
+            _timed(lambda: update(home_dir, "-t", next(targets)), 6) * 1000
+        )
+        results["status_ms"] = (
+            _timed(lambda: bootstrap(home_dir, "status", "--json"), 10) * 1000
+        )
+
+        project_dir = Path(tmpdir) / "project"
+        project_dir.mkdir()
+
+        def dotenv_create():
+            shutil.rmtree(project_dir / ".ufbt", ignore_errors=True)
+            (project_dir / ".env").unlink(missing_ok=True)
+            bootstrap(home_dir, "dotenv_create")
+
+        cwd = os.getcwd()
+        os.chdir(project_dir)
+        try:
+            results["dotenv_create_ms"] = _timed(dotenv_create, 10) * 1000
+        finally:
+            os.chdir(cwd)
+        results["requests"] = len(server.requests)
+    return results
+
+
+def bench_prefetch(tmpdir):
+    """Prefetch of two channels for two targets, serial and concurrent"""
+    from ufbt_testing import StandInRequestHandler, StandInServer, make_index
+
+    logging.basicConfig(level=logging.WARNING)
+    home_ids = itertools.count()
+    results = {}
+    # Delay per chunk stands in for network latency and bandwidth
+    with StandInServer(chunk_delay=0.01) as server:
+        channels = {}
+        for channel in ("release", "release-candidate"):
+            files = {}
+            for target in ("f7", "f18"):
+                path = f"/{channel}-{target}.zip"
+                server.files[path] = os.urandom(StandInRequestHandler.CHUNK_SIZE * 16)
+                files[target] = server.url + path
+            channels[channel] = {channel: files}
+        server.files["/directory.json"] = make_index(channels)
+
+        def prefetch(*args):
+            home_dir = Path(tmpdir) / f"home{next(home_ids)}"
+            result = bootstrap_cli(
+                ["--ufbt-home", str(home_dir), "--store-dir", "", "prefetch"]
+                + [arg for target in ("f7", "f18") for arg in ("-t", target)]
+                + ["-c", "release", "-c", "rc"]
+                + ["--index-url", f"{server.url}/directory.json", *args]
+            )
+            if result != 0:
+                raise RuntimeError(f"prefetch failed: {result}")
+
+        results["serial_ms"] = _timed(lambda: prefetch("-j", "1")) * 1000
+        results["concurrent_ms"] = _timed(prefetch) * 1000
+    return results
+
+
+def _make_tls_server(tmpdir, files):
+    # Stand-in server with a self-signed certificate for 127.0.0.1
+    import ssl
+    from ufbt_testing import StandInServer
+
+    if not shutil.which("openssl"):
+        raise RuntimeError("openssl is required to generate a test certificate")
+    cert_path = Path(tmpdir) / "cert.pem"
+    key_path = Path(tmpdir) / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"]
+        + ["-keyout", str(key_path), "-out", str(cert_path)],
+        capture_output=True,
+        check=True,
+    )
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert_path, key_path)
+    server = StandInServer(files)
+    server.socket = server_context.wrap_socket(server.socket, server_side=True)
+    return server, ssl.create_default_context(cafile=str(cert_path))
+
+
+def bench_download(tmpdir, connections=4):
+    """SDK archive download with a single connection and with ranges"""
+    from ufbt_testing import StandInRequestHandler, StandInServer
+
+    logging.basicConfig(level=logging.WARNING)
+    data = os.urandom(StandInRequestHandler.CHUNK_SIZE * 64)
+    download_ids = itertools.count()
+    results = {"size": len(data)}
+    settings = (
+        BaseSdkLoader.DOWNLOAD_CONNECTIONS,
+        BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE,
+    )
+    BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE = len(data) // connections
+    try:
+        # Delay per chunk limits bandwidth of each connection
+        with StandInServer({"/sdk.zip": data}, chunk_delay=0.01, etag='"v1"') as server:
+
+            def download():
+                download_dir = Path(tmpdir) / f"download{next(download_ids)}"
+                download_dir.mkdir()
+                UrlSdkLoader(
+                    str(download_dir), f"{server.url}/sdk.zip"
+                ).get_sdk_component("f7")
+
+            for connection_count in (1, connections):
+                BaseSdkLoader.DOWNLOAD_CONNECTIONS = connection_count
+                results[f"connections_{connection_count}_ms"] = _timed(download) * 1000
+    finally:
+        BaseSdkLoader.DOWNLOAD_CONNECTIONS, BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE = (
+            settings
+        )
+    return results
+
+
+def bench_tls(tmpdir, request_count=20):
+    """Request latency over TLS, with pooled connections and resumed sessions"""
+    from urllib.request import Request, urlopen
+
+    files = {"/directory.json": os.urandom(16 * 1024)}
+    server, ssl_context = _make_tls_server(tmpdir, files)
+    ssl_context_before = BaseSdkLoader._SSL_CONTEXT
+    BaseSdkLoader._SSL_CONTEXT = ssl_context
+    try:
+        with server:
+            url = f"https://127.0.0.1:{server.server_address[1]}/directory.json"
+            headers = {"User-Agent": BaseSdkLoader.USER_AGENT}
+
+            def get(open_func):
+                def requests():
+                    for _ in range(request_count):
+                        with open_func() as response:
+                            response.read()
+
+                return _timed(requests) * 1000 / request_count
+
+            results = {
+                "requests": request_count,
+                # Connection per request, as before pooling
+                "urlopen_ms": get(
+                    lambda: urlopen(Request(url, headers=headers), context=ssl_context)
+                ),
+                "new_pool_ms": get(
+                    lambda: HttpConnectionPool().open(url, headers, ssl_context)
+                ),
+            }
+
+            pool = HttpConnectionPool()
+
+            def new_connection():
+                # Idle connections are dropped, TLS sessions are kept
+                for connections in pool._idle_connections.values():
+                    for connection in connections:
+                        connection.close()
+                pool._idle_connections.clear()
+                response = pool.open(url, headers, ssl_context)
+                tls_socket = response._connection.sock
+                results["tls_version"] = tls_socket.version()
+                results["session_reused"] = tls_socket.session_reused
+                return response
+
+            results["resumed_session_ms"] = get(new_connection)
+            results["pooled_ms"] = get(lambda: pool.open(url, headers, ssl_context))
+    finally:
+        BaseSdkLoader._SSL_CONTEXT = ssl_context_before
+    return results
+
+
+BENCHMARKS = {
+    "download": bench_download,
+    "extract": bench_extract,
+    "import": bench_import,
+    "noop": bench_noop,
+    "prefetch": bench_prefetch,
+    "tls": bench_tls,
+    "update": bench_update,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="uFBT bootstrap benchmarks")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"Benchmarks to run, all by default. One of: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument("--json", help="Write results to JSON file")
+    parser.add_argument(
+        "--sdk-files", help="Number of headers in SDK archives", type=int, default=2000
+    )
+    parser.add_argument(
+        "--sdk-libs", help="Number of libraries in SDK archives", type=int, default=20
+    )
+    parser.add_argument(
+        "--sdk-lib-size",
+        help="Size of libraries in SDK archives, in KB",
+        type=int,
+        default=1024,
+    )
+    args = parser.parse_args()
+    if unknown := set(args.benchmarks) - BENCHMARKS.keys():
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    SDK_ZIP_OPTIONS.update(
+        file_count=args.sdk_files,
+        large_file_count=args.sdk_libs,
+        large_file_size=args.sdk_lib_size * 1024,
+    )
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS.keys():
+        with TemporaryDirectory() as tmpdir:
+            results[name] = BENCHMARKS[name](tmpdir)
+        print(f"{name}: {json.dumps(results[name], indent=4)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
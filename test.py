@@ -1,8 +1,56 @@
+import gzip
+import hashlib
+import importlib.util
 import json
+import logging
+import os
+import re
+import shutil
+import signal
+import socket
 import subprocess
+import sys
+import threading
+import time
 import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from urllib.error import HTTPError
+from zipfile import ZipFile
+
+from ufbt.artifacts import ArtifactCache
+from ufbt.bootstrap import (
+    BaseSdkLoader,
+    BranchSdkLoader,
+    ContentDecoder,
+    DownloadCache,
+    FileType,
+    IndexCache,
+    SdkDeployTask,
+    SdkMirror,
+    SdkStore,
+    Timings,
+    UfbtSdkDeployer,
+    UpdateChannelSdkLoader,
+    UrlSdkLoader,
+    bootstrap_cli,
+)
+from ufbt.fbtenv import get_toolchain_env
+from ufbt_testing import (
+    StandInRequestHandler,
+    StandInServer,
+    make_index,
+    make_stand_in_sdk,
+)
+
+
+def setUpModule():
+    # In-process tests only use SDK store when they enable it
+    os.environ["UFBT_STORE_DIR"] = ""
+    SdkStore.STORE_DIR = ""
 
 
 # ufbt invokation & json status output
@@ -20,6 +68,1404 @@ def ufbt_exec(args, cwd=None):
     return subprocess.check_output(["ufbt"] + args, cwd=cwd)
 
 
+class TestRangedDownload(unittest.TestCase):
+    DATA = os.urandom(2 * 1024 * 1024 + 123)
+
+    def setUp(self):
+        self.connections = BaseSdkLoader.DOWNLOAD_CONNECTIONS
+        self.min_range_size = BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE
+        BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE = 256 * 1024
+
+    def tearDown(self):
+        BaseSdkLoader.DOWNLOAD_CONNECTIONS = self.connections
+        BaseSdkLoader.DOWNLOAD_MIN_RANGE_SIZE = self.min_range_size
+
+    def _download(self, connections, support_ranges=True, **validators):
+        BaseSdkLoader.DOWNLOAD_CONNECTIONS = connections
+        validators = validators or {"etag": '"v1"'}
+        with StandInServer(
+            {"/sdk.zip": self.DATA}, support_ranges=support_ranges, **validators
+        ) as server, TemporaryDirectory() as tmpdir:
+            loader = UrlSdkLoader(tmpdir, f"{server.url}/sdk.zip")
+            file_path = loader.get_sdk_component("f7")
+            self.assertEqual(Path(file_path).read_bytes(), self.DATA)
+            self.assertEqual([f for f in os.listdir(tmpdir) if f.endswith(".part")], [])
+            return server.requests
+
+    def test_parallel_ranges(self):
+        self.assertEqual(len(self._download(1)), 1)
+        requests = self._download(4)
+        # Range probe, then 4 ranges covering the whole file once
+        self.assertEqual(requests[0][1]["Range"], "bytes=0-0")
+        byte_ranges = sorted(
+            tuple(map(int, headers["Range"][len("bytes=") :].split("-")))
+            for _, headers in requests[1:]
+        )
+        self.assertEqual(len(byte_ranges), 4)
+        self.assertEqual(byte_ranges[0][0], 0)
+        self.assertEqual(byte_ranges[-1][1], len(self.DATA) - 1)
+        for (_, end), (next_start, _) in zip(byte_ranges, byte_ranges[1:]):
+            self.assertEqual(next_start, end + 1)
+        for _, headers in requests[1:]:
+            self.assertEqual(headers["If-Range"], '"v1"')
+
+    def test_fallback_without_range_support(self):
+        requests = self._download(4, support_ranges=False)
+        self.assertEqual(len(requests), 1)
+
+    def test_last_modified_validator(self):
+        last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+        requests = self._download(4, last_modified=last_modified)
+        self.assertEqual(len(requests), 5)
+        for _, headers in requests[1:]:
+            self.assertEqual(headers["If-Range"], last_modified)
+
+    def test_fallback_without_validators(self):
+        requests = self._download(4, etag=None)
+        # Range probe and full download
+        self.assertEqual(len(requests), 2)
+        self.assertNotIn("Range", requests[1][1])
+
+
+class TestResumedDownload(unittest.TestCase):
+    DATA = os.urandom(1024 * 1024)
+    ETAG = '"v1"'
+
+    def _resume(self, part_size, part_etag):
+        with StandInServer(
+            {"/sdk.zip": self.DATA}, etag=self.ETAG
+        ) as server, TemporaryDirectory() as tmpdir:
+            url = f"{server.url}/sdk.zip"
+            part_path = Path(tmpdir) / "sdk.zip.part"
+            part_path.write_bytes(self.DATA[:part_size])
+            Path(f"{part_path}.json").write_text(
+                json.dumps({"url": url, "etag": part_etag, "length": len(self.DATA)})
+            )
+            file_path = UrlSdkLoader(tmpdir, url).get_sdk_component("f7")
+            self.assertEqual(Path(file_path).read_bytes(), self.DATA)
+            self.assertFalse(part_path.exists())
+            self.assertFalse(Path(f"{part_path}.json").exists())
+            return server.requests
+
+    def test_resume(self):
+        requests = self._resume(300000, self.ETAG)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0][1].get("Range"), "bytes=300000-")
+
+    def test_resume_refused_on_changed_etag(self):
+        requests = self._resume(300000, '"v0"')
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0][1].get("If-Range"), '"v0"')
+
+    def test_restart_on_changed_file_with_if_range_ignored(self):
+        # Part of the old file version is left by an interrupted download
+        old_data = os.urandom(len(self.DATA))
+        with StandInServer(
+            {"/sdk.zip": self.DATA}, etag=self.ETAG, support_if_range=False
+        ) as server, TemporaryDirectory() as tmpdir:
+            url = f"{server.url}/sdk.zip"
+            part_path = Path(tmpdir) / "sdk.zip.part"
+            part_path.write_bytes(old_data[:300000])
+            Path(f"{part_path}.json").write_text(
+                json.dumps({"url": url, "etag": '"v0"', "length": len(old_data)})
+            )
+            file_path = UrlSdkLoader(tmpdir, url).get_sdk_component("f7")
+            self.assertEqual(Path(file_path).read_bytes(), self.DATA)
+            self.assertFalse(part_path.exists())
+            self.assertFalse(Path(f"{part_path}.json").exists())
+            self.assertEqual(
+                [headers.get("Range") for _, headers in server.requests],
+                ["bytes=300000-", None],
+            )
+
+
+class TestConnectionPool(unittest.TestCase):
+    DATA = os.urandom(100000)
+
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.server = StandInServer({"/a": self.DATA, "/b": self.DATA[:10]})
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.loader = BaseSdkLoader(tmpdir.name)
+
+    def _get(self, path):
+        with self.loader._open_url(self.server.url + path) as response:
+            return response.read()
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self._get("/a"), self.DATA)
+            self.assertEqual(self._get("/b"), self.DATA[:10])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_partially_read_response(self):
+        with self.loader._open_url(f"{self.server.url}/a") as response:
+            response.read(10)
+        self.assertEqual(self._get("/b"), self.DATA[:10])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_closed_idle_connection(self):
+        self._get("/b")
+        pool = BaseSdkLoader._CONNECTION_POOL
+        for connections in pool._idle_connections.values():
+            for connection in connections:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self._get("/b"), self.DATA[:10])
+
+    def test_redirects_and_errors(self):
+        self.server.redirects = {"/old": "/a", "/missing": f"{self.server.url}/c"}
+        self.assertEqual(self._get("/old"), self.DATA)
+        with self.assertRaises(HTTPError) as error:
+            self._get("/missing")
+        self.assertEqual(error.exception.code, 404)
+        self.assertEqual(self._get("/b"), self.DATA[:10])
+
+
+class TestCompressedIndex(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.server = StandInServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        # Long history of versions, like official index
+        versions = {
+            f"0.{i}.0": {"f7": f"{self.server.url}/sdk-0.{i}.0.zip"}
+            for i in range(100, 0, -1)
+        }
+        self.index = make_index({"release": versions}, changelog="Fixed things\n" * 50)
+        links = "".join(
+            f'<a href="flipper-z-f7-sdk-dev-{i}.zip">flipper-z-f7-sdk-dev-{i}.zip</a>'
+            for i in range(1)
+        )
+        self.server.files = {
+            "/directory.json": self.index,
+            "/builds/dev/": f"<html><body>{links}</body></html>".encode(),
+        }
+
+    def _load_channel(self):
+        return UpdateChannelSdkLoader(
+            self.tmpdir,
+            UpdateChannelSdkLoader.UpdateChannel.RELEASE,
+            f"{self.server.url}/directory.json",
+        )
+
+    def test_compressed_index(self):
+        for encoding in ("gzip", "deflate"):
+            self.server.content_encodings = [encoding]
+            Timings.reset()
+            self.assertEqual(self._load_channel().version_info["version"], "0.100.0")
+            span = next(s for s in Timings.to_dict()["spans"] if s["name"] == "index")
+            self.assertEqual(span["encoding"], encoding)
+            self.assertEqual(span["decoded_bytes"], len(self.index))
+            self.assertLess(span["bytes"], len(self.index) / 10)
+
+        # Cached compressed copy
+        IndexCache.TTL_SECONDS = 60
+        self.addCleanup(setattr, IndexCache, "TTL_SECONDS", 0)
+        request_count = len(self.server.requests)
+        self.assertEqual(self._load_channel().version_info["version"], "0.100.0")
+        self.assertEqual(len(self.server.requests), request_count)
+
+    def test_revalidation(self):
+        self.server.etag = '"v1"'
+
+        def load_channel():
+            Timings.reset()
+            self.assertEqual(self._load_channel().version_info["version"], "0.100.0")
+            index_spans = [
+                s for s in Timings.to_dict()["spans"] if s["name"] == "index"
+            ]
+            return index_spans[0].get("cache")
+
+        def index_requests():
+            return [h for p, h in self.server.requests if p == "/directory.json"]
+
+        self.assertEqual(load_channel(), "miss")
+        # Stale entry is revalidated, and cached index is used when not modified
+        self.assertEqual(load_channel(), "not_modified")
+        self.assertNotIn("If-None-Match", index_requests()[0])
+        self.assertEqual(index_requests()[1]["If-None-Match"], '"v1"')
+        self.assertEqual(len(index_requests()), 2)
+
+        IndexCache.TTL_SECONDS = 60
+        self.addCleanup(setattr, IndexCache, "TTL_SECONDS", 0)
+        self.assertEqual(load_channel(), "fresh")
+        self.assertEqual(len(index_requests()), 2)
+        with patch("ufbt.bootstrap.time.time", return_value=time.time() + 61):
+            self.assertEqual(load_channel(), "not_modified")
+        self.assertEqual(len(index_requests()), 3)
+        self.assertEqual(index_requests()[2]["If-None-Match"], '"v1"')
+
+    def test_compressed_branch_index(self):
+        self.server.content_encodings = ["gzip"]
+        loader = BranchSdkLoader(self.tmpdir, "dev", f"{self.server.url}/builds")
+        self.assertEqual(loader.get_metadata()["version"], "dev-0")
+        self.assertEqual(self.server.requests[0][1]["Accept-Encoding"], "gzip, deflate")
+
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        data = compressor.compress(self.index) + compressor.flush()
+        decoder = ContentDecoder("deflate")
+        decoded = b"".join(
+            decoder.decode(data[i : i + 100]) for i in range(0, len(data), 100)
+        )
+        self.assertEqual(decoded + decoder.flush(), self.index)
+
+    def test_concurrent_updates(self):
+        index_cache = IndexCache(self.tmpdir)
+        url = f"{self.server.url}/directory.json"
+
+        def put(version):
+            tmp_body_path = index_cache.make_tmp_body_path(url)
+            Path(tmp_body_path).write_text(version)
+            index_cache.put(url, tmp_body_path, {"ETag": version}, "channel", None)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(put, (f"v{i}" for i in range(50))))
+        entry = index_cache.get(url)
+        self.assertEqual(b"".join(index_cache.read_body(entry)).decode(), entry["etag"])
+        self.assertEqual(len(list(Path(self.tmpdir).glob("*.body"))), 1)
+
+        # Decision for a replaced response is not stored
+        put("v50")
+        index_cache.put_decision(entry, "channel", {"version": "0.1.0"})
+        self.assertEqual(index_cache.get(url)["decisions"], {})
+
+    def test_truncated_index(self):
+        decoder = ContentDecoder("gzip")
+        decoder.decode(gzip.compress(self.index)[:-100])
+        with self.assertRaises(ValueError):
+            decoder.flush()
+
+
+class TestStreamingIndex(unittest.TestCase):
+    CHANNELS = [
+        {
+            "id": "development",
+            "title": "Development [builds]",
+            "versions": [{"version": "dev-2", "files": []}, {"version": "dev-1"}],
+        },
+        {
+            # Id after versions, strings with escapes and structural characters
+            "versions": [
+                {
+                    "version": "1.0",
+                    "changelog": 'Исправлено: "quotes", \\ and {[,:]}\n',
+                    "files": [{"type": "sdk_zip", "target": "f7", "url": "a.zip"}],
+                }
+            ],
+            "id": "release",
+        },
+        {"id": "release-candidate", "versions": []},
+    ]
+
+    def _parse(self, document, channel_id, chunk_size):
+        parser = UpdateChannelSdkLoader.HeadVersionParser(channel_id)
+        for offset in range(0, len(document), chunk_size):
+            parser.feed(document[offset : offset + chunk_size])
+            if parser.done:
+                break
+        else:
+            parser.close()
+        return parser.result()
+
+    def test_head_version_parser(self):
+        document = json.dumps(
+            {"title": "Index", "channels": self.CHANNELS}, indent=2, ensure_ascii=False
+        ).encode()
+        for chunk_size in (1, 7, len(document)):
+            for channel in self.CHANNELS:
+                self.assertEqual(
+                    self._parse(document, channel["id"], chunk_size),
+                    {"head": (channel["versions"] or [None])[0]},
+                )
+            self.assertIsNone(self._parse(document, "nightly", chunk_size))
+            with self.assertRaises(ValueError):
+                self._parse(document[:-20], "nightly", chunk_size)
+
+    def test_early_exit(self):
+        # Release is listed first, followed by a long history of dev builds
+        document = make_index(
+            {
+                "release": {"1.0": {}},
+                "development": {f"dev-{i}": {} for i in range(2000)},
+            },
+            changelog="Fixed things\n" * 100,
+        )
+        with StandInServer(
+            {"/directory.json": document}, etag='"v1"'
+        ) as server, TemporaryDirectory() as tmpdir:
+            index_url = f"{server.url}/directory.json"
+
+            def load(channel):
+                Timings.reset()
+                loader = UpdateChannelSdkLoader(tmpdir, channel, index_url)
+                span = next(
+                    s for s in Timings.to_dict()["spans"] if s["name"] == "index"
+                )
+                return loader.version_info["version"], span
+
+            version, span = load(UpdateChannelSdkLoader.UpdateChannel.RELEASE)
+            self.assertEqual(version, "1.0")
+            self.assertTrue(span["stopped_early"])
+            self.assertLess(span["bytes"], len(document) / 10)
+
+            # Partially read index is not cached, but the decision is
+            version, span = load(UpdateChannelSdkLoader.UpdateChannel.RELEASE)
+            self.assertEqual(version, "1.0")
+            self.assertEqual(
+                (span["cache"], span["decision"]), ("not_modified", "cached")
+            )
+
+            version, span = load(UpdateChannelSdkLoader.UpdateChannel.DEV)
+            self.assertEqual(version, "dev-0")
+            self.assertEqual(span["cache"], "miss")
+            index_cache = IndexCache(
+                os.path.join(tmpdir, BaseSdkLoader.INDEX_CACHE_SUBDIR)
+            )
+            self.assertEqual(
+                sorted(index_cache.get(index_url)["decisions"]),
+                ["channel:development", "channel:release"],
+            )
+
+            # Changed index invalidates decisions
+            server.etag = '"v2"'
+            version, span = load(UpdateChannelSdkLoader.UpdateChannel.RELEASE)
+            self.assertEqual(span["decision"], "parsed")
+            self.assertEqual(
+                list(index_cache.get(index_url)["decisions"]), ["channel:release"]
+            )
+
+    def test_branch_early_exit(self):
+        links = "".join(
+            f'<a href="flipper-z-{target}-{file_type}-dev-1.{ext}">{target}</a>\n'
+            for target in ("f18", "f7")
+            for file_type, ext in (("sdk", "zip"), ("update", "tgz"), ("full", "dfu"))
+        )
+        files = {
+            "/builds/dev/": f"<html><body>{links}</body></html>".encode(),
+            "/builds/dev/flipper-z-f7-sdk-dev-1.zip": b"f7 sdk",
+        }
+        chunk_size = BaseSdkLoader.INDEX_CHUNK_SIZE
+        BaseSdkLoader.INDEX_CHUNK_SIZE = 64
+        self.addCleanup(setattr, BaseSdkLoader, "INDEX_CHUNK_SIZE", chunk_size)
+        with StandInServer(files) as server, TemporaryDirectory() as tmpdir:
+            loader = BranchSdkLoader(tmpdir, "dev", f"{server.url}/builds", "f18")
+            self.assertEqual(loader.get_metadata()["version"], "dev-1")
+            self.assertNotIn((FileType.SDK_ZIP, "f7"), loader._branch_files)
+
+            # Other targets are looked up in the whole index
+            with open(loader.get_sdk_component("f7"), "rb") as f:
+                self.assertEqual(f.read(), b"f7 sdk")
+            with self.assertRaises(ValueError):
+                loader.get_sdk_component("f0")
+
+
+class TestChecksumVerification(unittest.TestCase):
+    DATA = os.urandom(100000)
+
+    def _fetch(self, sha256):
+        with StandInServer() as server, TemporaryDirectory() as tmpdir:
+            file_entry = {"url": f"{server.url}/sdk.zip", "sha256": sha256}
+            server.files = {
+                "/sdk.zip": self.DATA,
+                "/directory.json": make_index({"release": {"1.0": {"f7": file_entry}}}),
+            }
+            loader = UpdateChannelSdkLoader(
+                tmpdir,
+                UpdateChannelSdkLoader.UpdateChannel.RELEASE,
+                f"{server.url}/directory.json",
+            )
+            try:
+                return Path(loader.get_sdk_component("f7")).read_bytes()
+            finally:
+                self.assertEqual([f for f in os.listdir(tmpdir) if ".part" in f], [])
+
+    def test_checksum_match(self):
+        sha256 = hashlib.sha256(self.DATA).hexdigest()
+        self.assertEqual(self._fetch(sha256), self.DATA)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ValueError):
+            self._fetch("0" * 64)
+
+
+class TestSdkStore(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = Path(tmpdir.name)
+        SdkStore.STORE_DIR = str(self.tmpdir / "store")
+        self.addCleanup(setattr, SdkStore, "STORE_DIR", "")
+
+    def test_shared_download(self):
+        data = os.urandom(100000)
+        sha256 = hashlib.sha256(data).hexdigest()
+        with StandInServer() as server:
+            file_entry = {"url": f"{server.url}/sdk.zip", "sha256": sha256}
+            server.files = {
+                "/sdk.zip": data,
+                "/directory.json": make_index({"release": {"1.0": {"f7": file_entry}}}),
+            }
+            for env in ("a", "b"):
+                loader = UpdateChannelSdkLoader(
+                    str(self.tmpdir / env),
+                    UpdateChannelSdkLoader.UpdateChannel.RELEASE,
+                    f"{server.url}/directory.json",
+                )
+                file_path = loader.get_sdk_component("f7")
+                self.assertEqual(Path(file_path).read_bytes(), data)
+            sdk_requests = [path for path, _ in server.requests if path == "/sdk.zip"]
+            self.assertEqual(len(sdk_requests), 1)
+
+    def test_shared_deploy(self):
+        zip_path = self.tmpdir / "sdk.zip"
+        with ZipFile(zip_path, "w") as zip_file:
+            for i in range(20):
+                zip_file.writestr(f"sdk/dir{i % 3}/file{i}.h", f"// {i % 10}\n")
+            zip_file.writestr("sdk/empty/", "")
+
+        task = SdkDeployTask(
+            hw_target="f7", mode="local", all_params={"file_path": str(zip_path)}
+        )
+        deployers = [UfbtSdkDeployer(str(self.tmpdir / env)) for env in ("a", "b")]
+        for deployer in deployers:
+            self.assertTrue(deployer.deploy(task))
+        store_objects = list((self.tmpdir / "store" / "objects").rglob("*"))
+        # Duplicate files are stored once
+        self.assertEqual(len([p for p in store_objects if p.is_file()]), 10)
+
+        for i in range(20):
+            files = [
+                deployer.current_sdk_dir / f"sdk/dir{i % 3}/file{i}.h"
+                for deployer in deployers
+            ]
+            self.assertEqual(files[0].read_text(), f"// {i % 10}\n")
+            self.assertEqual(files[1].read_text(), f"// {i % 10}\n")
+        self.assertTrue((deployers[1].current_sdk_dir / "sdk/empty").is_dir())
+
+        # SDK files are read-only hardlinks of store objects
+        file_stats = [
+            os.stat(deployer.current_sdk_dir / "sdk/dir0/file0.h")
+            for deployer in deployers
+        ]
+        self.assertEqual(file_stats[0].st_ino, file_stats[1].st_ino)
+        self.assertEqual(file_stats[0].st_mode & 0o222, 0)
+
+        # Forced deploy restores store objects modified through SDK trees
+        edited_path = deployers[0].current_sdk_dir / "sdk/dir0/file0.h"
+        os.chmod(edited_path, 0o644)
+        edited_path.write_text("// edited\n")
+        task.force = True
+        self.assertTrue(deployers[1].deploy(task))
+        self.assertEqual(
+            (deployers[1].current_sdk_dir / "sdk/dir0/file0.h").read_text(), "// 0\n"
+        )
+
+    def test_garbage_collection(self):
+        SdkStore.GC_GRACE_SECONDS = 0
+        self.addCleanup(setattr, SdkStore, "GC_GRACE_SECONDS", 3600)
+        home_dir = self.tmpdir / "home"
+        zip_path = self.tmpdir / "sdk.zip"
+        with ZipFile(zip_path, "w") as zip_file:
+            zip_file.writestr("sdk/a.h", "// a\n")
+            zip_file.writestr("sdk/b.h", "// b\n")
+        sha256 = hashlib.sha256(zip_path.read_bytes()).hexdigest()
+        download_cache = DownloadCache(
+            str(home_dir / "download"), SdkStore.get_default()
+        )
+        shutil.copy(zip_path, self.tmpdir / "download.zip")
+        cached_path = download_cache.put(
+            "http://sdk/sdk.zip",
+            sha256,
+            str(self.tmpdir / "download.zip"),
+            "sdk.zip",
+            sha256=sha256,
+        )
+        deployer = UfbtSdkDeployer(str(home_dir))
+        task = SdkDeployTask(
+            hw_target="f7", mode="local", all_params={"file_path": cached_path}
+        )
+        self.assertTrue(deployer.deploy(task))
+        store = SdkStore.get_default()
+        self.assertEqual(
+            {key: store.stats()[key] for key in ("archives", "files")},
+            {"archives": 1, "files": 2},
+        )
+
+        # Archive not linked from download caches is removed, files of
+        # installed SDK are kept
+        cli_args = ["--ufbt-home", str(home_dir), "--store-dir", str(store.store_dir)]
+        self.assertEqual(bootstrap_cli([*cli_args, "clean", "--downloads"]), 0)
+        self.assertEqual(
+            {key: store.stats()[key] for key in ("archives", "files")},
+            {"archives": 0, "files": 2},
+        )
+        self.assertEqual(bootstrap_cli([*cli_args, "clean"]), 0)
+        self.assertEqual(store.stats(), {"archives": 0, "files": 0, "size": 0})
+
+    def test_cache_eviction(self):
+        max_size_mb = DownloadCache.MAX_SIZE_MB
+        DownloadCache.MAX_SIZE_MB = 0
+        self.addCleanup(setattr, DownloadCache, "MAX_SIZE_MB", max_size_mb)
+        store = SdkStore.get_default()
+        download_cache = DownloadCache(str(self.tmpdir / "download"), store)
+        archive_hashes = []
+        for name in ("a.zip", "b.zip"):
+            (self.tmpdir / name).write_bytes(name.encode())
+            sha256 = hashlib.sha256(name.encode()).hexdigest()
+            download_cache.put(
+                f"http://sdk/{name}",
+                sha256,
+                str(self.tmpdir / name),
+                name,
+                None,
+                sha256,
+            )
+            archive_hashes.append(sha256)
+        # Archive evicted from the only cache using it is removed from store
+        self.assertFalse(store.archive_path(archive_hashes[0]).exists())
+        self.assertTrue(store.archive_path(archive_hashes[1]).exists())
+        self.assertEqual(download_cache.stats()["evictions"], 1)
+
+
+class TestSdkSlots(unittest.TestCase):
+    def _make_sdk_zip(self, target):
+        zip_path = self.tmpdir / f"{target}.zip"
+        with ZipFile(zip_path, "w") as zip_file:
+            zip_file.writestr("sdk/target.txt", target)
+        return zip_path.read_bytes()
+
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = Path(tmpdir.name)
+        self.server = StandInServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        files = {target: f"{self.server.url}/{target}.zip" for target in ("f7", "f18")}
+        self.server.files = {
+            "/f7.zip": self._make_sdk_zip("f7"),
+            "/f18.zip": self._make_sdk_zip("f18"),
+            "/directory.json": make_index({"release": {"1.0": files}}),
+        }
+        self.deployer = UfbtSdkDeployer(str(self.tmpdir / "home"))
+
+    def _deploy(self, target):
+        task = SdkDeployTask(
+            hw_target=target,
+            mode="channel",
+            all_params={
+                "channel": "release",
+                "json_index": f"{self.server.url}/directory.json",
+            },
+        )
+        self.assertTrue(self.deployer.deploy(task))
+        current_sdk_dir = self.deployer.current_sdk_dir
+        self.assertEqual((current_sdk_dir / "sdk/target.txt").read_text(), target)
+        return current_sdk_dir.resolve()
+
+    def test_switch_to_installed_slot(self):
+        f7_slot_dir = self._deploy("f7")
+        self._deploy("f18")
+        self.assertEqual(self._deploy("f7"), f7_slot_dir)
+        sdk_requests = [p for p, _ in self.server.requests if p.endswith(".zip")]
+        self.assertEqual(sdk_requests, ["/f7.zip", "/f18.zip"])
+        self.assertEqual(len(self.deployer.list_slots()), 2)
+
+    def test_incremental_update(self):
+        zip_path = self.tmpdir / "local.zip"
+        task = SdkDeployTask(
+            hw_target="f7", mode="local", all_params={"file_path": str(zip_path)}
+        )
+        for version in (1, 2):
+            with ZipFile(zip_path, "w") as zip_file:
+                for i in range(5):
+                    zip_file.writestr(f"sdk/dir{i}/unchanged{i}.h", f"// {i}\n")
+                zip_file.writestr("sdk/changed.h", f"// {version}\n")
+                zip_file.writestr(f"sdk/removed{version}/file.h", "")
+            self.assertTrue(self.deployer.deploy(task))
+            if version == 1:
+                sdk_dir = self.deployer.current_sdk_dir.resolve()
+                file_stats = {
+                    path: os.stat(path) for path in sdk_dir.rglob("unchanged*.h")
+                }
+
+        # Only changed files are written, in place
+        self.assertEqual(self.deployer.current_sdk_dir.resolve(), sdk_dir)
+        self.assertEqual(len(file_stats), 5)
+        for path, file_stat in file_stats.items():
+            new_stat = os.stat(path)
+            self.assertEqual(new_stat.st_ino, file_stat.st_ino)
+            self.assertEqual(new_stat.st_mtime_ns, file_stat.st_mtime_ns)
+        self.assertEqual((sdk_dir / "sdk/changed.h").read_text(), "// 2\n")
+        self.assertFalse((sdk_dir / "sdk/removed1").exists())
+        self.assertTrue((sdk_dir / "sdk/removed2/file.h").exists())
+        self.assertEqual(len(list(self.deployer.sdk_trees_dir.iterdir())), 1)
+
+    def test_unchanged_files_linked_to_new_slot(self):
+        f7_file = self._deploy("f7") / "sdk/target.txt"
+        # Same file in archive of another target
+        self.server.files["/f18.zip"] = self._make_sdk_zip("f7")
+        task = SdkDeployTask(
+            hw_target="f18",
+            mode="channel",
+            all_params={
+                "channel": "release",
+                "json_index": f"{self.server.url}/directory.json",
+            },
+        )
+        self.assertTrue(self.deployer.deploy(task))
+        f18_file = self.deployer.current_sdk_dir / "sdk/target.txt"
+        self.assertEqual(os.stat(f18_file).st_ino, os.stat(f7_file).st_ino)
+        self.assertEqual(os.stat(f18_file).st_mode & 0o222, 0)
+
+    def test_concurrent_deploys(self):
+        # Downloads are slow enough for deploys to overlap without lock
+        self.server.chunk_delay = 0.2
+        current_dir = self.deployer.current_sdk_dir
+        deploys_done = threading.Event()
+        current_states = []
+
+        def watch_current():
+            while not deploys_done.is_set():
+                if os.path.lexists(current_dir):
+                    sdk_dir = Path(os.path.realpath(current_dir))
+                    current_states.append(
+                        (sdk_dir / UfbtSdkDeployer.UFBT_STATE_FILE_NAME).is_file()
+                        and (sdk_dir / "sdk/target.txt").is_file()
+                    )
+
+        def deploy(target):
+            task = SdkDeployTask(
+                hw_target=target,
+                mode="channel",
+                all_params={
+                    "channel": "release",
+                    "json_index": f"{self.server.url}/directory.json",
+                },
+            )
+            return UfbtSdkDeployer(str(self.tmpdir / "home")).deploy(task)
+
+        watcher = threading.Thread(target=watch_current)
+        watcher.start()
+        with self.assertLogs("ufbt.filelock", logging.INFO) as logs:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(deploy, ("f7", "f18")))
+        deploys_done.set()
+        watcher.join()
+
+        self.assertEqual(results, [True, True])
+        self.assertIn("Waiting for lock", "\n".join(logs.output))
+        # Second deploy starts after the first one is done
+        paths = [path for path, _ in self.server.requests]
+        self.assertIn(
+            paths,
+            (
+                ["/directory.json", "/f7.zip", "/directory.json", "/f18.zip"],
+                ["/directory.json", "/f18.zip", "/directory.json", "/f7.zip"],
+            ),
+        )
+        # Current SDK link always points to a complete slot
+        self.assertTrue(current_states)
+        self.assertTrue(all(current_states))
+        self.assertEqual(len(self.deployer.list_slots()), 2)
+
+    def test_prune_slots(self):
+        self._deploy("f7")
+        f18_slot_dir = self._deploy("f18")
+        self.deployer.prune_slots(keep_count=0)
+        self.assertEqual(
+            [slot_dir for slot_dir, _ in self.deployer.list_slots()], [f18_slot_dir]
+        )
+
+
+class TestUpdateCheck(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.home_dir = Path(tmpdir.name) / "home"
+        zip_path = Path(tmpdir.name) / "sdk.zip"
+        with ZipFile(zip_path, "w") as zip_file:
+            zip_file.writestr("sdk/target.txt", "f7")
+        self.server = StandInServer(etag='"v1"')
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.server.files = {
+            "/f7.zip": zip_path.read_bytes(),
+            "/directory.json": make_index(
+                {"release": {"1.0": {"f7": f"{self.server.url}/f7.zip"}}}
+            ),
+        }
+        # Set by update subcommand
+        self.addCleanup(setattr, BaseSdkLoader, "OFFLINE", False)
+        self.addCleanup(setattr, UfbtSdkDeployer, "UPDATE_CHECK_INTERVAL", 0)
+
+    def _update(self, *args):
+        return bootstrap_cli(
+            ["--ufbt-home", str(self.home_dir), "update", "-t", "f7", "-c", "release"]
+            + ["--index-url", f"{self.server.url}/directory.json", *args]
+        )
+
+    def test_check_interval(self):
+        self.assertEqual(self._update(), 0)
+        request_count = len(self.server.requests)
+        self.assertEqual(self._update("--check-interval", "3600"), 0)
+        self.assertEqual(len(self.server.requests), request_count)
+        # Expired interval only revalidates index
+        self.assertEqual(self._update("--check-interval", "0"), 0)
+        self.assertEqual(
+            [path for path, _ in self.server.requests[request_count:]],
+            ["/directory.json"],
+        )
+
+    def test_offline_with_warm_cache(self):
+        self.assertEqual(self._update(), 0)
+        # SDK is deployed again from cached index and download
+        self.assertEqual(bootstrap_cli(["--ufbt-home", str(self.home_dir), "clean"]), 0)
+        self.server.__exit__()
+        self.assertEqual(self._update("--offline"), 0)
+        self.assertEqual(
+            (self.home_dir / "current" / "sdk" / "target.txt").read_text(), "f7"
+        )
+
+    def test_offline_with_cold_cache(self):
+        with self.assertLogs("ufbt.bootstrap", logging.ERROR) as logs:
+            self.assertNotEqual(self._update("--offline"), 0)
+        self.assertIn("offline mode", "\n".join(logs.output))
+        self.assertEqual(self.server.requests, [])
+        self.assertFalse((self.home_dir / "current").exists())
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_concurrent_prefetch(self):
+        with StandInServer() as server, TemporaryDirectory() as tmpdir:
+            channels = {}
+            for channel in ("release", "release-candidate"):
+                files = {}
+                for target in ("f7", "f18"):
+                    path = f"/{channel}-{target}.zip"
+                    server.files[path] = os.urandom(
+                        StandInRequestHandler.CHUNK_SIZE * 8
+                    )
+                    files[target] = server.url + path
+                channels[channel] = {channel: files}
+            server.files["/directory.json"] = make_index(channels)
+
+            result = bootstrap_cli(
+                ["--ufbt-home", tmpdir, "--store-dir", "", "prefetch"]
+                + ["-t", "f7", "-t", "f18", "-c", "release", "-c", "rc"]
+                + ["--index-url", f"{server.url}/directory.json"]
+            )
+
+            self.assertEqual(result, 0)
+            sdk_requests = [p for p, _ in server.requests if p.endswith(".zip")]
+            self.assertEqual(len(sdk_requests), 4)
+            self.assertEqual(len(set(sdk_requests)), 4)
+            self.assertEqual(
+                DownloadCache(str(Path(tmpdir) / "download")).stats()["entries"], 4
+            )
+            self.assertFalse((Path(tmpdir) / "current").exists())
+
+
+class TestMirror(unittest.TestCase):
+    def _make_sdk_zip(self, content):
+        zip_path = self.tmpdir / "sdk.zip"
+        with ZipFile(zip_path, "w") as zip_file:
+            zip_file.writestr("sdk/version.txt", content)
+        return zip_path.read_bytes()
+
+    def _publish_upstream(self, version):
+        files = {}
+        links = []
+        for target in ("f7", "f18"):
+            path = f"/firmware/{version}/flipper-z-{target}-sdk-{version}.zip"
+            self.upstream.files[path] = self._make_sdk_zip(f"{version} {target}")
+            files[target] = self.upstream.url + path
+            file_name = f"flipper-z-{target}-sdk-{version}.zip"
+            self.upstream.files[f"/builds/dev/{file_name}"] = self._make_sdk_zip(
+                f"dev {target}"
+            )
+            links.append(f'<a href="{file_name}">{file_name}</a>')
+        self.upstream.files["/firmware/directory.json"] = make_index(
+            {"release": {version: files}}
+        )
+        self.upstream.files["/builds/dev/"] = "".join(links).encode()
+
+    def _sync(self, *args):
+        result = bootstrap_cli(
+            ["--ufbt-home", str(self.tmpdir / "mirror_home"), "--store-dir", ""]
+            + ["mirror", str(self.mirror_dir), "-c", "release", "-b", "dev"]
+            + ["--index-url", f"{self.upstream.url}/firmware/directory.json"]
+            + ["--branch-root-url", f"{self.upstream.url}/builds", *args]
+        )
+        self.assertEqual(result, 0)
+
+    def _deploy_from_mirror(self, mode, **params):
+        task = SdkDeployTask(hw_target="f7", mode=mode, all_params=params)
+        deployer = UfbtSdkDeployer(str(self.tmpdir / "client"))
+        self.assertTrue(deployer.deploy(task))
+        return (deployer.current_sdk_dir / "sdk/version.txt").read_text()
+
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = Path(tmpdir.name)
+        self.mirror_dir = self.tmpdir / "mirror"
+        self.upstream = StandInServer()
+        self.upstream.__enter__()
+        self.addCleanup(self.upstream.__exit__)
+
+    def test_sync_and_serve(self):
+        self._publish_upstream("1.0")
+        self._sync()
+        self.assertTrue(
+            (self.mirror_dir / "files/1.0/flipper-z-f7-sdk-1.0.zip").exists()
+        )
+        self.assertFalse(
+            (self.mirror_dir / "files/1.0/flipper-z-f18-sdk-1.0.zip").exists()
+        )
+
+        mirror_server = SdkMirror(str(self.mirror_dir), "").make_server("127.0.0.1", 0)
+        threading.Thread(target=mirror_server.serve_forever, daemon=True).start()
+        self.addCleanup(mirror_server.server_close)
+        self.addCleanup(mirror_server.shutdown)
+        mirror_url = f"http://127.0.0.1:{mirror_server.server_address[1]}"
+
+        upstream_requests = len(self.upstream.requests)
+        self.assertEqual(
+            self._deploy_from_mirror(
+                "channel",
+                channel="release",
+                json_index=f"{mirror_url}/directory.json",
+            ),
+            "1.0 f7",
+        )
+        self.assertEqual(
+            self._deploy_from_mirror(
+                "branch", branch="dev", branch_root=f"{mirror_url}/builds"
+            ),
+            "dev f7",
+        )
+        self.assertEqual(len(self.upstream.requests), upstream_requests)
+
+        # Only new version is downloaded, old one is removed
+        self._publish_upstream("1.1")
+        self._sync("-t", "f7", "-t", "f18")
+        self._sync("-t", "f7", "-t", "f18")
+        sdk_requests = [p for p, _ in self.upstream.requests if p.endswith(".zip")]
+        self.assertEqual(
+            sorted(sdk_requests),
+            sorted(
+                ["/firmware/1.0/flipper-z-f7-sdk-1.0.zip"]
+                + ["/builds/dev/flipper-z-f7-sdk-1.0.zip"]
+                + [f"/firmware/1.1/flipper-z-{t}-sdk-1.1.zip" for t in ("f7", "f18")]
+                + [f"/builds/dev/flipper-z-{t}-sdk-1.1.zip" for t in ("f7", "f18")]
+            ),
+        )
+        self.assertFalse((self.mirror_dir / "files/1.0").exists())
+        self.assertEqual(
+            sorted(p.name for p in (self.mirror_dir / "builds/dev").iterdir()),
+            ["flipper-z-f18-sdk-1.1.zip", "flipper-z-f7-sdk-1.1.zip", "index.html"],
+        )
+        self.assertEqual(
+            self._deploy_from_mirror(
+                "channel",
+                channel="release",
+                json_index=f"{mirror_url}/directory.json",
+            ),
+            "1.1 f7",
+        )
+
+
+class TestTimings(unittest.TestCase):
+    def test_update_phases(self):
+        self.addCleanup(setattr, Timings, "ENABLED", False)
+        self.addCleanup(setattr, Timings, "OUTPUT_FILE", None)
+        with StandInServer() as server, TemporaryDirectory() as tmpdir:
+            zip_path = Path(tmpdir) / "sdk.zip"
+            with ZipFile(zip_path, "w") as zip_file:
+                zip_file.writestr("sdk/file.h", os.urandom(10000))
+            server.files = {
+                "/sdk.zip": zip_path.read_bytes(),
+                "/directory.json": make_index(
+                    {"release": {"1.0": {"f7": f"{server.url}/sdk.zip"}}}
+                ),
+            }
+            timings_path = Path(tmpdir) / "timings.json"
+            for _ in range(2):
+                result = bootstrap_cli(
+                    ["--ufbt-home", str(Path(tmpdir) / "home"), "--store-dir", "", "-f"]
+                    + ["--timings-file", str(timings_path), "update", "-c", "release"]
+                    + ["--index-url", f"{server.url}/directory.json"]
+                )
+                self.assertEqual(result, 0)
+
+            reports = [
+                json.loads(line) for line in timings_path.read_text().splitlines()
+            ]
+            self.assertEqual(len(reports), 2)
+            self.assertEqual(reports[0]["command"], "update")
+            spans = {span["name"]: span for span in reports[0]["spans"]}
+            for name in ("deploy", "resolve_version", "index", "request", "stage"):
+                self.assertIn(name, spans)
+            self.assertEqual(spans["download"]["bytes"], zip_path.stat().st_size)
+            self.assertGreater(spans["download"]["throughput_bps"], 0)
+            self.assertEqual(spans["extract"]["bytes"], 10000)
+            deploy_index = reports[0]["spans"].index(spans["deploy"])
+            self.assertEqual(spans["stage"]["parent"], deploy_index)
+
+            # Second update is served from caches
+            spans = {span["name"]: span for span in reports[1]["spans"]}
+            self.assertEqual(spans["download"]["cache"], "hit")
+            self.assertNotIn("bytes", spans["download"])
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_build_path_does_not_import_bootstrap(self):
+        output = subprocess.check_output(
+            [sys.executable, "-c", "import sys, ufbt; print(sorted(sys.modules))"],
+            text=True,
+        )
+        self.assertNotIn("'ufbt.bootstrap'", output)
+        self.assertNotIn("'importlib.metadata'", output)
+
+    def test_subcommands_match_bootstrap(self):
+        import ufbt
+        from ufbt import bootstrap
+
+        self.assertEqual(
+            set(ufbt.BOOTSTRAP_SUBCOMMANDS),
+            {cls.COMMAND for cls in bootstrap.bootstrap_subcommand_classes},
+        )
+
+    def test_subcommand_dispatch(self):
+        from ufbt import _find_subcommand
+
+        self.assertEqual(_find_subcommand(["update", "-c", "dev"]), "update")
+        self.assertEqual(_find_subcommand(["--timings", "update"]), "update")
+        self.assertEqual(_find_subcommand(["--ufbt-home", "x", "clean"]), "clean")
+        self.assertEqual(_find_subcommand(["batch", "apps/*"]), "batch")
+        self.assertEqual(_find_subcommand(["APPSRC=update"]), "APPSRC=update")
+        self.assertEqual(_find_subcommand(["launch", "status"]), "launch")
+        self.assertIsNone(_find_subcommand(["-c"]))
+
+
+@unittest.skipIf(sys.platform == "win32", "fbtenv.sh is used on POSIX only")
+class TestToolchainEnv(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_dir = Path(tmpdir.name)
+        self.fbtenv_path = self.state_dir / "current" / "scripts" / "toolchain"
+        self.fbtenv_path.mkdir(parents=True)
+        self.fbtenv_path /= "fbtenv.sh"
+        # Counts its runs, like toolchain probe it should only run once
+        self.fbtenv_path.write_text(
+            f'echo run >> "{self.state_dir}/runs"\n'
+            f'PATH="{Path(sys.executable).parent}:$PATH"\n'
+            "export FBT_TOOLCHAIN_VERSION=1\n"
+        )
+        env = patch.dict(os.environ, {"FBT_TOOLCHAIN_PATH": tmpdir.name})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def _probe_count(self):
+        return (self.state_dir / "runs").read_text().count("run")
+
+    def test_env_is_cached(self):
+        toolchain_env = get_toolchain_env(str(self.state_dir))
+        self.assertEqual(toolchain_env["env"]["FBT_TOOLCHAIN_VERSION"], "1")
+        self.assertTrue(os.path.exists(toolchain_env["python"]))
+        self.assertEqual(get_toolchain_env(str(self.state_dir)), toolchain_env)
+        self.assertEqual(self._probe_count(), 1)
+
+    def test_invalidation(self):
+        get_toolchain_env(str(self.state_dir))
+        self.fbtenv_path.write_text(
+            self.fbtenv_path.read_text().replace("VERSION=1", "VERSION=2")
+        )
+        toolchain_env = get_toolchain_env(str(self.state_dir))
+        self.assertEqual(toolchain_env["env"]["FBT_TOOLCHAIN_VERSION"], "2")
+
+        (self.state_dir / "toolchain" / "x86_64-linux").mkdir(parents=True)
+        get_toolchain_env(str(self.state_dir))
+        with patch.dict(os.environ, {"UFBT_TEST_VAR": "1"}):
+            toolchain_env = get_toolchain_env(str(self.state_dir))
+        self.assertEqual(toolchain_env["env"]["UFBT_TEST_VAR"], "1")
+        self.assertEqual(self._probe_count(), 4)
+
+    def test_failed_fbtenv(self):
+        self.fbtenv_path.write_text("false\n")
+        self.assertIsNone(get_toolchain_env(str(self.state_dir)))
+
+
+@unittest.skipIf(sys.platform == "win32", "Build daemon is POSIX only")
+@unittest.skipUnless(
+    importlib.util.find_spec("SCons"), "SCons is not installed for this interpreter"
+)
+class TestBuildDaemon(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_dir = Path(tmpdir.name) / "home"
+        self.app_dir = Path(tmpdir.name) / "app"
+        self.app_dir.mkdir()
+        (self.app_dir / "in.txt").write_text("app")
+        make_stand_in_sdk(self.state_dir, slots=("a", "b"))
+        self.addCleanup(self._stop_daemons)
+
+    def _ufbt(self, *args):
+        env = dict(
+            os.environ,
+            UFBT_HOME=str(self.state_dir),
+            UFBT_DAEMON="1",
+        )
+        return subprocess.run(
+            ["ufbt", *args], cwd=self.app_dir, env=env, capture_output=True, text=True
+        )
+
+    def _daemon_log(self):
+        return (self.state_dir / "daemon" / "daemon.log").read_text()
+
+    def _stop_daemons(self):
+        for pid in re.findall(r"uFBT daemon (\d+) serving", self._daemon_log()):
+            try:
+                os.kill(int(pid), signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def test_warm_builds(self):
+        build = self._ufbt()
+        self.assertEqual(build.returncode, 0, build.stderr)
+        self.assertEqual((self.app_dir / "dist" / "out.txt").read_text(), "app")
+
+        build = self._ufbt()
+        self.assertEqual(build.returncode, 0, build.stderr)
+        self.assertIn("is up to date", build.stdout)
+        # SCons exit code for failed build
+        self.assertEqual(self._ufbt("fail").returncode, 2)
+        self.assertEqual(self._daemon_log().count("serving"), 1)
+
+    def test_restart_on_sdk_switch(self):
+        self.assertEqual(self._ufbt().returncode, 0)
+        (self.state_dir / "current").unlink()
+        (self.state_dir / "current").symlink_to(Path("sdk") / "b")
+
+        build = self._ufbt()
+        self.assertEqual(build.returncode, 0, build.stderr)
+        self.assertIn("SDK has changed", self._daemon_log())
+        self.assertRegex(self._daemon_log(), r"serving \S+/sdk/b on")
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("SCons"), "SCons is not installed for this interpreter"
+)
+class TestNoopBuild(unittest.TestCase):
+    SKIP_MESSAGE = "unchanged since last build"
+
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_dir = Path(tmpdir.name) / "home"
+        self.app_dir = Path(tmpdir.name) / "app"
+        (self.app_dir / "src").mkdir(parents=True)
+        (self.app_dir / "in.txt").write_text("app")
+        (self.app_dir / "src" / "app.c").write_text("int main;")
+        make_stand_in_sdk(self.state_dir, slots=("a", "b"))
+
+    def _ufbt(self, *args, **env_vars):
+        env = {
+            **os.environ,
+            "UFBT_HOME": str(self.state_dir),
+            "UFBT_NOOP_CHECK": "1",
+            **env_vars,
+        }
+        env = {name: value for name, value in env.items() if value is not None}
+        return subprocess.run(
+            ["ufbt", *args], cwd=self.app_dir, env=env, capture_output=True, text=True
+        )
+
+    def _assert_built(self, *args, skipped=False, **env_vars):
+        build = self._ufbt(*args, **env_vars)
+        self.assertEqual(build.returncode, 0, build.stderr)
+        if skipped:
+            self.assertIn(self.SKIP_MESSAGE, build.stdout)
+        else:
+            self.assertNotIn(self.SKIP_MESSAGE, build.stdout)
+
+    def test_unchanged_app(self):
+        self._assert_built()
+        self._assert_built(skipped=True)
+        # Same content, only mtime has changed
+        os.utime(self.app_dir / "src" / "app.c", ns=(0, 0))
+        self._assert_built(skipped=True)
+        self._assert_built("COMPACT=1")
+        self._assert_built("COMPACT=1", skipped=True)
+        # Not read by build scripts
+        self._assert_built("COMPACT=1", skipped=True, TERM_SESSION_ID="1")
+        self._assert_built("COMPACT=1", FBT_NO_SYNC="1")
+
+    def test_disabled_by_default(self):
+        self._assert_built()
+        self._assert_built(UFBT_NOOP_CHECK=None)
+        self._assert_built(UFBT_NOOP_CHECK="0")
+
+    def test_changed_inputs(self):
+        self._assert_built()
+        (self.app_dir / "in.txt").write_text("changed")
+        self._assert_built()
+        self.assertEqual((self.app_dir / "dist" / "out.txt").read_text(), "changed")
+
+        (self.app_dir / "src" / "new.c").touch()
+        self._assert_built()
+        (self.app_dir / ".clang-format").touch()
+        self._assert_built()
+        (self.app_dir / ".git").mkdir()
+        (self.app_dir / ".git" / "index").touch()
+        self._assert_built(skipped=True)
+        (self.app_dir / "dist" / "out.txt").unlink()
+        self._assert_built()
+        self.assertTrue((self.app_dir / "dist" / "out.txt").exists())
+
+        (self.state_dir / "current").unlink()
+        (self.state_dir / "current").symlink_to(Path("sdk") / "b")
+        self._assert_built()
+        self._assert_built(skipped=True)
+
+    def test_other_targets_always_run(self):
+        self._assert_built()
+        self.assertEqual(self._ufbt("fail").returncode, 2)
+        self._assert_built(skipped=True)
+        self._assert_built("-c")
+        self.assertFalse((self.app_dir / "dist" / "out.txt").exists())
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("SCons"), "SCons is not installed for this interpreter"
+)
+class TestArtifactCache(unittest.TestCase):
+    RESTORE_MESSAGE = "Restored build outputs"
+
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmp_dir = Path(tmpdir.name)
+        self.cache_dir = self.tmp_dir / "cache"
+        # Two workers with their own state and checkout, sharing the cache
+        for worker in ("worker1", "worker2"):
+            make_stand_in_sdk(self.tmp_dir / worker / "home", mode="channel")
+            (self.tmp_dir / worker / "app").mkdir()
+            (self.tmp_dir / worker / "app" / "in.txt").write_text("app")
+
+    def _ufbt(self, worker, *args, **env_vars):
+        env = dict(
+            os.environ,
+            UFBT_HOME=str(self.tmp_dir / worker / "home"),
+            UFBT_ARTIFACT_CACHE=str(self.cache_dir),
+            **env_vars,
+        )
+        return subprocess.run(
+            ["ufbt", *args],
+            cwd=self.tmp_dir / worker / "app",
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+
+    def _assert_built(self, worker, *args, restored=False):
+        build = self._ufbt(worker, *args)
+        self.assertEqual(build.returncode, 0, build.stderr)
+        if restored:
+            self.assertIn(self.RESTORE_MESSAGE, build.stdout)
+        else:
+            self.assertNotIn(self.RESTORE_MESSAGE, build.stdout)
+
+    def test_shared_outputs(self):
+        self._assert_built("worker1")
+        # Outputs of an older build are replaced
+        (self.tmp_dir / "worker2" / "app" / "dist").mkdir()
+        (self.tmp_dir / "worker2" / "app" / "dist" / "old.txt").write_text("old")
+        self._assert_built("worker2", restored=True)
+        self.assertEqual(
+            os.listdir(self.tmp_dir / "worker2" / "app" / "dist"), ["out.txt"]
+        )
+        self.assertEqual(
+            (self.tmp_dir / "worker2" / "app" / "dist" / "out.txt").read_text(), "app"
+        )
+        # Restored outputs are up to date for no-op check
+        self.assertIn("unchanged", self._ufbt("worker2", UFBT_NOOP_CHECK="1").stdout)
+
+        # Other build flags
+        self._assert_built("worker2", "COMPACT=1")
+        self._assert_built("worker1", "COMPACT=1", restored=True)
+
+        (self.tmp_dir / "worker2" / "app" / "in.txt").write_text("changed")
+        self._assert_built("worker2")
+        self.assertEqual(
+            ArtifactCache(str(self.cache_dir)).stats(),
+            {
+                "hits": 2,
+                "misses": 3,
+                "publishes": 3,
+                "evictions": 0,
+                "entries": 3,
+                "size": 13,
+            },
+        )
+
+    def test_other_toolchain(self):
+        for worker, version in (("worker1", "39"), ("worker2", "40")):
+            toolchain_dir = self.tmp_dir / worker / "home" / "toolchain" / "x86_64"
+            toolchain_dir.mkdir(parents=True)
+            (toolchain_dir / "VERSION").write_text(version)
+        self._assert_built("worker1")
+        self._assert_built("worker2")
+        (
+            self.tmp_dir / "worker2" / "home" / "toolchain" / "x86_64" / "VERSION"
+        ).write_text("39")
+        self._assert_built("worker2", "COMPACT=1")
+        self._assert_built("worker1", "COMPACT=1", restored=True)
+
+    def test_local_sdk_not_cached(self):
+        (self.tmp_dir / "worker1" / "home" / "current" / "ufbt_state.json").write_text(
+            json.dumps({"hw_target": "f7", "mode": "local", "version": "a"})
+        )
+        self._assert_built("worker1")
+        self.assertFalse(self.cache_dir.exists())
+
+    def test_eviction(self):
+        cache = ArtifactCache(str(self.cache_dir))
+        cache.max_size = 8
+        output_dir = self.tmp_dir / "dist"
+        output_dir.mkdir()
+        for age, key in ((30, "aa1"), (20, "bb2"), (0, "cc3")):
+            (output_dir / "app.fap").write_text(key)
+            cache.publish(key, str(output_dir))
+            used_at = time.time() - age
+            os.utime(
+                self.cache_dir / "entries" / key[:2] / key / "manifest.json",
+                (used_at, used_at),
+            )
+        self.assertFalse(cache.restore("aa1", str(output_dir)))
+        self.assertTrue(cache.restore("bb2", str(output_dir)))
+        self.assertEqual((output_dir / "app.fap").read_text(), "bb2")
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def _publish(self, cache, key):
+        output_dir = self.tmp_dir / "dist"
+        output_dir.mkdir(exist_ok=True)
+        (output_dir / "app.fap").write_text(key)
+        cache.publish(key, str(output_dir))
+        return output_dir
+
+    def test_stats_file(self):
+        cache = ArtifactCache(str(self.cache_dir))
+        output_dir = self._publish(cache, "aa1")
+        # Hits, misses and publishes do not list cache entries
+        with patch.object(ArtifactCache, "_list_entries", side_effect=AssertionError):
+            self._publish(cache, "bb2")
+            self.assertTrue(cache.restore("aa1", str(output_dir)))
+            self.assertFalse(cache.restore("cc3", str(output_dir)))
+            self.assertEqual(
+                cache.stats(),
+                {
+                    "hits": 1,
+                    "misses": 1,
+                    "publishes": 2,
+                    "evictions": 0,
+                    "entries": 2,
+                    "size": 6,
+                },
+            )
+
+    def test_invalid_size_setting(self):
+        env = {
+            "UFBT_ARTIFACT_CACHE": str(self.cache_dir),
+            "UFBT_ARTIFACT_CACHE_SIZE": "1GB",
+        }
+        with patch.dict(os.environ, env), self.assertLogs(
+            "ufbt.artifacts", logging.WARNING
+        ):
+            cache = ArtifactCache.get_default()
+        self.assertEqual(cache.max_size, ArtifactCache.MAX_SIZE_MB * 1024 * 1024)
+
+    def test_failed_restore_keeps_outputs(self):
+        cache = ArtifactCache(str(self.cache_dir))
+        output_dir = self._publish(cache, "aa1")
+        (output_dir / "app.fap").write_text("old")
+        rename = os.rename
+
+        def fail_moving_new_outputs(src, dst):
+            # Restored outputs are staged in a temporary dir next to dist
+            if str(dst) == str(output_dir) and str(src).endswith(".tmp"):
+                raise OSError("Cannot rename")
+            rename(src, dst)
+
+        with patch("ufbt.artifacts.os.rename", side_effect=fail_moving_new_outputs):
+            self.assertFalse(cache.restore("aa1", str(output_dir)))
+        self.assertEqual((output_dir / "app.fap").read_text(), "old")
+        self.assertEqual(
+            sorted(p.name for p in self.tmp_dir.iterdir()),
+            ["cache", "dist", "worker1", "worker2"],
+        )
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("SCons"), "SCons is not installed for this interpreter"
+)
+class TestBatchBuild(unittest.TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_dir = Path(tmpdir.name) / "home"
+        make_stand_in_sdk(self.state_dir)
+        self.apps_dir = Path(tmpdir.name) / "apps"
+        for app in ("app1", "app2", "app3"):
+            (self.apps_dir / app).mkdir(parents=True)
+            (self.apps_dir / app / "application.fam").touch()
+            (self.apps_dir / app / "in.txt").write_text(app)
+        # Not matched by globs
+        (self.apps_dir / "docs").mkdir()
+
+    def _batch(self, *args):
+        env = dict(os.environ, UFBT_HOME=str(self.state_dir))
+        return subprocess.run(
+            ["ufbt", "batch", "--json", *args],
+            cwd=self.apps_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+
+    def test_batch_build(self):
+        batch = self._batch("-j", "2", "*")
+        self.assertEqual(batch.returncode, 0, batch.stderr)
+        summary = json.loads(batch.stdout)
+        self.assertEqual(summary["version"], "a")
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(
+            [Path(build["app_dir"]).name for build in summary["builds"]],
+            ["app1", "app2", "app3"],
+        )
+        for build in summary["builds"]:
+            app_dir = Path(build["app_dir"])
+            self.assertEqual((app_dir / "dist" / "out.txt").read_text(), app_dir.name)
+
+    def test_failed_builds(self):
+        batch = self._batch("app1", "app[23]", "-a", "fail")
+        self.assertEqual(batch.returncode, 1)
+        summary = json.loads(batch.stdout)
+        self.assertEqual(summary["failed"], 3)
+        self.assertEqual({build["returncode"] for build in summary["builds"]}, {2})
+        self.assertIn("[fail.txt] Error 1", summary["builds"][0]["log"])
+
+
 # Test initial deployment
 class TestInitialDeployment(unittest.TestCase):
     def test_default_deployment(self):
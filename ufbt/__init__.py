@@ -18,20 +18,28 @@
 #
 
 import os
-import pathlib
-import platform
 import sys
-import oslex
 
-from .bootstrap import (
+# Build path runs on every invocation, so it does not import bootstrap and
+# package metadata - they are loaded on first use
+from .constants import (
+    BATCH_SUBCOMMAND,
+    BOOTSTRAP_SUBCOMMANDS,
     DEFAULT_UFBT_HOME,
     ENV_FILE_NAME,
-    bootstrap_cli,
-    bootstrap_subcommands,
-    get_ufbt_package_version,
 )
 
-__version__ = get_ufbt_package_version()
+
+def __getattr__(name):
+    if name == "__version__":
+        from .bootstrap import get_ufbt_package_version
+
+        return get_ufbt_package_version()
+    if name in ("bootstrap_cli", "bootstrap_subcommands", "get_ufbt_package_version"):
+        from . import bootstrap
+
+        return getattr(bootstrap, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _load_env_file(env_file):
@@ -53,6 +61,23 @@ def _load_env_file(env_file):
     return env_vars
 
 
+def _find_subcommand(args):
+    """
+    Returns first positional argument, skipping leading options and their
+    values - so `ufbt --timings update` is an update, and `ufbt APPSRC=update`
+    is a build.
+    """
+    option_value_expected = False
+    for arg in args:
+        if arg.startswith("-"):
+            option_value_expected = "=" not in arg
+        elif not option_value_expected or arg in BOOTSTRAP_SUBCOMMANDS:
+            return arg
+        else:
+            option_value_expected = False
+    return None
+
+
 def ufbt_cli():
     # load environment variables from .env file in current directory
     try:
@@ -74,19 +99,27 @@ def ufbt_cli():
         # fbtenv.sh appends /toolchain/{PLATFORM} to FBT_TOOLCHAIN_PATH
         os.environ["FBT_TOOLCHAIN_PATH"] = os.environ["UFBT_STATE_DIR"]
 
-    ufbt_state_dir = pathlib.Path(os.environ["UFBT_STATE_DIR"])
+    ufbt_state_dir = os.environ["UFBT_STATE_DIR"]
 
-    # if any of bootstrap subcommands are in the arguments - call it instead
+    subcommand = _find_subcommand(sys.argv[1:])
+    if subcommand == BATCH_SUBCOMMAND:
+        from .batch import batch_cli
+
+        return batch_cli(ufbt_state_dir, sys.argv[sys.argv.index(subcommand) + 1 :])
+
+    # bootstrap subcommands are passed to it
     # kept for compatibility with old scripts, better use `ufbt-bootstrap` directly
-    if any(map(sys.argv.__contains__, bootstrap_subcommands)):
+    if subcommand in BOOTSTRAP_SUBCOMMANDS:
+        from .bootstrap import bootstrap_cli
+
         return bootstrap_cli()
 
-    if not os.path.exists(ufbt_state_dir / "current"):
+    if not os.path.exists(os.path.join(ufbt_state_dir, "current")):
+        from .bootstrap import bootstrap_cli
+
         bootstrap_cli(["update"])
 
-    if not (
-        ufbt_script_root := ufbt_state_dir / "current" / "scripts" / "ufbt"
-    ).exists():
+    if not os.path.exists(os.path.join(ufbt_state_dir, "current", "scripts", "ufbt")):
         print("SDK is missing scripts distribution!")
         print("You might be trying to use an SDK in an outdated format.")
         print("You can clean up current state with `ufbt clean --purge`.")
@@ -95,32 +128,77 @@ def ufbt_cli():
 
     UFBT_APP_DIR = os.getcwd()
 
-    if platform.system() == "Windows":
-        commandline = r'call "%UFBT_STATE_DIR%/current/scripts/toolchain/fbtenv.cmd" env & python '
-    else:
-        commandline = (
-            '. "$UFBT_STATE_DIR/current/scripts/toolchain/fbtenv.sh" && python3 '
+    # Unchanged app is not built again, without starting the toolchain. Only
+    # app dir is fingerprinted, so this is opt-in: app manifests may refer to
+    # sources outside of it
+    from .artifacts import ArtifactCache
+    from .fbtenv import get_toolchain_id
+    from .fingerprint import OUTPUT_DIR_NAME, BuildFingerprint, get_build_env_key
+
+    noop_check = os.environ.get("UFBT_NOOP_CHECK", "0") != "0"
+    artifact_cache = ArtifactCache.get_default()
+    fingerprint = None
+    if noop_check or artifact_cache:
+        fingerprint = BuildFingerprint.create(
+            ufbt_state_dir, UFBT_APP_DIR, sys.argv[1:], get_build_env_key()
         )
-
-    commandline += oslex.join(
-        [
-            "-m",
-            "SCons",
-            "-Q",
-            "--warn=target-not-built",
-            "-C",
-            str(ufbt_script_root),
-            f"UFBT_APP_DIR={UFBT_APP_DIR}",
-            *sys.argv[1:],
-        ]
+    if noop_check and fingerprint and fingerprint.is_up_to_date():
+        print("Application and SDK are unchanged since last build, skipping")
+        return 0
+
+    # Outputs of the same sources and SDK may be built elsewhere already
+    output_dir = os.path.join(UFBT_APP_DIR, OUTPUT_DIR_NAME)
+    content_key = (
+        fingerprint.get_content_key(get_toolchain_id())
+        if artifact_cache and fingerprint
+        else None
     )
+    if content_key and artifact_cache.restore(content_key, output_dir):
+        print(f"Restored build outputs from {artifact_cache.cache_dir}")
+        fingerprint.save()
+        return 0
+
+    retcode = _run_build(ufbt_state_dir, UFBT_APP_DIR, sys.argv[1:])
+    if retcode == 0 and fingerprint:
+        fingerprint.save()
+        if content_key and fingerprint.inputs_unchanged():
+            # Toolchain may have been installed by the build
+            if content_key := fingerprint.get_content_key(get_toolchain_id()):
+                artifact_cache.publish(content_key, output_dir)
+    return retcode
+
+
+def _run_build(ufbt_state_dir, app_dir, args):
+    from .fbtenv import get_scons_args
+
+    scons_args = get_scons_args(ufbt_state_dir, app_dir, args)
+
+    if sys.platform != "win32":
+        from .fbtenv import get_toolchain_env, run_python
+
+        if not (toolchain_env := get_toolchain_env(ufbt_state_dir)):
+            print("Failed to set up toolchain environment")
+            return 1
+
+        # Opt-in: reuse a warm build process, started on first build
+        if os.environ.get("UFBT_DAEMON"):
+            from .daemon import run_in_daemon
+
+            retcode = run_in_daemon(ufbt_state_dir, app_dir, scons_args, toolchain_env)
+            if retcode is not None:
+                return retcode
+            print("Running build without daemon")
+
+        return run_python(toolchain_env, ["-m", "SCons", *scons_args])
+
+    import oslex
+
+    from .fbtenv import WINDOWS_COMMANDLINE_PREFIX
+
+    commandline = WINDOWS_COMMANDLINE_PREFIX + oslex.join(["-m", "SCons", *scons_args])
 
     # print(commandline)
-    retcode = os.system(commandline)
-    if platform.system() != "Windows":
-        # low byte is signal number, high byte is exit code
-        retcode = retcode >> 8
-    return retcode
+    return os.system(commandline)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+#
+# Build artifact cache, shared between uFBT instances and machines
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Cache dir may be on a network filesystem, used by several CI workers at
+# once. Entries are published and evicted with directory renames, which
+# are atomic, so readers see either a complete entry or none. Layout:
+#   entries/<key[:2]>/<key>/manifest.json - file list, sizes
+#   entries/<key[:2]>/<key>/files/...     - contents of dist dir
+#   tmp/                                  - entries being written or removed
+#   stats.json                            - hit/miss counters, entry count
+#                                           and total size
+# Used on build path, so this module only imports from the standard library.
+
+import json
+import logging
+import os
+import shutil
+import uuid
+
+from .filelock import FileLock
+
+log = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    MANIFEST_FILE_NAME = "manifest.json"
+    STATS_FILE_NAME = "stats.json"
+    STATS_LOCK_FILE_NAME = "stats.lock"
+    MAX_SIZE_MB = 1024
+    COUNTERS = ("hits", "misses", "publishes", "evictions")
+    TOTALS = ("entries", "size")
+
+    def __init__(self, cache_dir: str, max_size_mb: int = None):
+        self.cache_dir = cache_dir
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+        self.max_size = (max_size_mb or self.MAX_SIZE_MB) * 1024 * 1024
+
+    @classmethod
+    def get_default(cls):
+        """Returns cache configured by UFBT_ARTIFACT_CACHE, if any"""
+        if not (cache_dir := os.environ.get("UFBT_ARTIFACT_CACHE")):
+            return None
+        max_size_mb = os.environ.get("UFBT_ARTIFACT_CACHE_SIZE", cls.MAX_SIZE_MB)
+        try:
+            max_size_mb = int(max_size_mb)
+        except ValueError:
+            log.warning(
+                f"Invalid UFBT_ARTIFACT_CACHE_SIZE {max_size_mb!r}, "
+                f"using {cls.MAX_SIZE_MB} MB"
+            )
+            max_size_mb = cls.MAX_SIZE_MB
+        return cls(os.path.abspath(cache_dir), max_size_mb)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.entries_dir, key[:2], key)
+
+    def _make_tmp_dir(self) -> str:
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    @staticmethod
+    def _copy_tree_files(src_dir: str, dst_dir: str, rel_paths) -> None:
+        # Each file is replaced atomically, so build outputs are never partial
+        for rel_path in rel_paths:
+            dst_path = os.path.join(dst_dir, rel_path)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            tmp_path = f"{dst_path}.{uuid.uuid4().hex[:8]}.tmp"
+            shutil.copyfile(os.path.join(src_dir, rel_path), tmp_path)
+            os.replace(tmp_path, dst_path)
+
+    @staticmethod
+    def _replace_dir(src_dir: str, dst_dir: str) -> None:
+        # Renames are atomic, so dst_dir has either all old or all new files.
+        # Old files are put back if new ones cannot be moved into place
+        old_dir = f"{src_dir}.old"
+        try:
+            os.rename(dst_dir, old_dir)
+        except FileNotFoundError:
+            old_dir = None
+        try:
+            os.rename(src_dir, dst_dir)
+        except OSError:
+            if old_dir:
+                os.rename(old_dir, dst_dir)
+            raise
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def restore(self, key: str, output_dir: str) -> bool:
+        """
+        Replaces contents of output_dir with cached outputs for key.
+        Returns True on hit
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, self.MANIFEST_FILE_NAME)
+        # Next to output_dir, so it can be renamed into place
+        tmp_output_dir = os.path.join(
+            os.path.dirname(output_dir), f".{uuid.uuid4().hex}.tmp"
+        )
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self._copy_tree_files(
+                os.path.join(entry_dir, "files"), tmp_output_dir, manifest["files"]
+            )
+            # Last use time, for eviction
+            os.utime(manifest_path)
+            self._replace_dir(tmp_output_dir, output_dir)
+        except (OSError, ValueError):
+            # Missing, or evicted while being read
+            shutil.rmtree(tmp_output_dir, ignore_errors=True)
+            self._update_stats(misses=1)
+            return False
+        self._update_stats(hits=1)
+        return True
+
+    def publish(self, key: str, output_dir: str) -> None:
+        """Adds files in output_dir as outputs for key"""
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        files = {}
+        for dir_path, _, file_names in os.walk(output_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                rel_path = os.path.relpath(file_path, output_dir)
+                files[rel_path.replace(os.sep, "/")] = os.path.getsize(file_path)
+        if not files:
+            return
+
+        tmp_entry_dir = self._make_tmp_dir()
+        try:
+            self._copy_tree_files(
+                output_dir, os.path.join(tmp_entry_dir, "files"), files
+            )
+            with open(os.path.join(tmp_entry_dir, self.MANIFEST_FILE_NAME), "w") as f:
+                json.dump({"files": files, "size": sum(files.values())}, f)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            try:
+                os.rename(tmp_entry_dir, entry_dir)
+            except OSError:
+                # Published concurrently by another build
+                return
+        finally:
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+        stats = self._update_stats(publishes=1, entries=1, size=sum(files.values()))
+        if not stats or stats["size"] > self.max_size:
+            self.evict()
+
+    def _list_entries(self):
+        # Returns [(last use time, size, entry dir)]
+        entries = []
+        if not os.path.isdir(self.entries_dir):
+            return entries
+        for prefix in os.listdir(self.entries_dir):
+            prefix_dir = os.path.join(self.entries_dir, prefix)
+            for key in os.listdir(prefix_dir):
+                manifest_path = os.path.join(prefix_dir, key, self.MANIFEST_FILE_NAME)
+                try:
+                    with open(manifest_path) as f:
+                        size = json.load(f)["size"]
+                    used_at = os.stat(manifest_path).st_mtime
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((used_at, size, os.path.join(prefix_dir, key)))
+        return entries
+
+    def evict(self) -> None:
+        """Removes least recently used entries over size limit"""
+        entries = sorted(self._list_entries())
+        total_size = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry_dir in entries:
+            if total_size <= self.max_size:
+                break
+            tmp_entry_dir = self._make_tmp_dir()
+            try:
+                # Entry disappears at once for readers
+                os.rename(entry_dir, tmp_entry_dir)
+            except OSError:
+                # Evicted by another build
+                continue
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+            total_size -= size
+            evicted += 1
+        # Totals are recounted, as entries may be evicted by other builds
+        self._update_stats(
+            totals={"entries": len(entries) - evicted, "size": total_size},
+            evictions=evicted,
+        )
+
+    def _update_stats(self, totals: dict = None, **increments):
+        """
+        Adds increments to counters and totals in stats file, and returns
+        them, or None if stats file cannot be used. File is small and is
+        updated in place under lock, so entries are not listed on each build
+        """
+        try:
+            with FileLock(
+                os.path.join(self.cache_dir, self.STATS_LOCK_FILE_NAME), quiet=True
+            ):
+                fd = os.open(
+                    os.path.join(self.cache_dir, self.STATS_FILE_NAME),
+                    os.O_RDWR | os.O_CREAT,
+                )
+                with open(fd, "r+") as f:
+                    try:
+                        saved_stats = json.load(f)
+                    except ValueError:
+                        saved_stats = {}
+                    stats = {
+                        name: saved_stats.get(name, 0)
+                        for name in self.COUNTERS + self.TOTALS
+                    }
+                    for name, increment in increments.items():
+                        stats[name] += increment
+                    if not all(name in saved_stats for name in self.TOTALS):
+                        # New cache, or stats written by older versions
+                        entries = self._list_entries()
+                        stats["entries"] = len(entries)
+                        stats["size"] = sum(size for _, size, _ in entries)
+                    stats.update(totals or {})
+                    if stats != saved_stats:
+                        f.seek(0)
+                        f.truncate()
+                        json.dump(stats, f)
+                return stats
+        except OSError:
+            # Stats are informational only
+            return None
+
+    def stats(self) -> dict:
+        stats = self._update_stats() if os.path.isdir(self.cache_dir) else None
+        return stats or {name: 0 for name in self.COUNTERS + self.TOTALS}
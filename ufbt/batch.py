@@ -0,0 +1,203 @@
+#
+# Parallel builds of multiple applications
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# All builds of a batch share the SDK and the toolchain environment, which
+# are resolved once, and run in parallel in a thread pool.
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from .constants import BATCH_SUBCOMMAND
+from .fbtenv import (
+    WINDOWS_COMMANDLINE_PREFIX,
+    get_scons_args,
+    get_toolchain_env,
+    run_python,
+)
+
+log = logging.getLogger(__name__)
+
+APP_MANIFEST_FILE_NAME = "application.fam"
+
+
+def _find_app_dirs(patterns: List[str]) -> List[str]:
+    app_dirs = {}
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(
+                path
+                for path in glob.glob(pattern, recursive=True)
+                if os.path.isfile(os.path.join(path, APP_MANIFEST_FILE_NAME))
+            )
+        elif os.path.isdir(pattern):
+            matches = [pattern]
+        else:
+            raise ValueError(f"Application directory {pattern} does not exist")
+        for path in matches:
+            app_dirs.setdefault(os.path.realpath(path), None)
+    return list(app_dirs)
+
+
+def _build(state_dir: str, app_dir: str, build_args: List[str], toolchain_env):
+    scons_args = get_scons_args(state_dir, app_dir, build_args)
+    start_time = time.monotonic()
+    with tempfile.TemporaryFile() as output:
+        if toolchain_env:
+            returncode = run_python(
+                toolchain_env, ["-m", "SCons", *scons_args], app_dir, output
+            )
+        else:
+            import subprocess
+
+            import oslex
+
+            returncode = subprocess.run(
+                WINDOWS_COMMANDLINE_PREFIX + oslex.join(["-m", "SCons", *scons_args]),
+                shell=True,
+                cwd=app_dir,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            ).returncode
+        output.seek(0)
+        build_log = output.read().decode(errors="replace")
+    return {
+        "app_dir": app_dir,
+        "returncode": returncode,
+        "duration": round(time.monotonic() - start_time, 3),
+        "log": build_log,
+    }
+
+
+def _get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog=f"ufbt {BATCH_SUBCOMMAND}",
+        description="""Build applications in given directories with current SDK,
+        running several builds at once. Glob patterns match directories with
+        application manifests. Prints a summary with exit code, duration and
+        output of each build.""",
+    )
+    parser.add_argument(
+        "app_dirs",
+        help="Application directory or glob pattern",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--arg",
+        "-a",
+        help="Build argument, like target name or KEY=value, can be repeated",
+        action="append",
+        default=[],
+        dest="build_args",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Maximum number of concurrent builds",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--json",
+        help="Print summary in JSON format",
+        action="store_true",
+        default=False,
+    )
+    return parser
+
+
+def batch_cli(state_dir: str, cmdline_args=None) -> int:
+    logging.basicConfig(
+        format="%(asctime)s.%(msecs)03d [%(levelname).1s] %(message)s",
+        level=logging.INFO,
+        datefmt="%H:%M:%S",
+    )
+    args = _get_parser().parse_args(cmdline_args)
+
+    try:
+        app_dirs = _find_app_dirs(args.app_dirs)
+    except ValueError as e:
+        log.error(e)
+        return 1
+    if not app_dirs:
+        log.error("No application directories found")
+        return 1
+
+    # SDK and toolchain environment are resolved once for all builds
+    from .bootstrap import BaseSdkLoader, UfbtSdkDeployer, bootstrap_cli
+
+    sdk_deployer = UfbtSdkDeployer(state_dir)
+    if not (task := sdk_deployer.get_previous_task()):
+        bootstrap_cli(["update"])
+        if not (task := sdk_deployer.get_previous_task()):
+            return 1
+    toolchain_env = None
+    if sys.platform != "win32":
+        if not (toolchain_env := get_toolchain_env(state_dir)):
+            log.error("Failed to set up toolchain environment")
+            return 1
+
+    # Cores are split between concurrent builds, unless set explicitly
+    jobs = max(1, min(args.jobs, len(app_dirs)))
+    build_args = args.build_args
+    if not any(re.match(r"-j\d*$|--jobs", arg) for arg in build_args):
+        build_args = [f"-j{max(1, (os.cpu_count() or 1) // jobs)}", *build_args]
+
+    log.info(f"Building {len(app_dirs)} applications, {jobs} at a time")
+    start_time = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(_build, state_dir, app_dir, build_args, toolchain_env)
+            for app_dir in app_dirs
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = "OK" if result["returncode"] == 0 else "FAILED"
+            log.info(f"{status:<6} {result['app_dir']} ({result['duration']}s)")
+    results.sort(key=lambda result: app_dirs.index(result["app_dir"]))
+
+    failed = [result for result in results if result["returncode"] != 0]
+    summary = {
+        "target": task.hw_target,
+        "version": task.all_params.get("version", BaseSdkLoader.VERSION_UNKNOWN),
+        "jobs": jobs,
+        "duration": round(time.monotonic() - start_time, 3),
+        "failed": len(failed),
+        "builds": results,
+    }
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for result in failed:
+            log.error(f"Build of {result['app_dir']} failed:\n{result['log']}")
+        log.info(
+            f"{len(results) - len(failed)} of {len(results)} applications built "
+            f"in {summary['duration']}s"
+        )
+    return 1 if failed else 0
@@ -18,39 +18,215 @@
 #
 
 import argparse
+import codecs
+import contextlib
 import enum
+import glob
+import hashlib
+import http.client
+import io
 import json
 import logging
 import os
 import platform
 import re
 import shutil
+import stat
 import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from html.parser import HTMLParser
-from importlib.metadata import version
 from pathlib import Path, PurePosixPath
-from typing import ClassVar, Dict, Optional
-from urllib.parse import unquote, urlparse
-from urllib.request import Request, urlopen
+from typing import Callable, ClassVar, Dict, Iterator, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import Request, getproxies, proxy_bypass, urlopen
 from zipfile import ZipFile
 
+from .constants import (
+    BOOTSTRAP_SUBCOMMANDS,
+    DEFAULT_UFBT_HOME,
+    ENV_FILE_NAME,
+    STATE_DIR_TOOLCHAIN_SUBDIR,
+)
+from .filelock import FileLock as BaseFileLock
+
 ##############################################################################
 
 log = logging.getLogger(__name__)
-DEFAULT_UFBT_HOME = os.path.expanduser("~/.ufbt")
-ENV_FILE_NAME = ".env"
-STATE_DIR_TOOLCHAIN_SUBDIR = "toolchain"
 
 
 def get_ufbt_package_version():
     try:
+        # Package metadata is slow to import and only needed here
+        from importlib.metadata import version
+
         return version("ufbt")
     except Exception as e:
         log.debug(f"Failed to get ufbt version: {e}")
         return "unknown"
 
 
+def zip_member_path(target_dir: str, member_name: str) -> str:
+    # Path of zip member in target_dir, sanitized like ZipFile.extract does
+    parts = [
+        p for p in PurePosixPath(member_name).parts if p not in ("", ".", "..", "/")
+    ]
+    return os.path.join(target_dir, *parts)
+
+
+def file_sha256(file_path: str, chunk_size: int = 256 * 1024):
+    # Returns sha256 hasher fed with file data
+    hasher = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as in_file:
+        while read_size := in_file.readinto(buffer):
+            hasher.update(view[:read_size])
+    return hasher
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def link_or_copy_file(src_path: str, dst_path: str) -> None:
+    # Hardlinks keep inode and mtime of unchanged files, and take no space.
+    # Only used for files never modified in place: archives and read-only
+    # SDK files. Files on another filesystem are cloned or copied
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        clone_or_copy_file(src_path, dst_path)
+
+
+# Linux ioctl cloning file data on copy-on-write filesystems
+FICLONE = 0x40049409
+_reflink_supported = platform.system() == "Linux"
+
+
+def clone_or_copy_file(src_path: str, dst_path: str) -> None:
+    """
+    Copies file with its mode and mtime. Reflinks only share data blocks
+    until written to, and are used when supported.
+    """
+    global _reflink_supported
+    if _reflink_supported:
+        import fcntl
+
+        try:
+            with open(src_path, "rb") as src_file, open(dst_path, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            shutil.copystat(src_path, dst_path)
+            return
+        except OSError as e:
+            log.debug(f"Reflinks are not supported, copying files: {e}")
+            _reflink_supported = False
+    shutil.copy2(src_path, dst_path)
+
+
+# SDK files are shared between SDK trees and store, and are never written to
+READ_ONLY_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def remove_file(file_path) -> None:
+    # Windows does not allow removing read-only files
+    try:
+        os.unlink(file_path)
+    except PermissionError:
+        os.chmod(file_path, stat.S_IWRITE)
+        os.unlink(file_path)
+
+
+def replace_file(src_path, dst_path) -> None:
+    try:
+        os.replace(src_path, dst_path)
+    except PermissionError:
+        os.chmod(dst_path, stat.S_IWRITE)
+        os.replace(src_path, dst_path)
+
+
+def remove_tree(dir_path) -> None:
+    # Like shutil.rmtree with ignore_errors, also removing read-only files
+    def on_error(func, failed_path, _) -> None:
+        with contextlib.suppress(OSError):
+            os.chmod(failed_path, stat.S_IWRITE)
+            func(failed_path)
+
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(dir_path, onexc=on_error)
+    else:
+        shutil.rmtree(dir_path, onerror=on_error)
+
+
+def map_zip_members(zip_path: str, members: list, func, workers: int = 0) -> None:
+    """
+    Calls func(zip_file, member) for each of zip archive members using
+    a pool of threads. Members are processed largest first, each worker
+    reading through its own ZipFile handle.
+    """
+    workers = workers or min(os.cpu_count() or 1, 8)
+    # Sorted by size, largest members are popped from the end first
+    pending_members = sorted(members, key=lambda member: member.file_size)
+    members_lock = threading.Lock()
+
+    def member_worker() -> None:
+        with ZipFile(zip_path, "r") as zip_file:
+            while True:
+                with members_lock:
+                    if not pending_members:
+                        return
+                    member = pending_members.pop()
+                func(zip_file, member)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(member_worker) for _ in range(workers)]:
+            future.result()
+
+
+def extract_zip(
+    zip_path: str,
+    target_dir: str,
+    workers: int = 0,
+    member_names: Optional[List[str]] = None,
+) -> None:
+    """
+    Extracts zip archive, or only given members of it, into target_dir
+    using a pool of threads. Produces the same result as ZipFile.extractall.
+    Directories are created up front, files are extracted by map_zip_members.
+    """
+    workers = workers or min(os.cpu_count() or 1, 8)
+    with ZipFile(zip_path, "r") as zip_file:
+        members = zip_file.infolist()
+        if member_names is not None:
+            member_names = set(member_names)
+            members = [m for m in members if m.filename in member_names]
+        if workers == 1:
+            zip_file.extractall(target_dir, members)
+            return
+
+    for member in members:
+        member_path = zip_member_path(target_dir, member.filename)
+        if not member.is_dir():
+            member_path = os.path.dirname(member_path)
+        os.makedirs(member_path, exist_ok=True)
+
+    map_zip_members(
+        zip_path,
+        [member for member in members if not member.is_dir()],
+        lambda zip_file, member: zip_file.extract(member, target_dir),
+        workers,
+    )
+
+
 class FileType(enum.Enum):
     SDK_ZIP = "sdk_zip"
     LIB_ZIP = "lib_zip"
@@ -68,6 +244,954 @@ class FileType(enum.Enum):
     UPDATER_JSON = "updater_json"
 
 
+class DownloadProgress:
+    """
+    Reports download progress to the log in fixed percentage steps.
+    When total size is unknown, reports every REPORT_STEP_UNKNOWN_SIZE bytes.
+    """
+
+    REPORT_STEP_PERCENT = 10
+    REPORT_STEP_UNKNOWN_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, name: str, total_size: int = 0, downloaded: int = 0):
+        self.name = name
+        self.total_size = total_size
+        self.downloaded = downloaded
+        self._next_report = self._report_step()
+        while self._next_report <= self.downloaded:
+            self._next_report += self._report_step()
+        self._lock = threading.Lock()
+        self._span = Timings.current_span()
+
+    def _report_step(self) -> int:
+        if self.total_size:
+            return self.total_size * self.REPORT_STEP_PERCENT // 100 or 1
+        return self.REPORT_STEP_UNKNOWN_SIZE
+
+    def update(self, size: int) -> None:
+        if self._span:
+            self._span.add_bytes(size)
+        with self._lock:
+            self.downloaded += size
+            if self.downloaded < self._next_report:
+                return
+            while self._next_report <= self.downloaded:
+                self._next_report += self._report_step()
+        if self.total_size:
+            percent = 100 * self.downloaded // self.total_size
+            log.info(
+                f"{self.name}: {percent}% ({self.downloaded}/{self.total_size} bytes)"
+            )
+        else:
+            log.info(f"{self.name}: {self.downloaded} bytes")
+
+    def finish(self) -> None:
+        log.debug(f"{self.name}: downloaded {self.downloaded} bytes")
+
+
+class Timings:
+    """
+    Records durations of bootstrap phases as spans, nested per thread.
+    Spans of transfers also count bytes and report throughput.
+    When enabled, spans are written on exit as a JSON line to stderr,
+    or appended to OUTPUT_FILE.
+    """
+
+    ENABLED = False
+    OUTPUT_FILE = None
+
+    class Span:
+        def __init__(self, name: str, attrs: dict):
+            self.name = name
+            self.attrs = attrs
+            self.parent = None
+            self.started_at = None
+            self.duration = None
+            self.bytes = None
+            self._lock = threading.Lock()
+
+        def __enter__(self) -> "Timings.Span":
+            stack = Timings._get_stack()
+            self.parent = stack[-1] if stack else None
+            stack.append(self)
+            with Timings._lock:
+                Timings._spans.append(self)
+            self.started_at = time.perf_counter()
+            return self
+
+        def __exit__(self, exc_type, *args) -> None:
+            self.duration = time.perf_counter() - self.started_at
+            if exc_type:
+                self.attrs["error"] = exc_type.__name__
+            Timings._get_stack().remove(self)
+
+        def set(self, **attrs) -> None:
+            self.attrs.update(attrs)
+
+        def add_bytes(self, size: int) -> None:
+            # Called from download threads
+            with self._lock:
+                self.bytes = (self.bytes or 0) + size
+
+    _spans: ClassVar[List[Span]] = []
+    _lock = threading.Lock()
+    _local = threading.local()
+    _started_at = time.perf_counter()
+
+    @classmethod
+    def _get_stack(cls) -> List[Span]:
+        if not hasattr(cls._local, "stack"):
+            cls._local.stack = []
+        return cls._local.stack
+
+    @classmethod
+    def span(cls, name: str, **attrs) -> Span:
+        return cls.Span(name, attrs)
+
+    @classmethod
+    def current_span(cls) -> Optional[Span]:
+        stack = cls._get_stack()
+        return stack[-1] if stack else None
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._spans = []
+        cls._started_at = time.perf_counter()
+
+    @classmethod
+    def to_dict(cls) -> dict:
+        span_ids = {id(span): index for index, span in enumerate(cls._spans)}
+        spans = []
+        for span in cls._spans:
+            span_data = {
+                "name": span.name,
+                "parent": span_ids.get(id(span.parent)),
+                "start_ms": round((span.started_at - cls._started_at) * 1000, 3),
+                "duration_ms": (
+                    round(span.duration * 1000, 3)
+                    if span.duration is not None
+                    else None
+                ),
+                **span.attrs,
+            }
+            if span.bytes is not None:
+                span_data["bytes"] = span.bytes
+                if span.duration:
+                    span_data["throughput_bps"] = round(span.bytes / span.duration)
+            spans.append(span_data)
+        return {
+            "duration_ms": round((time.perf_counter() - cls._started_at) * 1000, 3),
+            "spans": spans,
+        }
+
+    @classmethod
+    def emit(cls, **fields) -> None:
+        if not cls.ENABLED:
+            return
+        report = json.dumps({"time": time.time(), **fields, **cls.to_dict()})
+        if not cls.OUTPUT_FILE:
+            print(report, file=sys.stderr)
+            return
+        try:
+            with open(cls.OUTPUT_FILE, "a") as f:
+                f.write(report + "\n")
+        except OSError as e:
+            log.warning(f"Failed to write timings to {cls.OUTPUT_FILE}: {e}")
+
+
+class SdkStore:
+    """
+    Content-addressed store of SDK files, in default uFBT home, and shared
+    between all state dirs using the same store dir.
+    Extracted files are kept once, named by sha256 of their content. They are
+    read-only, and SDK trees are built from them with hardlinks, so files are
+    not written again nor take space twice. SDK trees on another filesystem
+    get reflinks or copies. Downloaded archives are kept along with manifests
+    of their files, so an archive already used by another state dir is
+    neither downloaded nor extracted again.
+    Objects are written to a temporary file and renamed into place, so
+    concurrent writers do not need locking.
+    Archives are hardlinked from download caches, so an archive with a single
+    link is no longer used. Garbage collection removes such archives, objects
+    not referenced by remaining archives nor linked from SDK trees, and least
+    recently used archives over MAX_SIZE_MB. Entries used within
+    GC_GRACE_SECONDS are always kept, as they may not be referenced yet.
+    """
+
+    # Set by CLI, to "store" subdir of default uFBT home. Empty disables store
+    STORE_DIR = ""
+    STORE_SUBDIR = "store"
+    MAX_SIZE_MB = 2048
+    GC_GRACE_SECONDS = 3600
+    GC_LOCK_FILE_NAME = ".gc.lock"
+    COPY_CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        self.objects_dir = self.store_dir / "objects"
+        self.archives_dir = self.store_dir / "archives"
+        self.sources_dir = self.store_dir / "sources"
+        self.tmp_dir = self.store_dir / "tmp"
+
+    @classmethod
+    def get_default(cls) -> Optional["SdkStore"]:
+        return cls(cls.STORE_DIR) if cls.STORE_DIR else None
+
+    def object_path(self, sha256: str) -> Path:
+        return self.objects_dir / sha256[:2] / sha256
+
+    def archive_path(self, sha256: str) -> Path:
+        return self.archives_dir / f"{sha256}.zip"
+
+    def _source_path(self, url: str, validator: Optional[str]) -> Path:
+        return self.sources_dir / f"{DownloadCache.make_key(url, validator)}.json"
+
+    def _make_tmp_path(self) -> Path:
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        return self.tmp_dir / uuid.uuid4().hex
+
+    @staticmethod
+    def _publish(tmp_path: Path, path: Path, replace: bool = False) -> None:
+        # Objects are immutable, if another process has already stored
+        # the same content, it is kept
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists() and not replace:
+            remove_file(tmp_path)
+        else:
+            replace_file(tmp_path, path)
+
+    @staticmethod
+    def _read_json(path: Path) -> Optional[dict]:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path: Path, data: dict) -> None:
+        tmp_path = self._make_tmp_path()
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def add_archive(
+        self,
+        file_path: str,
+        sha256: str,
+        url: str,
+        validator: Optional[str],
+        file_name: str,
+        etag: Optional[str] = None,
+    ) -> None:
+        # Records downloaded archive, keyed by URL and validator like
+        # download cache entries. Latest ETag of URL is recorded too,
+        # so other state dirs can revalidate it
+        if not self.archive_path(sha256).exists():
+            tmp_path = self._make_tmp_path()
+            link_or_copy_file(file_path, tmp_path)
+            self._publish(tmp_path, self.archive_path(sha256))
+        source = {"url": url, "file": file_name, "etag": etag, "sha256": sha256}
+        self._write_json(self._source_path(url, validator), source)
+        if etag:
+            self._write_json(self._source_path(url, None), source)
+
+    def release_archive(self, sha256: str) -> None:
+        # Removes archive when its last download cache link is removed,
+        # so evicting it from cache frees disk space
+        archive_path = self.archive_path(sha256)
+        with contextlib.suppress(FileNotFoundError):
+            if os.stat(archive_path).st_nlink == 1:
+                os.unlink(archive_path)
+
+    def find_archive(self, url: str, validator: Optional[str]) -> Optional[dict]:
+        # Returns source record of stored archive
+        source = self._read_json(self._source_path(url, validator))
+        if not source or not self.archive_path(source["sha256"]).is_file():
+            return None
+        return source
+
+    def get_archive_manifest(self, sha256: str) -> Optional[dict]:
+        manifest_path = self.archives_dir / f"{sha256}.json"
+        manifest = self._read_json(manifest_path)
+        if not manifest or not all(
+            self.object_path(entry["sha256"]).is_file()
+            for entry in manifest["files"].values()
+        ):
+            return None
+        # Last use time, for garbage collection
+        os.utime(manifest_path)
+        return manifest
+
+    def import_archive(self, zip_path: str, sha256: str, replace: bool = False) -> dict:
+        # Stores files of zip archive, returns manifest with their
+        # size, CRC32 and sha256, and a list of directories. Objects
+        # are replaced on request, in case they were modified through
+        # SDK trees despite being read-only
+        with ZipFile(zip_path, "r") as zip_file:
+            members = zip_file.infolist()
+        files = {}
+
+        def import_member(zip_file: ZipFile, member) -> None:
+            hasher = hashlib.sha256()
+            tmp_path = self._make_tmp_path()
+            with zip_file.open(member) as src_file, open(tmp_path, "wb") as dst_file:
+                while chunk := src_file.read(self.COPY_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    dst_file.write(chunk)
+            digest = hasher.hexdigest()
+            os.chmod(tmp_path, READ_ONLY_MODE)
+            self._publish(tmp_path, self.object_path(digest), replace)
+            files[member.filename] = {
+                "size": member.file_size,
+                "crc": member.CRC,
+                "sha256": digest,
+            }
+
+        map_zip_members(zip_path, [m for m in members if not m.is_dir()], import_member)
+        manifest = {
+            "files": files,
+            "dirs": [member.filename for member in members if member.is_dir()],
+        }
+        self._write_json(self.archives_dir / f"{sha256}.json", manifest)
+        return manifest
+
+    def materialize(self, sha256: str, dst_path: str) -> None:
+        link_or_copy_file(self.object_path(sha256), dst_path)
+
+    def _list_objects(self) -> Dict[str, os.stat_result]:
+        objects = {}
+        if self.objects_dir.is_dir():
+            for prefix_dir in self.objects_dir.iterdir():
+                for object_path in prefix_dir.iterdir():
+                    # May be removed concurrently
+                    with contextlib.suppress(FileNotFoundError):
+                        objects[object_path.name] = object_path.stat()
+        return objects
+
+    def _list_archives(self) -> Dict[str, dict]:
+        # Returns {sha256: archive info} for archives and their manifests
+        archives = {}
+        if not self.archives_dir.is_dir():
+            return archives
+        for file_path in self.archives_dir.iterdir():
+            if file_path.suffix not in (".zip", ".json"):
+                continue
+            try:
+                file_stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            archive = archives.setdefault(
+                file_path.stem, {"size": 0, "links": 0, "used_at": 0, "objects": []}
+            )
+            archive["used_at"] = max(archive["used_at"], file_stat.st_mtime)
+            if file_path.suffix == ".zip":
+                archive["size"] = file_stat.st_size
+                archive["links"] = file_stat.st_nlink
+            elif manifest := self._read_json(file_path):
+                archive["objects"] = [
+                    entry["sha256"] for entry in manifest["files"].values()
+                ]
+        return archives
+
+    def collect_garbage(self, live_objects=()) -> None:
+        """
+        Removes unused archives and objects, keeping live_objects - ones
+        used by SDK slots of the calling state dir - if possible. Objects
+        linked from SDK trees of any state dir are always kept, as they take
+        no extra space.
+        """
+        with FileLock(self.store_dir / self.GC_LOCK_FILE_NAME, quiet=True):
+            self._collect_garbage(set(live_objects))
+
+    def _collect_garbage(self, live_objects: set) -> None:
+        recent_time = time.time() - self.GC_GRACE_SECONDS
+        objects = self._list_objects()
+        archives = self._list_archives()
+        live_objects |= {
+            sha256
+            for sha256, object_stat in objects.items()
+            if object_stat.st_nlink > 1
+        }
+
+        # Most recently used archives are kept first, up to size limit
+        kept_objects = set()
+        kept_size = sum(
+            objects[sha256].st_size for sha256 in live_objects & set(objects)
+        )
+        removed_archives = []
+        for sha256, archive in sorted(
+            archives.items(), key=lambda item: item[1]["used_at"], reverse=True
+        ):
+            new_objects = set(archive["objects"]) - kept_objects - live_objects
+            size = archive["size"] + sum(
+                objects[object_sha256].st_size
+                for object_sha256 in new_objects
+                if object_sha256 in objects
+            )
+            if archive["used_at"] < recent_time and (
+                archive["links"] <= 1
+                or kept_size + size > self.MAX_SIZE_MB * 1024 * 1024
+            ):
+                removed_archives.append(sha256)
+                continue
+            kept_objects |= new_objects
+            kept_size += size
+
+        removed_size = 0
+        for sha256 in removed_archives:
+            removed_size += archives[sha256]["size"]
+            for suffix in (".zip", ".json"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.archives_dir / f"{sha256}{suffix}")
+        for sha256, object_stat in objects.items():
+            if (
+                sha256 not in kept_objects
+                and sha256 not in live_objects
+                and object_stat.st_mtime < recent_time
+            ):
+                removed_size += object_stat.st_size
+                with contextlib.suppress(FileNotFoundError):
+                    remove_file(self.object_path(sha256))
+
+        # Sources of removed archives, and leftovers of interrupted writes
+        if self.sources_dir.is_dir():
+            for source_path in self.sources_dir.iterdir():
+                source = self._read_json(source_path)
+                if not source or not self.archive_path(source["sha256"]).exists():
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(source_path)
+        if self.tmp_dir.is_dir():
+            for tmp_path in self.tmp_dir.iterdir():
+                with contextlib.suppress(OSError):
+                    if tmp_path.stat().st_mtime < recent_time:
+                        remove_file(tmp_path)
+        if removed_size:
+            log.info(
+                f"Removed {removed_size // (1024 * 1024)} MB of unused files "
+                f"from SDK store {self.store_dir}"
+            )
+
+    def stats(self) -> Dict[str, int]:
+        objects = self._list_objects()
+        archives = self._list_archives()
+        return {
+            "archives": sum(1 for archive in archives.values() if archive["size"]),
+            "files": len(objects),
+            "size": sum(archive["size"] for archive in archives.values())
+            + sum(object_stat.st_size for object_stat in objects.values()),
+        }
+
+
+class DownloadCache:
+    """
+    Cache of downloaded artifacts, stored in download dir.
+    Entries are keyed by URL and a validator - artifact checksum, version or ETag.
+    Entries are only added after checksum verification, so they are not
+    re-hashed on use. Index file keeps per-entry size and last use time, least recently used
+    entries are evicted when total size exceeds MAX_SIZE_MB.
+    With an SDK store, added entries are published to it, and entries missing
+    in cache are linked from archives downloaded by other state dirs.
+    Index updates are serialized with a file lock, so cache can be used by
+    concurrent threads and processes.
+    """
+
+    INDEX_FILE_NAME = "cache_index.json"
+    LOCK_FILE_NAME = ".cache_index.lock"
+    MAX_SIZE_MB = 1024
+
+    def __init__(self, cache_dir: str, sdk_store: Optional[SdkStore] = None):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, self.INDEX_FILE_NAME)
+        self.sdk_store = sdk_store
+
+    @staticmethod
+    def make_key(url: str, validator: Optional[str]) -> str:
+        return hashlib.sha256(f"{url}\n{validator or ''}".encode()).hexdigest()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("stats", {"hits": 0, "misses": 0, "evictions": 0})
+        return index
+
+    def _save_index(self, index: dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_index_path = self.index_path + ".tmp"
+        with open(tmp_index_path, "w") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_index_path, self.index_path)
+
+    def _entry_path(self, entry: dict) -> str:
+        return os.path.join(self.cache_dir, entry["file"])
+
+    def _lock(self) -> "FileLock":
+        return FileLock(Path(self.cache_dir) / self.LOCK_FILE_NAME, quiet=True)
+
+    def get(self, url: str, validator: Optional[str]) -> Optional[str]:
+        with self._lock():
+            index = self._load_index()
+            key = self.make_key(url, validator)
+            if (entry := index["entries"].get(key, None)) and not os.path.isfile(
+                self._entry_path(entry)
+            ):
+                log.debug(f"Cache entry for {url} is missing its file, dropping it")
+                del index["entries"][key]
+                self._save_index(index)
+                entry = None
+            if not entry:
+                if not (entry := self._link_from_store(url, validator, key)):
+                    return None
+                index["entries"][key] = entry
+                self._evict(index, keep_key=key)
+            entry_path = self._entry_path(entry)
+            entry["last_used"] = time.time()
+            index["stats"]["hits"] += 1
+            self._save_index(index)
+            return entry_path
+
+    def _link_from_store(
+        self, url: str, validator: Optional[str], key: str
+    ) -> Optional[dict]:
+        # Returns new entry for archive from SDK store, if it has one
+        if not self.sdk_store or not (
+            source := self.sdk_store.find_archive(url, validator)
+        ):
+            return None
+        log.debug(f"Linking {source['file']} from SDK store")
+        entry = {
+            "url": url,
+            "validator": validator,
+            "etag": source["etag"],
+            "sha256": source["sha256"],
+            "file": f"{key[:16]}-{source['file']}",
+        }
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if os.path.exists(entry_path := self._entry_path(entry)):
+            os.unlink(entry_path)
+        try:
+            link_or_copy_file(self.sdk_store.archive_path(source["sha256"]), entry_path)
+        except OSError:
+            # Removed from store concurrently
+            return None
+        entry["size"] = os.path.getsize(entry_path)
+        entry["last_used"] = time.time()
+        return entry
+
+    def find_etag(self, url: str) -> Optional[str]:
+        # Returns ETag of the most recently used entry for URL, if any
+        entries = [
+            entry
+            for entry in self._load_index()["entries"].values()
+            if entry["url"] == url
+            and entry.get("etag")
+            and os.path.isfile(self._entry_path(entry))
+        ]
+        if entries:
+            return max(entries, key=lambda entry: entry["last_used"])["etag"]
+        if self.sdk_store and (source := self.sdk_store.find_archive(url, None)):
+            return source["etag"]
+        return None
+
+    def find_sha256(self, file_path: str) -> Optional[str]:
+        # Returns sha256 of cached file, if it was recorded
+        for entry in self._load_index()["entries"].values():
+            if os.path.abspath(self._entry_path(entry)) == os.path.abspath(file_path):
+                return entry.get("sha256")
+        return None
+
+    def put(
+        self,
+        url: str,
+        validator: Optional[str],
+        src_path: str,
+        file_name: str,
+        etag: Optional[str] = None,
+        sha256: Optional[str] = None,
+    ) -> str:
+        with self._lock():
+            index = self._load_index()
+            key = self.make_key(url, validator)
+            entry = {
+                "url": url,
+                "validator": validator,
+                "etag": etag,
+                "sha256": sha256,
+                "file": f"{key[:16]}-{file_name}",
+                "size": os.path.getsize(src_path),
+                "last_used": time.time(),
+            }
+            os.replace(src_path, entry_path := self._entry_path(entry))
+            if self.sdk_store and sha256:
+                self.sdk_store.add_archive(
+                    entry_path, sha256, url, validator, file_name, etag
+                )
+            index["entries"][key] = entry
+            index["stats"]["misses"] += 1
+            self._evict(index, keep_key=key)
+            self._save_index(index)
+            return entry_path
+
+    def _evict(self, index: dict, keep_key: str) -> None:
+        max_size = self.MAX_SIZE_MB * 1024 * 1024
+        entries = index["entries"]
+        total_size = sum(entry["size"] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda e: e[1]["last_used"]):
+            if total_size <= max_size:
+                break
+            if key == keep_key:
+                continue
+            log.info(f"Evicting {entry['file']} from download cache")
+            try:
+                os.unlink(self._entry_path(entry))
+            except FileNotFoundError:
+                pass
+            if self.sdk_store and entry.get("sha256"):
+                self.sdk_store.release_archive(entry["sha256"])
+            total_size -= entry["size"]
+            del entries[key]
+            index["stats"]["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        index = self._load_index()
+        return {
+            "entries": len(index["entries"]),
+            "size": sum(entry["size"] for entry in index["entries"].values()),
+            **index["stats"],
+        }
+
+
+class IndexCache:
+    """
+    On-disk cache for index documents - channel JSON and branch HTML pages.
+    Entries younger than TTL_SECONDS are used as is, older ones are
+    revalidated with a conditional request using stored ETag/Last-Modified.
+    Bodies are stored as received, with their Content-Encoding, and only if
+    they were read to the end. Results of parsing an index for a selector,
+    like a channel or a target, are stored as decisions, valid while the
+    index is not modified.
+    Each stored response has its own id, and its body file is named after
+    it, so metadata always refers to the body it was received with.
+    Updates are made under a lock, and only to the entry they were made for.
+    """
+
+    TTL_SECONDS = 0
+    READ_CHUNK_SIZE = 64 * 1024
+    LOCK_FILE_NAME = ".lock"
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _entry_base(self, url: str) -> str:
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(url.encode()).hexdigest()[:16]
+        )
+
+    def _body_path(self, entry: dict) -> str:
+        return f"{self._entry_base(entry['url'])}.{entry['id']}.body"
+
+    def _lock(self) -> "FileLock":
+        return FileLock(Path(self.cache_dir) / self.LOCK_FILE_NAME, quiet=True)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _write_entry(self, entry: dict) -> None:
+        self._write_atomic(
+            self._entry_base(entry["url"]) + ".json",
+            json.dumps(entry, indent=4).encode(),
+        )
+
+    def get(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._entry_base(url) + ".json", "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or "id" not in entry:
+            return None
+        return entry
+
+    def has_body(self, entry: dict) -> bool:
+        return entry.get("has_body", False) and os.path.exists(self._body_path(entry))
+
+    def read_body(self, entry: dict) -> Iterator[bytes]:
+        with open(self._body_path(entry), "rb") as f:
+            while chunk := f.read(self.READ_CHUNK_SIZE):
+                yield chunk
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] < self.TTL_SECONDS
+
+    @staticmethod
+    def get_validator_headers(entry: dict) -> Dict[str, str]:
+        headers = {}
+        if etag := entry.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := entry.get("last_modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def make_tmp_body_path(self, url: str) -> str:
+        # Body is streamed to this file, then added to cache with put()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return f"{self._entry_base(url)}.{uuid.uuid4().hex[:8]}.tmp"
+
+    def put(
+        self,
+        url: str,
+        tmp_body_path: Optional[str],
+        response_headers,
+        selector: str,
+        decision: Optional[dict],
+    ) -> None:
+        """Adds a fetched index. Without tmp_body_path, only decisions are kept"""
+        entry = {
+            "url": url,
+            "id": uuid.uuid4().hex,
+            "etag": response_headers.get("ETag", None),
+            "last_modified": response_headers.get("Last-Modified", None),
+            "encoding": response_headers.get("Content-Encoding", None),
+            "fetched_at": time.time(),
+            "has_body": bool(tmp_body_path),
+            "decisions": {},
+        }
+        with self._lock():
+            # Decisions for other selectors hold for the same index version
+            previous_entry = self.get(url)
+            if (
+                previous_entry
+                and entry["etag"]
+                and previous_entry.get("etag") == entry["etag"]
+            ):
+                entry["decisions"] = previous_entry.get("decisions", {})
+            if decision is not None:
+                entry["decisions"] = {**entry["decisions"], selector: decision}
+            if tmp_body_path:
+                os.replace(tmp_body_path, self._body_path(entry))
+            self._write_entry(entry)
+            # Bodies of previous versions. Ones still being read may remain
+            # on Windows, until next update
+            entry_name = os.path.basename(self._entry_base(url))
+            for file_path in Path(self.cache_dir).glob(f"{entry_name}.*.body"):
+                if str(file_path) != self._body_path(entry):
+                    with contextlib.suppress(OSError):
+                        file_path.unlink()
+
+    def _update(self, entry: dict, **fields) -> None:
+        with self._lock():
+            current_entry = self.get(entry["url"])
+            # Replaced by a newer response meanwhile
+            if not current_entry or current_entry["id"] != entry["id"]:
+                return
+            self._write_entry({**current_entry, **fields})
+
+    def put_decision(self, entry: dict, selector: str, decision: dict) -> None:
+        self._update(
+            entry, decisions={**entry.get("decisions", {}), selector: decision}
+        )
+
+    def refresh(self, entry: dict) -> None:
+        self._update(entry, fetched_at=time.time())
+
+
+class ContentDecoder:
+    """
+    Incremental decoder of HTTP Content-Encoding. "deflate" is supposed to be
+    a zlib stream, but some servers send raw deflate data, so both are accepted.
+    """
+
+    def __init__(self, encoding: Optional[str]):
+        self.encoding = (encoding or "identity").strip().lower()
+        if self.encoding in ("gzip", "x-gzip", "deflate"):
+            # Detects zlib or gzip header
+            self._decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+        elif self.encoding == "identity":
+            self._decompressor = None
+        else:
+            raise ValueError(f"Unsupported content encoding {encoding}")
+        self._started = False
+
+    def decode(self, data: bytes) -> bytes:
+        if not self._decompressor:
+            return data
+        if self._started or self.encoding != "deflate":
+            return self._decompressor.decompress(data)
+        self._started = True
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            self._decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        if not self._decompressor:
+            return b""
+        data = self._decompressor.flush()
+        if not self._decompressor.eof:
+            raise ValueError("Truncated compressed data")
+        return data
+
+
+class HttpConnectionPool:
+    """
+    Keeps HTTP/1.1 connections open between requests, per scheme, host and
+    port, and resumes TLS sessions on new connections to the same host.
+    Connections are used by one request at a time, so pool can be shared
+    by loaders in several threads. Like urlopen, follows redirects and
+    raises HTTPError for other non-2xx responses.
+    Requests going through a proxy are made with urlopen.
+    """
+
+    MAX_IDLE_CONNECTIONS = 8
+    MAX_REDIRECTS = 10
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+    class HTTPSConnection(http.client.HTTPSConnection):
+        def __init__(self, host, port, context, pool, key):
+            super().__init__(host, port, context=context)
+            self._pool = pool
+            self._pool_key = key
+
+        def connect(self) -> None:
+            http.client.HTTPConnection.connect(self)
+            self.sock = self._context.wrap_socket(
+                self.sock,
+                server_hostname=self.host,
+                session=self._pool._tls_sessions.get(self._pool_key),
+            )
+
+    class Response:
+        # Returns connection to pool on close, if response was read to the end
+        def __init__(self, pool, key, connection, response, reused: bool):
+            self._pool = pool
+            self._key = key
+            self._connection = connection
+            self._response = response
+            self.reused = reused
+
+        def __getattr__(self, name):
+            return getattr(self._response, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args) -> None:
+            self.close()
+
+        def close(self) -> None:
+            if not self._connection:
+                return
+            reusable = self._response.isclosed() and not self._response.will_close
+            self._response.close()
+            self._pool._release(self._key, self._connection, reusable)
+            self._connection = None
+
+    def __init__(self):
+        self._idle_connections = {}
+        self._tls_sessions = {}
+        self._default_ssl_context = None
+        self._lock = threading.Lock()
+
+    def _get_ssl_context(self, ssl_context):
+        if ssl_context:
+            return ssl_context
+        if not self._default_ssl_context:
+            import ssl
+
+            self._default_ssl_context = ssl.create_default_context()
+        return self._default_ssl_context
+
+    def _get_connection(self, key: tuple, ssl_context):
+        # Returns connection and whether it was used before
+        with self._lock:
+            if idle_connections := self._idle_connections.get(key):
+                return idle_connections.pop(), True
+        scheme, host, port, _ = key
+        if scheme == "https":
+            return self.HTTPSConnection(host, port, ssl_context, self, key), False
+        return http.client.HTTPConnection(host, port), False
+
+    def _release(self, key: tuple, connection, reusable: bool) -> None:
+        with self._lock:
+            if tls_session := getattr(connection.sock, "session", None):
+                self._tls_sessions[key] = tls_session
+            idle_connections = self._idle_connections.setdefault(key, [])
+            if reusable and len(idle_connections) < self.MAX_IDLE_CONNECTIONS:
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def _request(self, url: str, headers: Dict[str, str], ssl_context):
+        parsed_url = urlparse(url)
+        ssl_context = (
+            self._get_ssl_context(ssl_context) if parsed_url.scheme == "https" else None
+        )
+        key = (parsed_url.scheme, parsed_url.hostname, parsed_url.port, id(ssl_context))
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path += f"?{parsed_url.query}"
+        while True:
+            connection, reused = self._get_connection(key, ssl_context)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                connection.close()
+                # Server has closed idle connection
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            return self.Response(self, key, connection, response, reused)
+
+    @staticmethod
+    def _is_proxied(url: str) -> bool:
+        parsed_url = urlparse(url)
+        return parsed_url.scheme in getproxies() and not proxy_bypass(
+            parsed_url.hostname
+        )
+
+    def open(self, url: str, headers: Dict[str, str], ssl_context=None):
+        if urlparse(url).scheme not in ("http", "https") or self._is_proxied(url):
+            return urlopen(Request(url, headers=headers), context=ssl_context)
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request(url, headers, ssl_context)
+            if response.status in self.REDIRECT_CODES and (
+                location := response.headers.get("Location")
+            ):
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                continue
+            if response.status >= 300:
+                body = response.read()
+                response.close()
+                raise HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.headers,
+                    io.BytesIO(body),
+                )
+            return response
+        raise HTTPError(
+            url, response.status, "Too many redirects", response.headers, None
+        )
+
+
 class BaseSdkLoader:
     """
     Base class for SDK loaders.
@@ -76,27 +1200,488 @@ class BaseSdkLoader:
     VERSION_UNKNOWN = "unknown"
     ALWAYS_UPDATE_VERSIONS = [VERSION_UNKNOWN, "local"]
     USER_AGENT = "uFBT SDKLoader/0.2"
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024
+    DOWNLOAD_CONNECTIONS = 1
+    DOWNLOAD_MIN_RANGE_SIZE = 4 * 1024 * 1024
+    PART_FILE_SUFFIX = ".part"
+    INDEX_CACHE_SUBDIR = "index"
+    INDEX_ACCEPT_ENCODING = "gzip, deflate"
+    INDEX_CHUNK_SIZE = 64 * 1024
+    OFFLINE = False
     _SSL_CONTEXT = None
+    _CONNECTION_POOL = HttpConnectionPool()
 
     def __init__(self, download_dir: str):
         self._download_dir = download_dir
+        self._download_cache = DownloadCache(download_dir, SdkStore.get_default())
+        self._index_cache = IndexCache(
+            os.path.join(download_dir, self.INDEX_CACHE_SUBDIR)
+        )
 
-    def _open_url(self, url: str):
-        request = Request(url, headers={"User-Agent": self.USER_AGENT})
-        return urlopen(request, context=self._SSL_CONTEXT)
+    def _open_url(self, url: str, headers: Dict[str, str] = None):
+        if self.OFFLINE:
+            raise RuntimeError(f"Cannot fetch {url} in offline mode")
+        headers = {"User-Agent": self.USER_AGENT, **(headers or {})}
+        # Time to response headers: name resolution, connection, TLS and
+        # server, unless connection is reused
+        with Timings.span("request", url=url) as span:
+            try:
+                response = self._CONNECTION_POOL.open(url, headers, self._SSL_CONTEXT)
+            except HTTPError as e:
+                span.set(status=e.code)
+                raise
+            span.set(status=response.status, reused=getattr(response, "reused", False))
+            return response
+
+    def _fetch_index(self, url: str, parser, selector: str) -> Optional[dict]:
+        """
+        Returns parser's decision for selector in index at url. Parser is fed
+        with decoded chunks of the document, until it is done or the document
+        ends, and has feed(data), close(), result() and `done` attribute.
+        Decisions are cached and reused while the index is not modified.
+        """
+        with Timings.span("index", url=url, selector=selector) as span:
+            return self._fetch_index_timed(url, parser, selector, span)
+
+    def _fetch_index_timed(
+        self, url: str, parser, selector: str, span: Timings.Span
+    ) -> Optional[dict]:
+        # Cached decision or body is used when fresh or not modified on
+        # server. Index is requested compressed and is decoded as it arrives
+        cached_entry = self._index_cache.get(url)
+        cached_decision = None
+        has_cached_body = False
+        if cached_entry:
+            cached_decision = cached_entry.get("decisions", {}).get(selector)
+            has_cached_body = self._index_cache.has_body(cached_entry)
+        if cached_decision is None and not has_cached_body:
+            cached_entry = None
+
+        if cached_entry:
+            if self.OFFLINE or self._index_cache.is_fresh(cached_entry):
+                log.debug(f"Using cached index {url}")
+                span.set(cache="fresh")
+                return self._use_cached_index(cached_entry, parser, selector, span)
+            request_headers = self._index_cache.get_validator_headers(cached_entry)
+        else:
+            request_headers = {}
+        request_headers["Accept-Encoding"] = self.INDEX_ACCEPT_ENCODING
+
+        try:
+            response = self._open_url(url, request_headers)
+        except HTTPError as e:
+            if e.code == 304 and cached_entry:
+                log.debug(f"Index {url} is not modified, using cached copy")
+                span.set(cache="not_modified")
+                self._index_cache.refresh(cached_entry)
+                return self._use_cached_index(cached_entry, parser, selector, span)
+            raise
+
+        span.set(cache="miss")
+        tmp_body_path = self._index_cache.make_tmp_body_path(url)
+        try:
+            with response, open(tmp_body_path, "wb") as body_file:
+
+                def read_response() -> Iterator[bytes]:
+                    while chunk := response.read(self.INDEX_CHUNK_SIZE):
+                        span.add_bytes(len(chunk))
+                        body_file.write(chunk)
+                        yield chunk
+
+                self._decode_index(
+                    read_response(),
+                    response.headers.get("Content-Encoding"),
+                    parser,
+                    span,
+                )
+                # Parser may be done before the end of the document
+                complete = response.isclosed()
+            decision = parser.result()
+            self._index_cache.put(
+                url,
+                tmp_body_path if complete else None,
+                response.headers,
+                selector,
+                decision,
+            )
+            return decision
+        finally:
+            if os.path.exists(tmp_body_path):
+                os.unlink(tmp_body_path)
+
+    def _use_cached_index(
+        self, cached_entry: dict, parser, selector: str, span: Timings.Span
+    ) -> Optional[dict]:
+        if (decision := cached_entry.get("decisions", {}).get(selector)) is not None:
+            span.set(decision="cached")
+            return decision
+        try:
+            self._decode_index(
+                self._index_cache.read_body(cached_entry),
+                cached_entry.get("encoding"),
+                parser,
+                span,
+            )
+        except FileNotFoundError:
+            # Replaced by a newer version before it was opened
+            return self._fetch_index_timed(cached_entry["url"], parser, selector, span)
+        if (decision := parser.result()) is not None:
+            self._index_cache.put_decision(cached_entry, selector, decision)
+        return decision
+
+    @staticmethod
+    def _decode_index(
+        chunks: Iterator[bytes],
+        encoding: Optional[str],
+        parser,
+        span: Timings.Span,
+    ) -> None:
+        decoder = ContentDecoder(encoding)
+        decoded_size = 0
+        for chunk in chunks:
+            if data := decoder.decode(chunk):
+                decoded_size += len(data)
+                parser.feed(data)
+                if parser.done:
+                    break
+        else:
+            if data := decoder.flush():
+                decoded_size += len(data)
+                parser.feed(data)
+            if not parser.done:
+                parser.close()
+        span.set(
+            encoding=decoder.encoding,
+            decoded_bytes=decoded_size,
+            decision="parsed",
+            stopped_early=parser.done,
+        )
 
-    def _fetch_file(self, url: str) -> str:
+    def _fetch_file(self, url: str, version: str = None, sha256: str = None) -> str:
         log.debug(f"Fetching {url}")
         file_name = PurePosixPath(unquote(urlparse(url).path)).parts[-1]
-        file_path = os.path.join(self._download_dir, file_name)
+        # Data is streamed to a temporary file and moved into place only when
+        # complete, so an interrupted download never leaves a truncated file
+        part_file_path = os.path.join(
+            self._download_dir, file_name + self.PART_FILE_SUFFIX
+        )
 
         os.makedirs(self._download_dir, exist_ok=True)
+        # Concurrent fetches of the same file, from threads or processes,
+        # are serialized, so later ones are served from cache
+        with Timings.span("download", file=file_name, cache="miss"), FileLock(
+            Path(self._download_dir) / f"{file_name}.lock"
+        ):
+            return self._fetch_file_locked(
+                url, file_name, part_file_path, version, sha256
+            )
+
+    def _fetch_file_locked(
+        self,
+        url: str,
+        file_name: str,
+        part_file_path: str,
+        version: Optional[str],
+        sha256: Optional[str],
+    ) -> str:
+        # Artifacts with known checksum or version are served from cache
+        # without network access. Otherwise, last cached copy is revalidated
+        # with its ETag
+        if sha256:
+            validator = f"sha256:{sha256.lower()}"
+        elif version not in self.ALWAYS_UPDATE_VERSIONS:
+            validator = version
+        else:
+            validator = None
+        request_headers = {}
+        if validator:
+            if cached_file_path := self._download_cache.get(url, validator):
+                log.info(f"Using cached {file_name}")
+                Timings.current_span().set(cache="hit")
+                return cached_file_path
+        elif etag := self._download_cache.find_etag(url):
+            if self.OFFLINE and (
+                cached_file_path := self._download_cache.get(url, etag)
+            ):
+                log.info(f"Using cached {file_name} in offline mode")
+                Timings.current_span().set(cache="hit")
+                return cached_file_path
+            request_headers["If-None-Match"] = etag
+
+        try:
+            etag, digest = self._download(
+                url, request_headers, part_file_path, file_name
+            )
+        except HTTPError as e:
+            if e.code == 304 and (
+                cached_file_path := self._download_cache.get(
+                    url, request_headers.get("If-None-Match")
+                )
+            ):
+                log.info(f"{file_name} is not modified, using cached copy")
+                Timings.current_span().set(cache="not_modified")
+                return cached_file_path
+            raise
+
+        if sha256 and digest != sha256.lower():
+            os.unlink(part_file_path)
+            self._remove_part_meta(part_file_path)
+            raise ValueError(
+                f"Checksum mismatch for {file_name}: expected {sha256}, got {digest}"
+            )
+
+        cached_file_path = self._download_cache.put(
+            url, validator or etag, part_file_path, file_name, etag, digest
+        )
+        self._remove_part_meta(part_file_path)
+        return cached_file_path
+
+    # Partially downloaded files have a sidecar with source URL, ETag and
+    # expected length, so an interrupted download can be resumed
+    @staticmethod
+    def _load_part_meta(file_path: str) -> Optional[dict]:
+        try:
+            with open(file_path + ".json", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_part_meta(file_path: str, part_meta: dict) -> None:
+        with open(file_path + ".json", "w") as f:
+            json.dump(part_meta, f, indent=4)
+
+    @staticmethod
+    def _remove_part_meta(file_path: str) -> None:
+        if os.path.exists(meta_path := file_path + ".json"):
+            os.unlink(meta_path)
+
+    @staticmethod
+    def _get_validators(response) -> Dict[str, Optional[str]]:
+        return {
+            "etag": response.headers.get("ETag", None),
+            "last_modified": response.headers.get("Last-Modified", None),
+        }
 
-        with self._open_url(url) as response, open(file_path, "wb") as out_file:
-            data = response.read()
-            out_file.write(data)
+    @staticmethod
+    def _get_if_range(part_meta: dict) -> Optional[str]:
+        # Servers without ETags accept Last-Modified date in If-Range
+        return part_meta.get("etag") or part_meta.get("last_modified")
 
-        return file_path
+    @staticmethod
+    def _is_same_version(response, part_meta: dict) -> bool:
+        if etag := part_meta.get("etag"):
+            return response.headers.get("ETag", etag) == etag
+        last_modified = part_meta.get("last_modified")
+        return response.headers.get("Last-Modified", last_modified) == last_modified
+
+    def _download(
+        self, url: str, request_headers: Dict[str, str], file_path: str, name: str
+    ) -> Tuple[Optional[str], str]:
+        # Downloads url to file_path, returns ETag and sha256 of downloaded data
+        if (
+            (part_meta := self._load_part_meta(file_path))
+            and part_meta.get("url") == url
+            and self._get_if_range(part_meta)
+            and os.path.exists(file_path)
+        ):
+            try:
+                if result := self._resume_download(url, file_path, part_meta, name):
+                    return result
+            except HTTPError as e:
+                if e.code != 416:
+                    raise
+                log.info(f"Cannot resume download of {name}, restarting")
+
+        # With multiple connections enabled, first request is a range probe:
+        # servers without range support reply with full body, which is used
+        # as a single stream
+        if self.DOWNLOAD_CONNECTIONS > 1:
+            request_headers = {**request_headers, "Range": "bytes=0-0"}
+
+        with self._open_url(url, request_headers) as response:
+            validators = self._get_validators(response)
+            etag = validators["etag"]
+            if response.status != 206:
+                return etag, self._save_response(url, response, file_path, name)
+            total_size = self._get_content_range_size(response)
+            response.read()
+
+        # Without a validator, ranges could come from different file versions
+        if total_size is None or not self._get_if_range(validators):
+            log.debug(f"Unknown size or version of {url}, using single connection")
+            del request_headers["Range"]
+            with self._open_url(url, request_headers) as response:
+                return response.headers.get("ETag", None), self._save_response(
+                    url, response, file_path, name
+                )
+
+        range_count = max(
+            1,
+            min(self.DOWNLOAD_CONNECTIONS, total_size // self.DOWNLOAD_MIN_RANGE_SIZE),
+        )
+        range_size = -(-total_size // range_count)
+        part_meta = {
+            "url": url,
+            **validators,
+            "length": total_size,
+            # [start, end, downloaded byte count] for each range
+            "ranges": [
+                [start, min(start + range_size, total_size) - 1, 0]
+                for start in range(0, total_size, range_size)
+            ],
+        }
+        # Ranges are written in place into preallocated file
+        with open(file_path, "wb") as out_file:
+            out_file.truncate(total_size)
+        self._download_ranges(file_path, part_meta, name)
+        return etag, file_sha256(file_path, self.DOWNLOAD_CHUNK_SIZE).hexdigest()
+
+    def _resume_download(
+        self, url: str, file_path: str, part_meta: dict, name: str
+    ) -> Optional[Tuple[Optional[str], str]]:
+        # Returns None if download has to be restarted
+        etag = part_meta.get("etag")
+        if ranges := part_meta.get("ranges"):
+            if all(start + downloaded > end for start, end, downloaded in ranges):
+                return (
+                    etag,
+                    file_sha256(file_path, self.DOWNLOAD_CHUNK_SIZE).hexdigest(),
+                )
+            # Ranges are resumed after a probe request validating version
+            resume_from = 0
+            range_header = "bytes=0-0"
+        else:
+            resume_from = os.path.getsize(file_path)
+            if part_meta.get("length") == resume_from:
+                return (
+                    etag,
+                    file_sha256(file_path, self.DOWNLOAD_CHUNK_SIZE).hexdigest(),
+                )
+            range_header = f"bytes={resume_from}-"
+
+        # If-Range makes server send full body if file has changed
+        range_headers = {
+            "Range": range_header,
+            "If-Range": self._get_if_range(part_meta),
+        }
+        with self._open_url(url, range_headers) as response:
+            if response.status != 206 or not self._is_same_version(response, part_meta):
+                log.info(f"{name} has changed on server, restarting download")
+                if response.status != 206:
+                    return response.headers.get("ETag", None), self._save_response(
+                        url, response, file_path, name
+                    )
+                # Server ignored If-Range, data of the old version is discarded
+                self._remove_part_meta(file_path)
+                os.unlink(file_path)
+                return None
+
+            if not ranges:
+                log.info(f"Resuming download of {name} from byte {resume_from}")
+                hasher = file_sha256(file_path, self.DOWNLOAD_CHUNK_SIZE)
+                progress = DownloadProgress(name, part_meta["length"], resume_from)
+                with open(file_path, "ab") as out_file:
+                    self._copy_response(response, out_file, progress, hasher)
+                progress.finish()
+                return etag, hasher.hexdigest()
+            response.read()
+
+        log.info(f"Resuming ranged download of {name}")
+        self._download_ranges(file_path, part_meta, name)
+        return etag, file_sha256(file_path, self.DOWNLOAD_CHUNK_SIZE).hexdigest()
+
+    def _download_ranges(self, file_path: str, part_meta: dict, name: str) -> None:
+        url = part_meta["url"]
+        pending_ranges = [
+            byte_range
+            for byte_range in part_meta["ranges"]
+            if byte_range[0] + byte_range[2] <= byte_range[1]
+        ]
+        log.debug(f"Downloading {name} in {len(pending_ranges)} ranges")
+        progress = DownloadProgress(
+            name,
+            part_meta["length"],
+            sum(byte_range[2] for byte_range in part_meta["ranges"]),
+        )
+
+        def fetch_range(byte_range) -> None:
+            start, end, downloaded = byte_range
+            # If-Range makes server send full body instead of a range if
+            # file has changed
+            range_headers = {
+                "Range": f"bytes={start + downloaded}-{end}",
+                "If-Range": self._get_if_range(part_meta),
+            }
+            with self._open_url(url, range_headers) as response, open(
+                file_path, "r+b"
+            ) as out_file:
+                if response.status != 206 or not self._is_same_version(
+                    response, part_meta
+                ):
+                    raise RuntimeError(f"{name} changed on server during download")
+                out_file.seek(start + downloaded)
+                try:
+                    self._copy_response(response, out_file, progress)
+                finally:
+                    out_file.flush()
+                    byte_range[2] = out_file.tell() - start
+            if start + byte_range[2] <= end:
+                raise RuntimeError(f"Incomplete range {start}-{end} of {name}")
+
+        self._save_part_meta(file_path, part_meta)
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending_ranges)) as executor:
+                for future in as_completed(
+                    executor.submit(fetch_range, byte_range)
+                    for byte_range in pending_ranges
+                ):
+                    future.result()
+                    self._save_part_meta(file_path, part_meta)
+        finally:
+            self._save_part_meta(file_path, part_meta)
+        progress.finish()
+
+    @staticmethod
+    def _get_content_range_size(response) -> Optional[int]:
+        content_range = response.headers.get("Content-Range", "")
+        if match := re.match(r"bytes \d+-\d+/(\d+)", content_range):
+            return int(match.group(1))
+        return None
+
+    def _save_response(self, url: str, response, file_path: str, name: str) -> str:
+        # Saves response body to file_path, returns its sha256
+        total_size = int(response.headers.get("Content-Length") or 0)
+        validators = self._get_validators(response)
+        if self._get_if_range(validators) and total_size:
+            self._save_part_meta(
+                file_path, {"url": url, **validators, "length": total_size}
+            )
+        else:
+            # Without a validator, partial data cannot be safely resumed
+            self._remove_part_meta(file_path)
+        progress = DownloadProgress(name, total_size)
+        hasher = hashlib.sha256()
+        with open(file_path, "wb") as out_file:
+            self._copy_response(response, out_file, progress, hasher)
+        progress.finish()
+        return hasher.hexdigest()
+
+    def _copy_response(
+        self, response, out_file, progress: DownloadProgress, hasher=None
+    ) -> int:
+        # Copies response body in fixed-size chunks, reusing a single buffer.
+        # Data is hashed on the fly if hasher is given. Returns number of bytes copied
+        copied_size = 0
+        buffer = bytearray(self.DOWNLOAD_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while read_size := response.readinto(buffer):
+            out_file.write(view[:read_size])
+            if hasher:
+                hasher.update(view[:read_size])
+            copied_size += read_size
+            progress.update(read_size)
+        return copied_size
 
     # Returns local FS path. Downloads file if necessary
     def get_sdk_component(self, target: str) -> str:
@@ -131,12 +1716,40 @@ class BranchSdkLoader(BaseSdkLoader):
     UPDATE_SERVER_BRANCH_ROOT = "https://update.flipperzero.one/builds/firmware"
 
     class LinkExtractor(HTMLParser):
+        """
+        Incremental parser of branch index page, fed with bytes. With
+        hw_target, it is done as soon as SDK link for it is found.
+        """
+
         FILE_NAME_RE = re.compile(r"flipper-z-(\w+)-(\w+)-(.+)\.(\w+)")
 
+        def __init__(self, hw_target: str = None):
+            self.hw_target = hw_target
+            super().__init__()
+
         def reset(self) -> None:
             super().reset()
             self.files = {}
             self.version = None
+            self.done = False
+            self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+        def feed(self, data: bytes) -> None:
+            super().feed(self._text_decoder.decode(data))
+
+        def close(self) -> None:
+            super().feed(self._text_decoder.decode(b"", final=True))
+            super().close()
+
+        def result(self) -> dict:
+            return {
+                "version": self.version,
+                "files": [
+                    [file_type.name, target, href]
+                    for (file_type, target), href in self.files.items()
+                ],
+                "complete": not self.done,
+            }
 
         def handle_starttag(self, tag, attrs):
             if tag == "a" and (href := dict(attrs).get("href", None)):
@@ -154,32 +1767,51 @@ class BranchSdkLoader(BaseSdkLoader):
                         raise RuntimeError(
                             f"Found multiple versions: {self.version} and {version}"
                         )
+                    if (FileType.SDK_ZIP, self.hw_target) in self.files:
+                        self.done = True
 
-    def __init__(self, download_dir: str, branch: str, branch_root_url: str = None):
+    def __init__(
+        self,
+        download_dir: str,
+        branch: str,
+        branch_root_url: str = None,
+        hw_target: str = None,
+    ):
         super().__init__(download_dir)
         self._branch = branch
         self._branch_root = branch_root_url or self.UPDATE_SERVER_BRANCH_ROOT
         self._branch_url = f"{self._branch_root}/{branch}/"
         self._branch_files = {}
+        self._all_files_listed = False
         self._version = None
-        self._fetch_branch()
+        self._fetch_branch(hw_target)
 
-    def _fetch_branch(self) -> None:
-        # Fetch html index page with links to files
+    def _fetch_branch(self, hw_target: str = None) -> None:
+        # Fetch html index page with links to files, up to the SDK for
+        # hw_target if given
         log.info(f"Fetching branch index {self._branch_url}")
-        with self._open_url(self._branch_url) as response:
-            html = response.read().decode("utf-8")
-            extractor = BranchSdkLoader.LinkExtractor()
-            extractor.feed(html)
-            self._branch_files = extractor.files
-            self._version = extractor.version
+        links = self._fetch_index(
+            self._branch_url,
+            BranchSdkLoader.LinkExtractor(hw_target),
+            f"sdk:{hw_target}" if hw_target else "files",
+        )
+        self._branch_files = {
+            (FileType[file_type], target): href
+            for file_type, target, href in links["files"]
+        }
+        self._all_files_listed = links["complete"]
+        self._version = links["version"]
         log.info(f"Found version {self._version}")
 
     def get_sdk_component(self, target: str) -> str:
+        if (FileType.SDK_ZIP, target) not in self._branch_files and (
+            not self._all_files_listed
+        ):
+            self._fetch_branch()
         if not (file_name := self._branch_files.get((FileType.SDK_ZIP, target), None)):
             raise ValueError(f"SDK bundle not found for {target}")
 
-        return self._fetch_file(self._branch_url + file_name)
+        return self._fetch_file(self._branch_url + file_name, self._version)
 
     def get_metadata(self) -> Dict[str, str]:
         return {
@@ -230,6 +1862,163 @@ class UpdateChannelSdkLoader(BaseSdkLoader):
         RC = "release-candidate"
         RELEASE = "release"
 
+    class HeadVersionParser:
+        """
+        Incremental parser of JSON index, fed with bytes, looking for the
+        first version of a channel. Only document structure is tracked, and
+        values on the path to that version are decoded, so it is done as soon
+        as the version is read.
+        """
+
+        # Structural characters are ASCII, and never part of multibyte UTF-8
+        TOKEN_RE = re.compile(rb'[{}\[\]",:]')
+        # String contents up to closing quote or incomplete escape sequence
+        STRING_BODY_RE = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+        # Complete strings and anything but brackets, in values off the path
+        SKIP_RE = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+
+        class Frame:
+            __slots__ = ("is_object", "key", "index", "expect_key")
+
+            def __init__(self, is_object: bool):
+                self.is_object = is_object
+                self.key = None
+                self.index = 0
+                self.expect_key = is_object
+
+        def __init__(self, channel_id: str):
+            self.channel_id = channel_id
+            self.done = False
+            self._buffer = bytearray()
+            self._pos = 0
+            self._stack = []
+            self._in_string = False
+            self._string_start = None
+            self._head_start = None
+            self._found = False
+            self._reset_channel()
+
+        def _reset_channel(self) -> None:
+            self._current_id = None
+            self._current_head = None
+            self._versions_read = False
+
+        def _depth_is(self, depth: int) -> bool:
+            # Stack is: root, channels, channel, versions, version
+            stack = self._stack
+            return (
+                len(stack) == depth
+                and (
+                    depth < 2 or (stack[0].key == "channels" and not stack[1].is_object)
+                )
+                and (
+                    depth < 4 or (stack[2].key == "versions" and not stack[3].is_object)
+                )
+            )
+
+        def _loads(self, start: int, end: int):
+            try:
+                return json.loads(self._buffer[start:end])
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON: {e}")
+
+        def _check_channel(self) -> None:
+            if self._current_id == self.channel_id and (
+                self._current_head is not None or self._versions_read
+            ):
+                self._found = self.done = True
+
+        def _handle_string(self, end: int) -> None:
+            if self._string_start is None:
+                return
+            value = self._loads(self._string_start, end)
+            self._string_start = None
+            if (frame := self._stack[-1]).expect_key:
+                frame.key = value
+            else:
+                self._current_id = value
+                self._check_channel()
+
+        def _handle_token(self, token: bytes, start: int, end: int) -> None:
+            frame = self._stack[-1] if self._stack else None
+            if token == b'"':
+                self._in_string = True
+                # Only keys and channel ids on the path to version are decoded
+                if (self._depth_is(1) and frame.expect_key) or (
+                    self._depth_is(3) and (frame.expect_key or frame.key == "id")
+                ):
+                    self._string_start = start
+            elif token in b"{[":
+                if token == b"{" and self._depth_is(4) and frame.index == 0:
+                    self._head_start = start
+                self._stack.append(self.Frame(token == b"{"))
+                if self._depth_is(3):
+                    self._reset_channel()
+            elif token in b"}]":
+                if not frame:
+                    raise ValueError("Invalid JSON: unexpected end of container")
+                if self._depth_is(5) and self._head_start is not None:
+                    self._current_head = self._loads(self._head_start, end)
+                    self._head_start = None
+                elif self._depth_is(4):
+                    self._versions_read = True
+                elif self._depth_is(3):
+                    self._versions_read = True
+                self._stack.pop()
+                self._check_channel()
+            elif frame and token == b":":
+                frame.expect_key = False
+            elif frame and token == b",":
+                frame.index += 1
+                frame.expect_key = frame.is_object
+
+        def feed(self, data: bytes) -> None:
+            if self.done:
+                return
+            buffer = self._buffer
+            buffer += data
+            pos = self._pos
+            while not self.done:
+                if self._in_string:
+                    pos = self.STRING_BODY_RE.match(buffer, pos).end()
+                    if pos == len(buffer) or buffer[pos] != ord('"'):
+                        # Rest of string, or escaped character, is in next chunk
+                        break
+                    pos += 1
+                    self._in_string = False
+                    self._handle_string(pos)
+                    continue
+                if not (self._depth_is(1) or self._depth_is(3) or self._depth_is(4)):
+                    # Only nesting matters here
+                    pos = self.SKIP_RE.match(buffer, pos).end()
+                if not (match := self.TOKEN_RE.search(buffer, pos)):
+                    pos = len(buffer)
+                    break
+                pos = match.end()
+                self._handle_token(match.group(), match.start(), pos)
+
+            # Only data of values being read is kept
+            keep_from = min(
+                offset
+                for offset in (pos, self._string_start, self._head_start)
+                if offset is not None
+            )
+            del buffer[:keep_from]
+            self._pos = pos - keep_from
+            if self._string_start is not None:
+                self._string_start -= keep_from
+            if self._head_start is not None:
+                self._head_start -= keep_from
+
+        def close(self) -> None:
+            if self._stack or self._in_string:
+                raise ValueError("Invalid JSON: unexpected end of document")
+
+        def result(self) -> Optional[dict]:
+            if not self._found:
+                return None
+            return {"head": self._current_head}
+
     def __init__(
         self, download_dir: str, channel: UpdateChannel, json_index_url: str = None
     ):
@@ -240,26 +2029,21 @@ class UpdateChannelSdkLoader(BaseSdkLoader):
 
     def _fetch_version(self, channel: UpdateChannel) -> dict:
         log.info(f"Fetching version info for {channel} from {self.json_index_url}")
-        try:
-            data = json.loads(
-                self._open_url(self.json_index_url).read().decode("utf-8")
-            )
-        except json.decoder.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON: {e}")
-
-        if not (channels := data.get("channels", [])):
-            raise ValueError(f"Invalid channel: {channel}")
-
-        channel_data = next((c for c in channels if c["id"] == channel.value), None)
-        if not channel_data:
+        # Index is only read up to the first version of channel
+        channel_info = self._fetch_index(
+            self.json_index_url,
+            self.HeadVersionParser(channel.value),
+            f"channel:{channel.value}",
+        )
+        if not channel_info:
             raise ValueError(f"Invalid channel: {channel}")
 
-        if not (versions := channel_data.get("versions", [])):
+        if not (version := channel_info["head"]):
             raise ValueError(f"Empty channel: {channel}")
 
-        log.info(f"Using version: {versions[0]['version']}")
-        log.debug(f"Changelog: {versions[0].get('changelog', 'None')}")
-        return versions[0]
+        log.info(f"Using version: {version['version']}")
+        log.debug(f"Changelog: {version.get('changelog', 'None')}")
+        return version
 
     @staticmethod
     def _get_file_info(version_data: dict, file_type: FileType, file_target: str):
@@ -285,7 +2069,12 @@ class UpdateChannelSdkLoader(BaseSdkLoader):
         if not (file_url := file_info.get("url", None)):
             raise ValueError("Invalid file url")
 
-        return self._fetch_file(file_url)
+        # Mirrors refer to files relative to index
+        return self._fetch_file(
+            urljoin(self.json_index_url, file_url),
+            self.version_info["version"],
+            file_info.get("sha256", None),
+        )
 
     def get_metadata(self) -> Dict[str, str]:
         return {
@@ -477,29 +2266,50 @@ class SdkDeployTask:
         return task
 
 
+class FileLock(BaseFileLock):
+    """Records time spent waiting for the lock in timings"""
+
+    def _acquire(self) -> None:
+        with Timings.span("lock_wait", lock=os.path.basename(self.lock_file_path)):
+            super()._acquire()
+
+
 class SdkLoaderFactory:
     @staticmethod
-    def create_for_task(task: SdkDeployTask, download_dir: str) -> BaseSdkLoader:
-        log.debug(f"SdkLoaderFactory::create_for_task {task=}")
-        loader_cls = None
+    def get_loader_cls(mode: str):
         for loader_cls in all_boostrap_loader_cls:
-            if loader_cls.LOADER_MODE_KEY == task.mode:
-                break
-        if loader_cls is None:
-            raise ValueError(f"Invalid mode: {task.mode}")
+            if loader_cls.LOADER_MODE_KEY == mode:
+                return loader_cls
+        raise ValueError(f"Invalid mode: {mode}")
 
+    @staticmethod
+    def create_for_task(task: SdkDeployTask, download_dir: str) -> BaseSdkLoader:
+        log.debug(f"SdkLoaderFactory::create_for_task {task=}")
+        loader_cls = SdkLoaderFactory.get_loader_cls(task.mode)
         ctor_kwargs = loader_cls.metadata_to_init_kwargs(task.all_params)
+        # Branch index is only read up to the SDK for target
+        if loader_cls is BranchSdkLoader and task.hw_target:
+            ctor_kwargs["hw_target"] = task.hw_target
         log.debug(f"SdkLoaderFactory::create_for_task {loader_cls=}, {ctor_kwargs=}")
         return loader_cls(download_dir, **ctor_kwargs)
 
 
 class UfbtSdkDeployer:
     UFBT_STATE_FILE_NAME = "ufbt_state.json"
+    SDK_MANIFEST_FILE_NAME = "sdk_manifest.json"
+    SLOT_INFO_FILE_NAME = "slot.json"
+    LOCK_FILE_NAME = ".ufbt_state.lock"
+    # Seconds after a successful update check during which it is skipped
+    UPDATE_CHECK_INTERVAL = 0
 
     def __init__(self, ufbt_state_dir: str, toolchain_dir: str = None):
         self.ufbt_state_dir = Path(ufbt_state_dir)
         self.download_dir = self.ufbt_state_dir / "download"
         self.current_sdk_dir = self.ufbt_state_dir / "current"
+        # Installed SDK slots, current SDK dir is a link to one of them
+        self.sdk_trees_dir = self.ufbt_state_dir / "sdk"
+        self.lock_file = self.ufbt_state_dir / self.LOCK_FILE_NAME
+        self.sdk_store = SdkStore.get_default()
         if toolchain_dir:
             self.toolchain_dir = self.ufbt_state_dir / toolchain_dir
         else:
@@ -511,33 +2321,426 @@ class UfbtSdkDeployer:
             )
         self.state_file = self.current_sdk_dir / self.UFBT_STATE_FILE_NAME
 
-    def get_previous_task(self) -> Optional[SdkDeployTask]:
+    def _load_state(self) -> Optional[dict]:
         if not os.path.exists(self.state_file):
             return None
         with open(self.state_file, "r") as f:
-            ufbt_state = json.load(f)
+            return json.load(f)
+
+    def get_previous_task(self) -> Optional[SdkDeployTask]:
+        if not (ufbt_state := self._load_state()):
+            return None
         log.debug(f"get_previous_task() loaded state: {ufbt_state=}")
         return SdkDeployTask.from_dict(ufbt_state)
 
-    def deploy(self, task: SdkDeployTask) -> bool:
-        log.info(f"Deploying SDK for {task.hw_target}")
-        sdk_loader = SdkLoaderFactory.create_for_task(task, self.download_dir)
-
-        sdk_target_dir = self.current_sdk_dir.absolute()
-        log.info(f"uFBT SDK dir: {sdk_target_dir}")
-        if not task.force and os.path.exists(sdk_target_dir):
-            # Read existing state
-            with open(self.state_file, "r") as f:
-                ufbt_state = json.load(f)
-            # Check if we need to update
-            if ufbt_state.get("version") in sdk_loader.ALWAYS_UPDATE_VERSIONS:
-                log.info("Cannot determine current SDK version, updating")
+    @staticmethod
+    def _is_task_deployed(task: SdkDeployTask, ufbt_state: dict) -> bool:
+        # Checks if task refers to the same SDK source as deployed one
+        if (
+            ufbt_state.get("mode") != task.mode
+            or ufbt_state.get("hw_target") != task.hw_target
+        ):
+            return False
+        loader_cls = SdkLoaderFactory.get_loader_cls(task.mode)
+        return loader_cls.metadata_to_init_kwargs(
+            ufbt_state
+        ) == loader_cls.metadata_to_init_kwargs(task.all_params)
+
+    @staticmethod
+    def _get_slot_key(ufbt_state: dict) -> Tuple:
+        loader_cls = SdkLoaderFactory.get_loader_cls(ufbt_state.get("mode"))
+        return (
+            ufbt_state.get("mode"),
+            ufbt_state.get("version"),
+            ufbt_state.get("hw_target"),
+            json.dumps(
+                loader_cls.metadata_to_init_kwargs(ufbt_state),
+                sort_keys=True,
+                default=str,
+            ),
+        )
+
+    def list_slots(self) -> List[Tuple[Path, dict]]:
+        # Returns installed SDK slots with their state, most recently used first.
+        # Slot is a complete SDK tree in SDK trees dir, keyed by mode, version,
+        # hw_target and source. Trees without state are not fully deployed
+        slots = []
+        if not self.sdk_trees_dir.is_dir():
+            return slots
+        for slot_dir in self.sdk_trees_dir.iterdir():
+            try:
+                with open(slot_dir / self.UFBT_STATE_FILE_NAME, "r") as f:
+                    slots.append((slot_dir, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        slots.sort(key=lambda slot: self._load_slot_info(slot[0])["used_at"])
+        return slots[::-1]
+
+    def _load_slot_info(self, slot_dir: Path) -> dict:
+        # Last use and last update check times of slot
+        try:
+            with open(slot_dir / self.SLOT_INFO_FILE_NAME, "r") as f:
+                slot_info = json.load(f)
+        except (OSError, ValueError):
+            slot_info = {}
+        if "used_at" not in slot_info:
+            try:
+                slot_info["used_at"] = os.stat(slot_dir).st_mtime
+            except OSError:
+                slot_info["used_at"] = 0
+        return slot_info
+
+    def _save_slot_info(self, slot_dir: Path, **updates) -> None:
+        slot_info = self._load_slot_info(slot_dir)
+        slot_info.update(updates)
+        with open(slot_dir / self.SLOT_INFO_FILE_NAME, "w") as f:
+            json.dump(slot_info, f, indent=4)
+
+    def is_current_slot(self, slot_dir: Path) -> bool:
+        return os.path.realpath(slot_dir) == os.path.realpath(self.current_sdk_dir)
+
+    def _find_slot(
+        self, task: SdkDeployTask, version: Optional[str] = None
+    ) -> Optional[Path]:
+        # Returns installed slot for task and given SDK version. Without
+        # version, returns the most recently checked slot not needing update
+        # check - any matching slot in offline mode, or one checked less than
+        # UPDATE_CHECK_INTERVAL seconds ago
+        candidates = []
+        for slot_dir, ufbt_state in self.list_slots():
+            if not self._is_task_deployed(task, ufbt_state):
+                continue
+            slot_version = ufbt_state.get("version")
+            if version is not None:
+                if slot_version == version:
+                    return slot_dir
+                continue
+            checked_at = self._load_slot_info(slot_dir).get("checked_at", 0)
+            if BaseSdkLoader.OFFLINE:
+                # Local SDK is always redeployed, it does not need network access
+                if task.mode != LocalSdkLoader.LOADER_MODE_KEY:
+                    candidates.append((checked_at, slot_dir))
             elif (
-                ufbt_state.get("version") == sdk_loader.get_metadata().get("version")
-                and ufbt_state.get("hw_target") == task.hw_target
+                slot_version not in BaseSdkLoader.ALWAYS_UPDATE_VERSIONS
+                and time.time() - checked_at < self.UPDATE_CHECK_INTERVAL
             ):
-                log.info("SDK is up-to-date")
-                return True
+                candidates.append((checked_at, slot_dir))
+        return max(candidates)[1] if candidates else None
+
+    def _load_manifest(self, sdk_dir: Path) -> Dict[str, dict]:
+        try:
+            with open(sdk_dir / self.SDK_MANIFEST_FILE_NAME, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _is_file_unchanged(file_path: str, manifest_entry: dict) -> bool:
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return False
+        return (
+            file_stat.st_size == manifest_entry["size"]
+            and file_stat.st_mtime_ns == manifest_entry["mtime"]
+        )
+
+    def get_archive_manifest(self, zip_path: str, force: bool = False) -> dict:
+        # Returns manifest of archive files, with their size and CRC32.
+        # With SDK store, archive is imported into it on first use, and
+        # on forced deploys, to restore store objects
+        if not self.sdk_store:
+            with ZipFile(zip_path, "r") as zip_file:
+                members = zip_file.infolist()
+            return {
+                "files": {
+                    member.filename: {"size": member.file_size, "crc": member.CRC}
+                    for member in members
+                    if not member.is_dir()
+                },
+                "dirs": [member.filename for member in members if member.is_dir()],
+            }
+
+        archive_sha256 = DownloadCache(str(self.download_dir)).find_sha256(zip_path)
+        if not archive_sha256:
+            archive_sha256 = file_sha256(zip_path).hexdigest()
+        # Concurrent imports of the same archive are serialized
+        with FileLock(
+            self.sdk_store.archives_dir / f"{archive_sha256}.lock", quiet=True
+        ):
+            if not force and (
+                archive_manifest := self.sdk_store.get_archive_manifest(archive_sha256)
+            ):
+                log.debug(f"Using SDK files from store {self.sdk_store.store_dir}")
+                return archive_manifest
+            log.info(f"Importing SDK into store {self.sdk_store.store_dir}")
+            archive_manifest = self.sdk_store.import_archive(
+                zip_path, archive_sha256, replace=force
+            )
+        # Store only grows on import
+        self.collect_store_garbage()
+        return archive_manifest
+
+    def collect_store_garbage(self) -> None:
+        # Objects of installed slots are kept, for redeploying them
+        if not self.sdk_store or not self.sdk_store.store_dir.is_dir():
+            return
+        live_objects = set()
+        for slot_dir, _ in self.list_slots():
+            live_objects.update(
+                entry["sha256"]
+                for entry in self._load_manifest(slot_dir).values()
+                if "sha256" in entry
+            )
+        self.sdk_store.collect_garbage(live_objects)
+
+    def _install_files(self, zip_path: str, force: bool, slot_name: str) -> Path:
+        # Installs SDK files to slot dir, writing only new and changed files.
+        # Files are compared using manifest of installed files with their size,
+        # CRC32 and mtime. Installed slot is updated in place, so its path and
+        # unchanged files stay the same for builds using it. New slot is staged
+        # in a temporary dir, with unchanged files of current SDK hardlinked,
+        # and renamed into place. Changed files are linked from SDK store, or
+        # extracted from archive when store is disabled
+        slot_dir = self.sdk_trees_dir / slot_name
+        update_in_place = slot_dir.is_dir()
+        if update_in_place:
+            base_dir = slot_dir
+            # Slot is incomplete until its state file is written again
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(slot_dir / self.UFBT_STATE_FILE_NAME)
+        else:
+            base_dir = self.current_sdk_dir.resolve()
+        installed_manifest = self._load_manifest(base_dir)
+        old_manifest = {} if force else installed_manifest
+
+        staging_dir = self.sdk_trees_dir / f"{slot_name}-{uuid.uuid4().hex[:8]}"
+        staging_dir.mkdir(parents=True)
+        target_dir = slot_dir if update_in_place else staging_dir
+
+        with Timings.span("read_archive"):
+            archive_manifest = self.get_archive_manifest(zip_path, force)
+        archive_files = archive_manifest["files"]
+        if update_in_place:
+            # Files no longer in archive are removed, with dirs left empty
+            for file_name in installed_manifest.keys() - archive_files.keys():
+                file_path = zip_member_path(slot_dir, file_name)
+                with contextlib.suppress(FileNotFoundError):
+                    remove_file(file_path)
+                dir_path = os.path.dirname(file_path)
+                with contextlib.suppress(OSError):
+                    while dir_path != str(slot_dir):
+                        os.rmdir(dir_path)
+                        dir_path = os.path.dirname(dir_path)
+        for dir_name in archive_manifest["dirs"]:
+            os.makedirs(zip_member_path(target_dir, dir_name), exist_ok=True)
+
+        created_dirs = set()
+
+        def make_parent_dir(file_path: str) -> None:
+            if (parent_dir := os.path.dirname(file_path)) not in created_dirs:
+                os.makedirs(parent_dir, exist_ok=True)
+                created_dirs.add(parent_dir)
+
+        unchanged_names = []
+        changed_names = []
+        for file_name, file_entry in archive_files.items():
+            old_entry = old_manifest.get(file_name, None)
+            if (
+                old_entry
+                and old_entry["size"] == file_entry["size"]
+                and old_entry["crc"] == file_entry["crc"]
+                and self._is_file_unchanged(
+                    zip_member_path(base_dir, file_name), old_entry
+                )
+            ):
+                unchanged_names.append(file_name)
+            else:
+                changed_names.append(file_name)
+
+        log.info(f"Updating {len(changed_names)} of {len(archive_files)} SDK files")
+        with Timings.span(
+            "extract", files=len(changed_names), unchanged_files=len(unchanged_names)
+        ) as span:
+            span.add_bytes(
+                sum(archive_files[file_name]["size"] for file_name in changed_names)
+            )
+            if self.sdk_store:
+                span.set(source="store")
+                for file_name in changed_names:
+                    file_path = zip_member_path(staging_dir, file_name)
+                    make_parent_dir(file_path)
+                    self.sdk_store.materialize(
+                        archive_files[file_name]["sha256"], file_path
+                    )
+            else:
+                span.set(source="archive")
+                extract_zip(zip_path, str(staging_dir), member_names=changed_names)
+                # Files may be hardlinked to other slots later
+                for file_name in changed_names:
+                    os.chmod(zip_member_path(staging_dir, file_name), READ_ONLY_MODE)
+
+        manifest = {file_name: old_manifest[file_name] for file_name in unchanged_names}
+        for file_name in changed_names:
+            file_stat = os.stat(zip_member_path(staging_dir, file_name))
+            manifest[file_name] = {
+                **archive_files[file_name],
+                "mtime": file_stat.st_mtime_ns,
+            }
+
+        if update_in_place:
+            for file_name in changed_names:
+                file_path = zip_member_path(slot_dir, file_name)
+                make_parent_dir(file_path)
+                replace_file(zip_member_path(staging_dir, file_name), file_path)
+            remove_tree(staging_dir)
+        else:
+            for file_name in unchanged_names:
+                file_path = zip_member_path(staging_dir, file_name)
+                make_parent_dir(file_path)
+                link_or_copy_file(zip_member_path(base_dir, file_name), file_path)
+            os.rename(staging_dir, slot_dir)
+
+        with open(slot_dir / self.SDK_MANIFEST_FILE_NAME, "w") as f:
+            json.dump(manifest, f)
+        return slot_dir
+
+    def _is_current_sdk_linked(self) -> bool:
+        return os.path.realpath(self.current_sdk_dir) != os.path.join(
+            os.path.realpath(self.ufbt_state_dir), self.current_sdk_dir.name
+        )
+
+    def _switch_current_sdk(self, sdk_dir: Path) -> None:
+        # Points current SDK link to sdk_dir. On POSIX systems, link is
+        # replaced atomically, so concurrent builds see either old or new SDK
+        if os.path.lexists(self.current_sdk_dir) and not self._is_current_sdk_linked():
+            # SDK extracted directly to current dir by older uFBT versions
+            os.rename(
+                self.current_sdk_dir, self.sdk_trees_dir / f"legacy-{os.getpid()}"
+            )
+
+        if platform.system() == "Windows":
+            # Junctions do not require admin rights, but cannot be replaced atomically
+            import _winapi
+
+            if os.path.lexists(self.current_sdk_dir):
+                os.rmdir(self.current_sdk_dir)
+            _winapi.CreateJunction(
+                str(sdk_dir.absolute()), str(self.current_sdk_dir.absolute())
+            )
+            return
+
+        tmp_link_path = self.ufbt_state_dir / f"{self.current_sdk_dir.name}.tmp"
+        if os.path.lexists(tmp_link_path):
+            os.unlink(tmp_link_path)
+        os.symlink(
+            os.path.relpath(sdk_dir, self.ufbt_state_dir),
+            tmp_link_path,
+            target_is_directory=True,
+        )
+        os.replace(tmp_link_path, self.current_sdk_dir)
+
+    def _activate_slot(self, slot_dir: Path, checked: bool) -> None:
+        if not self.is_current_slot(slot_dir):
+            self._switch_current_sdk(slot_dir)
+        now = time.time()
+        if checked:
+            self._save_slot_info(slot_dir, used_at=now, checked_at=now)
+        else:
+            self._save_slot_info(slot_dir, used_at=now)
+
+    def _remove_stale_sdk_trees(self, sdk_dir: Path, keep_dirs: List[Path]) -> None:
+        # Removes incomplete trees and older trees of sdk_dir's slot.
+        # Previous SDK is kept until next deploy, for builds still using it
+        keep_dirs = {os.path.realpath(keep_dir) for keep_dir in keep_dirs}
+        slot_keys = {
+            os.path.realpath(slot_dir): self._get_slot_key(ufbt_state)
+            for slot_dir, ufbt_state in self.list_slots()
+        }
+        sdk_slot_key = slot_keys[os.path.realpath(sdk_dir)]
+        for tree_dir in self.sdk_trees_dir.iterdir():
+            tree_path = os.path.realpath(tree_dir)
+            if tree_path in keep_dirs:
+                continue
+            if slot_keys.get(tree_path, sdk_slot_key) == sdk_slot_key:
+                log.debug(f"Removing stale SDK tree {tree_dir}")
+                remove_tree(tree_dir)
+
+    def prune_slots(
+        self, keep_count: Optional[int] = None, max_age: Optional[float] = None
+    ) -> None:
+        # Removes all but keep_count most recently used slots, and slots not
+        # used for max_age seconds. Current SDK slot is always kept
+        with FileLock(self.lock_file):
+            slots = self.list_slots()
+            complete_dirs = {os.path.realpath(slot_dir) for slot_dir, _ in slots}
+            for index, (slot_dir, _) in enumerate(slots):
+                if self.is_current_slot(slot_dir):
+                    continue
+                used_at = self._load_slot_info(slot_dir)["used_at"]
+                if (keep_count is not None and index >= keep_count) or (
+                    max_age is not None and time.time() - used_at > max_age
+                ):
+                    log.info(f"Removing SDK slot {slot_dir.name}")
+                    remove_tree(slot_dir)
+            for tree_dir in self.sdk_trees_dir.iterdir():
+                # Current slot is kept even if its in-place update was interrupted
+                if self.is_current_slot(tree_dir):
+                    continue
+                if os.path.realpath(tree_dir) not in complete_dirs:
+                    remove_tree(tree_dir)
+
+    def remove_current_sdk(self) -> None:
+        with FileLock(self.lock_file):
+            if os.path.lexists(self.current_sdk_dir):
+                if self._is_current_sdk_linked():
+                    os.unlink(self.current_sdk_dir)
+                else:
+                    remove_tree(self.current_sdk_dir)
+            remove_tree(self.sdk_trees_dir)
+
+    def deploy(self, task: SdkDeployTask) -> bool:
+        with Timings.span("deploy", target=task.hw_target, mode=task.mode) as span:
+            deployed = self._deploy(task)
+            span.set(deployed=deployed)
+            return deployed
+
+    def _deploy(self, task: SdkDeployTask) -> bool:
+        log.info(f"Deploying SDK for {task.hw_target}")
+        if (
+            not task.force
+            and (slot_dir := self._find_slot(task))
+            and self.is_current_slot(slot_dir)
+        ):
+            log.info("SDK is up-to-date, skipping update check")
+            return True
+
+        # Concurrent deploys to the same state dir are serialized. A process
+        # waiting for another one to finish will usually find SDK up-to-date
+        with FileLock(self.lock_file):
+            return self._deploy_locked(task)
+
+    def _deploy_locked(self, task: SdkDeployTask) -> bool:
+        if not task.force and (slot_dir := self._find_slot(task)):
+            log.info(f"Using installed SDK {slot_dir.name}, skipping update check")
+            self._activate_slot(slot_dir, checked=False)
+            return True
+
+        # Loaders fetch their indexes on creation
+        with Timings.span("resolve_version") as span:
+            sdk_loader = SdkLoaderFactory.create_for_task(task, self.download_dir)
+            version = sdk_loader.get_metadata().get("version")
+            span.set(version=version)
+
+        log.info(f"uFBT SDK dir: {self.current_sdk_dir.absolute()}")
+        if task.force:
+            pass
+        elif version in sdk_loader.ALWAYS_UPDATE_VERSIONS:
+            log.info("Cannot determine SDK version, updating")
+        elif slot_dir := self._find_slot(task, version):
+            log.info(f"SDK is up-to-date, using installed SDK {slot_dir.name}")
+            self._activate_slot(slot_dir, checked=True)
+            return True
 
         try:
             sdk_component_path = sdk_loader.get_sdk_component(task.hw_target)
@@ -545,8 +2748,6 @@ class UfbtSdkDeployer:
             log.error(f"Failed to fetch SDK for {task.hw_target}: {e}")
             return False
 
-        shutil.rmtree(sdk_target_dir, ignore_errors=True)
-
         ufbt_state = {
             "hw_target": task.hw_target,
             **sdk_loader.get_metadata(),
@@ -554,15 +2755,208 @@ class UfbtSdkDeployer:
 
         log.info("Deploying SDK")
 
-        with ZipFile(sdk_component_path, "r") as zip_file:
-            zip_file.extractall(sdk_target_dir)
+        previous_sdk_dir = self.current_sdk_dir.resolve()
+        slot_name = re.sub(r"[^\w.-]+", "_", f"{task.mode}-{version}-{task.hw_target}")
+        with Timings.span("stage", slot=slot_name):
+            slot_dir = self._install_files(sdk_component_path, task.force, slot_name)
+        with Timings.span("activate"):
+            # State file marks slot as complete, so it is written last
+            with open(slot_dir / self.UFBT_STATE_FILE_NAME, "w") as f:
+                json.dump(ufbt_state, f, indent=4)
+            self._activate_slot(slot_dir, checked=True)
+        with Timings.span("cleanup"):
+            self._remove_stale_sdk_trees(slot_dir, [slot_dir, previous_sdk_dir])
 
-        with open(self.state_file, "w") as f:
-            json.dump(ufbt_state, f, indent=4)
         log.info("SDK deployed.")
         return True
 
 
+class SdkMirror:
+    """
+    Copy of SDK indexes and archives from update server, to be served to
+    other uFBT instances. Indexes are rewritten to refer to archives in
+    mirror with relative URLs. Layout:
+      directory.json              - channel index, with latest versions only
+      files/<version>/<archive>   - SDK archives of channels
+      builds/<branch>/index.html  - branch page, with its SDK archives
+    """
+
+    INDEX_FILE_NAME = "directory.json"
+    FILES_SUBDIR = "files"
+    BRANCHES_SUBDIR = "builds"
+    BRANCH_INDEX_FILE_NAME = "index.html"
+
+    def __init__(self, mirror_dir: str, download_dir: str):
+        self.mirror_dir = Path(mirror_dir)
+        self.download_dir = download_dir
+        self.lock_file = self.mirror_dir / ".lock"
+
+    @staticmethod
+    def _publish(dst_path: Path, src_path: str = None, data: bytes = None) -> None:
+        # Files appear complete, so mirror can be served while syncing
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dst_path.with_name(f".{dst_path.name}.{uuid.uuid4().hex[:8]}")
+        if src_path:
+            link_or_copy_file(src_path, str(tmp_path))
+        else:
+            tmp_path.write_bytes(data)
+        os.replace(tmp_path, dst_path)
+
+    def _get_branch_dir(self, branch: str) -> PurePosixPath:
+        branch_path = PurePosixPath(branch)
+        if any(part in (".", "..") for part in branch_path.parts) or (
+            branch_path.is_absolute()
+        ):
+            raise ValueError(f"Invalid branch name {branch}")
+        return PurePosixPath(self.BRANCHES_SUBDIR) / branch_path
+
+    def get_archive_path(self, sdk_loader: BaseSdkLoader, hw_target: str):
+        """Returns path of SDK archive in mirror, None if there is no SDK"""
+        version = sdk_loader.get_metadata()["version"]
+        if isinstance(sdk_loader, BranchSdkLoader):
+            if (FileType.SDK_ZIP, hw_target) not in sdk_loader._branch_files:
+                return None
+            return self._get_branch_dir(sdk_loader.get_metadata()["branch"]) / (
+                f"flipper-z-{hw_target}-sdk-{version}.zip"
+            )
+        try:
+            file_info = UpdateChannelSdkLoader._get_file_info(
+                sdk_loader.version_info, FileType.SDK_ZIP, hw_target
+            )
+        except ValueError:
+            return None
+        file_name = PurePosixPath(unquote(urlparse(file_info["url"]).path)).name
+        return (
+            PurePosixPath(self.FILES_SUBDIR)
+            / re.sub(r"[^\w.-]+", "_", version)
+            / file_name
+        )
+
+    def fetch_archive(self, sdk_loader: BaseSdkLoader, hw_target: str) -> None:
+        # Archive path includes version, so existing archive is up-to-date
+        archive_path = self.get_archive_path(sdk_loader, hw_target)
+        if not (self.mirror_dir / archive_path).exists():
+            self._publish(
+                self.mirror_dir / archive_path,
+                src_path=sdk_loader.get_sdk_component(hw_target),
+            )
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.mirror_dir / self.INDEX_FILE_NAME, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"channels": []}
+
+    def update_indexes(
+        self, sdk_loaders: List[BaseSdkLoader], hw_targets: List[str]
+    ) -> None:
+        """Points indexes to archives of given loaders, removes unused archives"""
+        index = self._load_index()
+        channels = {channel["id"]: channel for channel in index["channels"]}
+        for sdk_loader in sdk_loaders:
+            if isinstance(sdk_loader, BranchSdkLoader):
+                self._update_branch_index(sdk_loader)
+                continue
+            version_info = sdk_loader.version_info
+            files = [
+                {**file_info, "url": str(archive_path)}
+                for file_info in version_info.get("files", [])
+                if file_info.get("type") == FileType.SDK_ZIP.value
+                and file_info.get("target") in hw_targets
+                and (
+                    archive_path := self.get_archive_path(
+                        sdk_loader, file_info["target"]
+                    )
+                )
+            ]
+            # Targets synced earlier are kept while version is the same
+            if (
+                previous_channel := channels.get(sdk_loader.channel.value)
+            ) and previous_channel["versions"][0]["version"] == version_info["version"]:
+                files += [
+                    file_info
+                    for file_info in previous_channel["versions"][0]["files"]
+                    if file_info["target"] not in hw_targets
+                ]
+            channels[sdk_loader.channel.value] = {
+                "id": sdk_loader.channel.value,
+                "versions": [{**version_info, "files": files}],
+            }
+
+        index["channels"] = list(channels.values())
+        self._publish(
+            self.mirror_dir / self.INDEX_FILE_NAME,
+            data=json.dumps(index, indent=4).encode(),
+        )
+        used_files = {
+            self.mirror_dir / file_info["url"]
+            for channel in index["channels"]
+            for file_info in channel["versions"][0]["files"]
+        }
+        self._remove_unused_files(self.mirror_dir / self.FILES_SUBDIR, used_files)
+
+    def _update_branch_index(self, sdk_loader: BranchSdkLoader) -> None:
+        version = sdk_loader.get_metadata()["version"]
+        branch_dir = self.mirror_dir / self._get_branch_dir(
+            sdk_loader.get_metadata()["branch"]
+        )
+        file_names = sorted(
+            file_path.name
+            for file_path in branch_dir.glob(
+                f"flipper-z-*-sdk-{glob.escape(version)}.zip"
+            )
+        )
+        links = "".join(
+            f'<a href="{file_name}">{file_name}</a><br>\n' for file_name in file_names
+        )
+        self._publish(
+            branch_dir / self.BRANCH_INDEX_FILE_NAME,
+            data=f"<html><body>\n{links}</body></html>\n".encode(),
+        )
+        self._remove_unused_files(
+            branch_dir,
+            {branch_dir / self.BRANCH_INDEX_FILE_NAME}
+            | {branch_dir / file_name for file_name in file_names},
+            recursive=False,
+        )
+
+    @staticmethod
+    def _remove_unused_files(root_dir: Path, used_files, recursive=True) -> None:
+        # Clients that have read previous index may still be downloading
+        # old archives, so they are removed only after index is replaced
+        if not root_dir.is_dir():
+            return
+        for file_path in root_dir.rglob("*") if recursive else root_dir.iterdir():
+            if file_path.name.startswith("."):
+                # Being published by another sync
+                continue
+            if file_path.is_file() and file_path not in used_files:
+                log.info(f"Removing {file_path.relative_to(root_dir)} from mirror")
+                file_path.unlink()
+        if recursive:
+            for dir_path in sorted(root_dir.rglob("*"), reverse=True):
+                if dir_path.is_dir() and not any(dir_path.iterdir()):
+                    dir_path.rmdir()
+
+    def make_server(self, bind: str, port: int):
+        from functools import partial
+        from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+        class MirrorRequestHandler(SimpleHTTPRequestHandler):
+            def send_head(self):
+                # Last-Modified has a resolution of one second, so an index
+                # replaced within a second of a request would not be sent again
+                del self.headers["If-Modified-Since"]
+                return super().send_head()
+
+            def log_message(self, format, *args):
+                log.debug(f"{self.address_string()} {format % args}")
+
+        handler = partial(MirrorRequestHandler, directory=str(self.mirror_dir))
+        return ThreadingHTTPServer((bind, port), handler)
+
+
 ###############################################################################
 
 
@@ -573,7 +2967,7 @@ class CliSubcommand:
 
     def add_to_parser(self, parser: argparse.ArgumentParser):
         subparser = parser.add_parser(self.name, help=self.help)
-        subparser.set_defaults(func=self._func)
+        subparser.set_defaults(func=self._func, command=self.name)
         self._add_arguments(subparser)
 
     def _func(args) -> int:
@@ -602,11 +2996,29 @@ class UpdateSubcommand(CliSubcommand):
             "--index-url",
             help="URL to use for SDK discovery",
         )
+        parser.add_argument(
+            "--offline",
+            help="Do not access network, use deployed SDK or cached downloads",
+            action="store_true",
+            default=bool(os.environ.get("UFBT_OFFLINE")),
+        )
+        parser.add_argument(
+            "--check-interval",
+            help="Skip update check if last one was less than this many seconds ago",
+            type=int,
+            default=int(
+                os.environ.get(
+                    "UFBT_UPDATE_CHECK_INTERVAL", UfbtSdkDeployer.UPDATE_CHECK_INTERVAL
+                )
+            ),
+        )
         mode_group = parser.add_mutually_exclusive_group(required=False)
         for loader_cls in all_boostrap_loader_cls:
             loader_cls.add_args_to_mode_group(mode_group)
 
     def _func(self, args) -> int:
+        BaseSdkLoader.OFFLINE = args.offline
+        UfbtSdkDeployer.UPDATE_CHECK_INTERVAL = args.check_interval
         sdk_deployer = UfbtSdkDeployer(args.ufbt_home)
 
         task_to_deploy = sdk_deployer.get_previous_task() or SdkDeployTask.default()
@@ -615,6 +3027,282 @@ class UpdateSubcommand(CliSubcommand):
         return 0 if sdk_deployer.deploy(task_to_deploy) else 1
 
 
+class PrefetchSubcommand(CliSubcommand):
+    COMMAND = "prefetch"
+    MAX_JOBS = 8
+
+    def __init__(self):
+        super().__init__(self.COMMAND, "Download SDKs for multiple targets and sources")
+
+    def _add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.description = """Download SDKs for all combinations of given hardware targets
+        and channels or branches into download cache, without changing current SDK.
+        By default uses the last used target and mode."""
+
+        parser.add_argument(
+            "--hw-target",
+            "-t",
+            help="Hardware target, can be repeated",
+            action="append",
+        )
+        parser.add_argument(
+            "--channel",
+            "-c",
+            help="Channel to load SDK from, can be repeated",
+            action="append",
+            choices=[c.name.lower() for c in UpdateChannelSdkLoader.UpdateChannel],
+        )
+        parser.add_argument(
+            "--branch",
+            "-b",
+            help="Branch to load SDK from, can be repeated",
+            action="append",
+        )
+        parser.add_argument(
+            "--index-url",
+            help="URL to use for SDK discovery",
+        )
+        parser.add_argument(
+            "--jobs",
+            "-j",
+            help="Maximum number of concurrent index and SDK downloads",
+            type=int,
+            default=self.MAX_JOBS,
+        )
+
+    def _func(self, args) -> int:
+        sdk_deployer = UfbtSdkDeployer(args.ufbt_home)
+        default_task = sdk_deployer.get_previous_task() or SdkDeployTask.default()
+
+        tasks = [
+            SdkDeployTask(
+                mode=UpdateChannelSdkLoader.LOADER_MODE_KEY,
+                all_params={"channel": channel, "json_index": args.index_url},
+            )
+            for channel in args.channel or []
+        ] + [
+            SdkDeployTask(
+                mode=BranchSdkLoader.LOADER_MODE_KEY,
+                all_params={"branch": branch, "branch_root": args.index_url},
+            )
+            for branch in args.branch or []
+        ]
+        hw_targets = args.hw_target or [default_task.hw_target]
+        if not tasks:
+            tasks = [default_task]
+
+        # Loaders resolve their indexes concurrently, SDK downloads are
+        # started as soon as their loader is ready
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            loader_futures = {
+                executor.submit(
+                    SdkLoaderFactory.create_for_task, task, sdk_deployer.download_dir
+                ): f"{task.mode} {task.all_params.get(task.mode, '')}".strip()
+                for task in tasks
+            }
+            download_futures = {}
+            for future in as_completed(loader_futures):
+                source_name = loader_futures[future]
+                try:
+                    sdk_loader = future.result()
+                except Exception as e:
+                    log.error(f"Failed to resolve SDK for {source_name}: {e}")
+                    failed.append(source_name)
+                    continue
+                for hw_target in hw_targets:
+                    download_futures[
+                        executor.submit(
+                            self._prefetch, sdk_deployer, sdk_loader, hw_target
+                        )
+                    ] = f"{source_name} for {hw_target}"
+
+            for future in as_completed(download_futures):
+                task_name = download_futures[future]
+                try:
+                    future.result()
+                    log.info(f"Prefetched SDK {task_name}")
+                except Exception as e:
+                    log.error(f"Failed to prefetch SDK {task_name}: {e}")
+                    failed.append(task_name)
+
+        return 1 if failed else 0
+
+    @staticmethod
+    def _prefetch(
+        sdk_deployer: UfbtSdkDeployer, sdk_loader: BaseSdkLoader, hw_target: str
+    ) -> None:
+        sdk_component_path = sdk_loader.get_sdk_component(hw_target)
+        if sdk_deployer.sdk_store:
+            # Files are imported into SDK store, so deploy only links them
+            sdk_deployer.get_archive_manifest(sdk_component_path)
+
+
+class MirrorSubcommand(CliSubcommand):
+    COMMAND = "mirror"
+    MAX_JOBS = 8
+
+    def __init__(self):
+        super().__init__(self.COMMAND, "Sync and serve a mirror of SDK update server")
+
+    def _add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.description = """Download latest SDKs of given channels and branches
+        for given hardware targets into mirror directory, with indexes referring
+        to them. Other uFBT instances can use mirror served over HTTP with
+        `ufbt update --index-url=<mirror url>/directory.json` for channels,
+        or `--index-url=<mirror url>/builds` for branches.
+        By default mirrors release channel for f7 target."""
+
+        parser.add_argument("mirror_dir", help="Mirror directory")
+        parser.add_argument(
+            "--hw-target",
+            "-t",
+            help="Hardware target, can be repeated",
+            action="append",
+        )
+        parser.add_argument(
+            "--channel",
+            "-c",
+            help="Channel to mirror, can be repeated",
+            action="append",
+            choices=[c.name.lower() for c in UpdateChannelSdkLoader.UpdateChannel],
+        )
+        parser.add_argument(
+            "--branch",
+            "-b",
+            help="Branch to mirror, can be repeated",
+            action="append",
+        )
+        parser.add_argument(
+            "--index-url",
+            help="URL of upstream channel index",
+        )
+        parser.add_argument(
+            "--branch-root-url",
+            help="URL of upstream branch directory",
+        )
+        parser.add_argument(
+            "--jobs",
+            "-j",
+            help="Maximum number of concurrent index and SDK downloads",
+            type=int,
+            default=self.MAX_JOBS,
+        )
+        parser.add_argument(
+            "--serve",
+            help="Serve mirror over HTTP after syncing",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--bind",
+            help="Address to serve mirror on, all interfaces by default",
+            default="",
+        )
+        parser.add_argument(
+            "--port",
+            help="Port to serve mirror on",
+            type=int,
+            default=8000,
+        )
+        parser.add_argument(
+            "--sync-interval",
+            help="When serving, sync mirror again every this many seconds",
+            type=int,
+            default=0,
+        )
+
+    def _sync(self, args, sdk_mirror: SdkMirror) -> int:
+        if not (channels := args.channel) and not args.branch:
+            channels = [UpdateChannelSdkLoader.UpdateChannel.RELEASE.name.lower()]
+        tasks = [
+            SdkDeployTask(
+                mode=UpdateChannelSdkLoader.LOADER_MODE_KEY,
+                all_params={"channel": channel, "json_index": args.index_url},
+            )
+            for channel in channels or []
+        ] + [
+            SdkDeployTask(
+                mode=BranchSdkLoader.LOADER_MODE_KEY,
+                all_params={"branch": branch, "branch_root": args.branch_root_url},
+            )
+            for branch in args.branch or []
+        ]
+        hw_targets = args.hw_target or [SdkDeployTask.DEFAULT_HW_TARGET]
+
+        # Sources are resolved and downloaded concurrently. Index of a source
+        # is updated only when all of its archives are in place
+        failed = []
+        synced_loaders = []
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            loader_futures = {
+                executor.submit(
+                    SdkLoaderFactory.create_for_task, task, sdk_mirror.download_dir
+                ): f"{task.mode} {task.all_params.get(task.mode, '')}".strip()
+                for task in tasks
+            }
+            download_futures = {}
+            for future in as_completed(loader_futures):
+                source_name = loader_futures[future]
+                try:
+                    sdk_loader = future.result()
+                except Exception as e:
+                    log.error(f"Failed to resolve SDK for {source_name}: {e}")
+                    failed.append(source_name)
+                    continue
+                download_futures[sdk_loader] = [
+                    executor.submit(sdk_mirror.fetch_archive, sdk_loader, hw_target)
+                    for hw_target in hw_targets
+                    if sdk_mirror.get_archive_path(sdk_loader, hw_target)
+                ]
+                if not download_futures[sdk_loader]:
+                    log.warning(f"No SDK for {', '.join(hw_targets)} in {source_name}")
+
+            for sdk_loader, futures in download_futures.items():
+                metadata = sdk_loader.get_metadata()
+                source_name = f"{metadata['mode']} {metadata.get(metadata['mode'])}"
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception as e:
+                    log.error(f"Failed to mirror SDK for {source_name}: {e}")
+                    failed.append(source_name)
+                    continue
+                log.info(f"Mirrored {source_name}, version {metadata['version']}")
+                synced_loaders.append(sdk_loader)
+
+        with FileLock(sdk_mirror.lock_file):
+            sdk_mirror.update_indexes(synced_loaders, hw_targets)
+        return 1 if failed else 0
+
+    def _func(self, args) -> int:
+        sdk_deployer = UfbtSdkDeployer(args.ufbt_home)
+        sdk_mirror = SdkMirror(args.mirror_dir, str(sdk_deployer.download_dir))
+        result = self._sync(args, sdk_mirror)
+        if not args.serve:
+            return result
+
+        if args.sync_interval > 0:
+
+            def sync_periodically() -> None:
+                while True:
+                    time.sleep(args.sync_interval)
+                    try:
+                        self._sync(args, sdk_mirror)
+                    except Exception as e:
+                        log.error(f"Failed to sync mirror: {e}")
+
+            threading.Thread(target=sync_periodically, daemon=True).start()
+
+        with sdk_mirror.make_server(args.bind, args.port) as server:
+            log.info(f"Serving mirror on {args.bind or '*'}:{server.server_address[1]}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return result
+
+
 class CleanSubcommand(CliSubcommand):
     COMMAND = "clean"
 
@@ -636,22 +3324,40 @@ class CleanSubcommand(CliSubcommand):
             action="store_true",
             default=False,
         )
+        parser.add_argument(
+            "--keep-slots",
+            help="Remove all but this many most recently used SDK slots",
+            type=int,
+        )
+        parser.add_argument(
+            "--max-slot-age",
+            help="Remove SDK slots not used for this many days",
+            type=float,
+        )
 
     def _func(self, args) -> int:
         sdk_deployer = UfbtSdkDeployer(args.ufbt_home)
         log.info("If you want to clean build artifacts, use 'ufbt -c', not 'clean'")
         if args.purge:
             log.info(f"Cleaning complete ufbt state in {sdk_deployer.ufbt_state_dir}")
-            shutil.rmtree(sdk_deployer.ufbt_state_dir, ignore_errors=True)
+            remove_tree(sdk_deployer.ufbt_state_dir)
+            # Store outside of state dir may be used by other state dirs
+            sdk_deployer.collect_store_garbage()
             log.info("Done")
-            return
+            return 0
 
-        if args.downloads:
+        if args.keep_slots is not None or args.max_slot_age is not None:
+            log.info(f"Pruning SDK slots in {sdk_deployer.sdk_trees_dir}")
+            max_age = args.max_slot_age and args.max_slot_age * 24 * 3600
+            sdk_deployer.prune_slots(args.keep_slots, max_age)
+        elif args.downloads:
             log.info(f"Cleaning download dir {sdk_deployer.download_dir}")
             shutil.rmtree(sdk_deployer.download_dir, ignore_errors=True)
         else:
             log.info(f"Cleaning SDK state in {sdk_deployer.current_sdk_dir}")
-            shutil.rmtree(sdk_deployer.current_sdk_dir, ignore_errors=True)
+            sdk_deployer.remove_current_sdk()
+        # Archives and files no longer used are removed from SDK store
+        sdk_deployer.collect_store_garbage()
         log.info("Done")
         return 0
 
@@ -662,8 +3368,13 @@ class StatusSubcommand(CliSubcommand):
         "ufbt_version": "uFBT version",
         "state_dir": "State dir",
         "download_dir": "Download dir",
+        "download_cache": "Download cache",
+        "artifact_cache": "Artifact cache",
+        "store_dir": "SDK store",
+        "store": "SDK store usage",
         "toolchain_dir": "Toolchain dir",
         "sdk_dir": "SDK dir",
+        "slots": "SDK slots",
         "target": "Target",
         "mode": "Mode",
         "version": "Version",
@@ -671,9 +3382,24 @@ class StatusSubcommand(CliSubcommand):
         "error": "Error",
     }
 
+    # Cache and store stats, shown as a line of counters
+    USAGE_FIELDS = ("download_cache", "artifact_cache", "store")
+
     def __init__(self):
         super().__init__(self.COMMAND, "Show uFBT SDK status")
 
+    @staticmethod
+    def _format_usage(usage: dict) -> str:
+        counters = [
+            format_size(value) if name == "size" else f"{value} {name}"
+            for name, value in usage.items()
+            if name != "dir"
+        ]
+        usage_str = ", ".join(counters)
+        if cache_dir := usage.get("dir"):
+            usage_str = f"{cache_dir}: {usage_str}"
+        return usage_str
+
     def _add_arguments(self, parser: argparse.ArgumentParser) -> None:
         parser.description = """Show uFBT status - deployment paths and SDK version."""
 
@@ -692,15 +3418,42 @@ class StatusSubcommand(CliSubcommand):
         )
 
     def _func(self, args) -> int:
+        from .artifacts import ArtifactCache
+
         ufbt_version = get_ufbt_package_version()
+        artifact_cache = ArtifactCache.get_default()
 
         sdk_deployer = UfbtSdkDeployer(args.ufbt_home)
         state_data = {
             "ufbt_version": ufbt_version,
             "state_dir": str(sdk_deployer.ufbt_state_dir.absolute()),
             "download_dir": str(sdk_deployer.download_dir.absolute()),
+            "download_cache": DownloadCache(str(sdk_deployer.download_dir)).stats(),
+            "artifact_cache": (
+                {"dir": artifact_cache.cache_dir, **artifact_cache.stats()}
+                if artifact_cache
+                else None
+            ),
+            "store_dir": (
+                str(sdk_deployer.sdk_store.store_dir.absolute())
+                if sdk_deployer.sdk_store
+                else None
+            ),
+            "store": (
+                sdk_deployer.sdk_store.stats() if sdk_deployer.sdk_store else None
+            ),
             "sdk_dir": str(sdk_deployer.current_sdk_dir.absolute()),
             "toolchain_dir": str(sdk_deployer.toolchain_dir.absolute()),
+            "slots": [
+                {
+                    "name": slot_dir.name,
+                    "target": slot_state.get("hw_target"),
+                    "mode": slot_state.get("mode"),
+                    "version": slot_state.get("version"),
+                    "current": sdk_deployer.is_current_slot(slot_dir),
+                }
+                for slot_dir, slot_state in sdk_deployer.list_slots()
+            ],
         }
 
         if previous_task := sdk_deployer.get_previous_task():
@@ -732,6 +3485,14 @@ class StatusSubcommand(CliSubcommand):
             else:
                 skip_error_message = True
                 for key, value in state_data.items():
+                    if key == "slots":
+                        log.info(f"{self.STATUS_FIELDS[key]:<15} {len(value)}")
+                        for slot in value:
+                            marker = "*" if slot["current"] else " "
+                            log.info(f"{'':<14}{marker} {slot['name']}")
+                        continue
+                    if key in self.USAGE_FIELDS and value:
+                        value = self._format_usage(value)
                     log.info(f"{self.STATUS_FIELDS[key]:<15} {value}")
 
         if state_data.get("error"):
@@ -820,14 +3581,14 @@ class LocalEnvSubcommand(CliSubcommand):
 
 bootstrap_subcommand_classes = (
     UpdateSubcommand,
+    PrefetchSubcommand,
+    MirrorSubcommand,
     CleanSubcommand,
     StatusSubcommand,
     LocalEnvSubcommand,
 )
 
-bootstrap_subcommands = (
-    subcommand_cls.COMMAND for subcommand_cls in bootstrap_subcommand_classes
-)
+bootstrap_subcommands = BOOTSTRAP_SUBCOMMANDS
 
 
 def bootstrap_cli(cmdline_args=None) -> Optional[int]:
@@ -850,6 +3611,53 @@ def bootstrap_cli(cmdline_args=None) -> Optional[int]:
         help="uFBT state directory",
         default=os.environ.get("UFBT_HOME", DEFAULT_UFBT_HOME),
     )
+    root_parser.add_argument(
+        "--store-dir",
+        help="Directory of SDK store, shared by state directories, 'store' in "
+        f"{DEFAULT_UFBT_HOME} by default. Empty to disable",
+        default=os.environ.get("UFBT_STORE_DIR"),
+    )
+    root_parser.add_argument(
+        "--store-size",
+        help="SDK store size limit, in MB",
+        type=int,
+        default=int(os.environ.get("UFBT_STORE_SIZE", SdkStore.MAX_SIZE_MB)),
+    )
+    root_parser.add_argument(
+        "--download-cache-size",
+        help="Download cache size limit, in MB",
+        type=int,
+        default=int(
+            os.environ.get("UFBT_DOWNLOAD_CACHE_SIZE", DownloadCache.MAX_SIZE_MB)
+        ),
+    )
+    root_parser.add_argument(
+        "--index-ttl",
+        help="Time in seconds during which cached SDK indexes are used without revalidation",
+        type=int,
+        default=int(os.environ.get("UFBT_INDEX_TTL", IndexCache.TTL_SECONDS)),
+    )
+    root_parser.add_argument(
+        "--download-connections",
+        help="Number of parallel connections for downloading large files",
+        type=int,
+        default=int(
+            os.environ.get(
+                "UFBT_DOWNLOAD_CONNECTIONS", BaseSdkLoader.DOWNLOAD_CONNECTIONS
+            )
+        ),
+    )
+    root_parser.add_argument(
+        "--timings",
+        help="Print durations of operation phases in JSON format to stderr",
+        action="store_true",
+        default=os.environ.get("UFBT_TIMINGS", "0") not in ("", "0"),
+    )
+    root_parser.add_argument(
+        "--timings-file",
+        help="Append durations of operation phases in JSON format to file",
+        default=os.environ.get("UFBT_TIMINGS_FILE"),
+    )
     root_parser.add_argument(
         "--force",
         "-f",
@@ -865,13 +3673,26 @@ def bootstrap_cli(cmdline_args=None) -> Optional[int]:
     )
 
     parsers = root_parser.add_subparsers()
-    for subcommand_cls in bootstrap_subcommand_classes:
-        subcommand_cls().add_to_parser(parsers)
+    subcommand_classes = {cls.COMMAND: cls for cls in bootstrap_subcommand_classes}
+    for command in BOOTSTRAP_SUBCOMMANDS:
+        subcommand_classes[command]().add_to_parser(parsers)
 
     args = root_parser.parse_args(cmdline_args)
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    SdkStore.STORE_DIR = (
+        os.path.join(DEFAULT_UFBT_HOME, SdkStore.STORE_SUBDIR)
+        if args.store_dir is None
+        else args.store_dir
+    )
+    SdkStore.MAX_SIZE_MB = args.store_size
+    DownloadCache.MAX_SIZE_MB = args.download_cache_size
+    IndexCache.TTL_SECONDS = args.index_ttl
+    BaseSdkLoader.DOWNLOAD_CONNECTIONS = args.download_connections
+    Timings.ENABLED = args.timings or bool(args.timings_file)
+    Timings.OUTPUT_FILE = args.timings_file
+
     if args.no_check_certificate:
         # Temporary fix for SSL negotiation failure on Mac
         import ssl
@@ -885,8 +3706,11 @@ def bootstrap_cli(cmdline_args=None) -> Optional[int]:
         root_parser.print_help()
         return 1
 
+    Timings.reset()
+    exit_code = 2
     try:
-        return args.func(args)
+        exit_code = args.func(args)
+        return exit_code
 
     except Exception as e:
         log.error(f"Failed to run operation: {e}. See --verbose for details")
@@ -894,6 +3718,9 @@ def bootstrap_cli(cmdline_args=None) -> Optional[int]:
             raise
         return 2
 
+    finally:
+        Timings.emit(command=args.command, exit_code=exit_code)
+
 
 if __name__ == "__main__":
     sys.exit(bootstrap_cli() or 0)
@@ -0,0 +1,395 @@
+#
+# Opt-in build daemon for uFBT. Keeps SCons imported in a long-lived process
+# running in toolchain environment, and runs each build in a forked child.
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Only interpreter startup and SCons import are saved this way. Each build
+# still reads SConstruct and SConscripts of the SDK and builds its dependency
+# graph from scratch, as SCons state cannot be reused between runs.
+#
+# Client side is imported by `ufbt` entry point, server side is run as a script
+# by toolchain Python, so this module only uses the standard library.
+#
+# Protocol, one connection per build: client sends a JSON request line with
+# its stdin, stdout and stderr attached (SCM_RIGHTS), so build output goes
+# straight to its terminal. Then client may send "signal <num>" lines to
+# forward signals, and daemon replies with "exit <code>" when build is done,
+# or "restart" if the SDK has changed since daemon start.
+
+import array
+import fcntl
+import hashlib
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DAEMON_SUBDIR = "daemon"
+IDLE_TIMEOUT = 900
+SPAWN_TIMEOUT = 600
+REQUEST_TIMEOUT = 10
+# Unix socket paths are limited to 104-108 bytes, depending on platform
+MAX_SOCKET_PATH_LENGTH = 100
+
+
+def get_daemon_key(state_dir: str, app_dir: str) -> str:
+    # One daemon serves one state dir and app dir
+    return hashlib.sha256(f"{state_dir}\0{app_dir}".encode()).hexdigest()[:16]
+
+
+def get_socket_path(state_dir: str, daemon_key: str) -> str:
+    socket_dir = os.path.join(state_dir, DAEMON_SUBDIR)
+    if len(os.path.join(socket_dir, f"{daemon_key}.sock")) > MAX_SOCKET_PATH_LENGTH:
+        socket_dir = os.path.join(tempfile.gettempdir(), f"ufbt-{os.getuid()}")
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    if os.stat(socket_dir).st_uid != os.getuid():
+        raise RuntimeError(f"Daemon socket dir {socket_dir} is owned by another user")
+    return os.path.join(socket_dir, f"{daemon_key}.sock")
+
+
+def _connect(socket_path: str):
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client_socket.connect(socket_path)
+    except OSError:
+        client_socket.close()
+        return None
+    return client_socket
+
+
+def _spawn_daemon(state_dir: str, socket_path: str, toolchain_env: dict, env_key: str):
+    # Daemon is started in toolchain environment, detached from client's
+    # session. Waits until it accepts connections
+    log_path = os.path.join(state_dir, DAEMON_SUBDIR, "daemon.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "ab") as log_file:
+        daemon_process = subprocess.Popen(
+            [
+                toolchain_env["python"],
+                os.path.abspath(__file__),
+                socket_path,
+                os.path.join(state_dir, "current"),
+                env_key,
+                str(int(os.environ.get("UFBT_DAEMON_IDLE_TIMEOUT", IDLE_TIMEOUT))),
+            ],
+            env=toolchain_env["env"],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + SPAWN_TIMEOUT
+    while time.monotonic() < deadline:
+        if client_socket := _connect(socket_path):
+            return client_socket
+        if daemon_process.poll() is not None:
+            break
+        time.sleep(0.02)
+    print(f"Failed to start uFBT daemon, see {log_path}", file=sys.stderr)
+    return None
+
+
+def run_in_daemon(state_dir: str, app_dir: str, scons_args: list, toolchain_env: dict):
+    """
+    Runs SCons with scons_args in build daemon for app_dir, starting it
+    in toolchain_env if needed. Returns exit code, or None if daemon
+    could not be used.
+    """
+    from .fbtenv import get_env_key
+
+    socket_path = get_socket_path(state_dir, get_daemon_key(state_dir, app_dir))
+    # Daemon runs builds in environment it was started in
+    request = {
+        "cwd": app_dir,
+        "argv": scons_args,
+        "env_key": get_env_key(toolchain_env["env"]),
+    }
+    for _ in range(2):
+        if not (client_socket := _connect(socket_path)):
+            # Concurrent clients wait for a single daemon to start
+            with open(f"{socket_path}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not (client_socket := _connect(socket_path)):
+                    if os.path.exists(socket_path):
+                        # Left by a daemon that did not exit cleanly
+                        os.unlink(socket_path)
+                    client_socket = _spawn_daemon(
+                        state_dir, socket_path, toolchain_env, request["env_key"]
+                    )
+            if not client_socket:
+                return None
+        with client_socket:
+            reply = _run_request(client_socket, request)
+        if reply != "restart":
+            return reply
+    return None
+
+
+def _run_request(client_socket, request: dict):
+    try:
+        client_socket.sendmsg(
+            [json.dumps(request).encode() + b"\n"],
+            [
+                (
+                    socket.SOL_SOCKET,
+                    socket.SCM_RIGHTS,
+                    array.array("i", [0, 1, 2]).tobytes(),
+                )
+            ],
+        )
+    except OSError:
+        # Daemon exited after accepting connection
+        return "restart"
+
+    # Signals from terminal reach only this process, build runs in daemon
+    def forward_signal(signum, frame):
+        client_socket.sendall(f"signal {signum}\n".encode())
+
+    forwarded_signals = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+    previous_handlers = {
+        signum: signal.signal(signum, forward_signal) for signum in forwarded_signals
+    }
+    try:
+        reply = client_socket.makefile("r").readline().split()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    if reply and reply[0] == "exit":
+        return int(reply[1])
+    if reply == ["restart"]:
+        return "restart"
+    # Connection lost, build process was terminated with daemon
+    return 1
+
+
+##############################################################################
+
+
+def get_sdk_signature(current_sdk_dir: str):
+    # Changes when SDK is switched to another slot or redeployed in place
+    try:
+        state_stat = os.stat(os.path.join(current_sdk_dir, "ufbt_state.json"))
+    except OSError:
+        state_stat = None
+    return (
+        os.path.realpath(current_sdk_dir),
+        state_stat and (state_stat.st_ino, state_stat.st_mtime_ns),
+    )
+
+
+def _receive_request(connection):
+    fds = array.array("i")
+    data, ancdata, _, _ = connection.recvmsg(65536, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[: len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    while data and not data.endswith(b"\n"):
+        if not (chunk := connection.recv(65536)):
+            break
+        data += chunk
+    return json.loads(data), list(fds)
+
+
+def _run_scons(request: dict, fds: list) -> None:
+    # Runs in forked build process, never returns
+    try:
+        os.setpgid(0, 0)
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+        sys.__stdin__, sys.__stdout__, sys.__stderr__ = (
+            sys.stdin,
+            sys.stdout,
+            sys.stderr,
+        )
+        os.chdir(request["cwd"])
+        # Same as for `python -m SCons`
+        sys.path[0] = request["cwd"]
+        sys.argv = ["scons", *request["argv"]]
+        exit_code = 0
+        try:
+            import SCons.Script
+
+            SCons.Script.main()
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                exit_code = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+    except BaseException as e:
+        print(f"uFBT daemon: build failed: {e}", file=sys.stderr)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def _reply_restart(connection) -> None:
+    try:
+        _, fds = _receive_request(connection)
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(b"restart\n")
+    except (OSError, ValueError):
+        pass
+    connection.close()
+
+
+def _handle_connection(connection, request: dict, fds: list) -> None:
+    # Runs in forked request handler: starts build process, forwards signals
+    # to it and reports its exit code
+    import selectors
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    wakeup_read_fd, wakeup_write_fd = os.pipe()
+    os.set_blocking(wakeup_write_fd, False)
+    signal.set_wakeup_fd(wakeup_write_fd)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    if (build_pid := os.fork()) == 0:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        connection.close()
+        _run_scons(request, fds)
+    for fd in fds:
+        os.close(fd)
+
+    selector = selectors.DefaultSelector()
+    selector.register(connection, selectors.EVENT_READ)
+    selector.register(wakeup_read_fd, selectors.EVENT_READ)
+    connection_file = connection.makefile("r")
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is wakeup_read_fd:
+                os.read(wakeup_read_fd, 4096)
+                continue
+            if not (line := connection_file.readline()):
+                # Client is gone
+                os.killpg(build_pid, signal.SIGTERM)
+                selector.unregister(connection)
+            elif line.startswith("signal "):
+                os.killpg(build_pid, int(line.split()[1]))
+        pid, status = os.waitpid(build_pid, os.WNOHANG)
+        if pid:
+            break
+
+    if os.WIFSIGNALED(status):
+        exit_code = 128 + os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    try:
+        connection.sendall(f"exit {exit_code}\n".encode())
+    except OSError:
+        pass
+
+
+def serve(
+    socket_path: str, current_sdk_dir: str, env_key: str, idle_timeout: int
+) -> None:
+    sdk_signature = get_sdk_signature(current_sdk_dir)
+    # Forked builds start with SCons already imported, but not with its
+    # build graph - it is evaluated by each build
+    import SCons.Script  # noqa: F401
+
+    tmp_socket_path = f"{socket_path}.{os.getpid()}"
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(tmp_socket_path)
+    server_socket.listen()
+    os.replace(tmp_socket_path, socket_path)
+    socket_inode = os.stat(socket_path).st_ino
+    server_socket.settimeout(idle_timeout)
+    # Request handlers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print(
+        f"uFBT daemon {os.getpid()} serving {sdk_signature[0]} on {socket_path}",
+        flush=True,
+    )
+
+    try:
+        while True:
+            try:
+                connection, _ = server_socket.accept()
+            except socket.timeout:
+                print(f"uFBT daemon {os.getpid()} is idle, exiting", flush=True)
+                break
+            connection.settimeout(REQUEST_TIMEOUT)
+            try:
+                request, fds = _receive_request(connection)
+            except (OSError, ValueError):
+                connection.close()
+                continue
+            if get_sdk_signature(current_sdk_dir) != sdk_signature:
+                restart_reason = "SDK has changed"
+            elif request.get("env_key") != env_key:
+                restart_reason = "environment has changed"
+            else:
+                if os.fork() == 0:
+                    server_socket.close()
+                    connection.settimeout(None)
+                    try:
+                        _handle_connection(connection, request, fds)
+                    finally:
+                        os._exit(0)
+                for fd in fds:
+                    os.close(fd)
+                connection.close()
+                continue
+
+            print(f"uFBT daemon {os.getpid()}: {restart_reason}, exiting", flush=True)
+            # New clients must not reach this daemon after it replied
+            _unlink_socket(socket_path, socket_inode)
+            for fd in fds:
+                os.close(fd)
+            connection.sendall(b"restart\n")
+            connection.close()
+            # Clients already waiting in backlog also need to restart
+            server_socket.settimeout(0)
+            while True:
+                try:
+                    connection, _ = server_socket.accept()
+                except OSError:
+                    break
+                connection.settimeout(REQUEST_TIMEOUT)
+                _reply_restart(connection)
+            break
+    finally:
+        _unlink_socket(socket_path, socket_inode)
+        server_socket.close()
+
+
+def _unlink_socket(socket_path: str, socket_inode: int) -> None:
+    # Socket path may already be taken over by a newer daemon
+    try:
+        if os.stat(socket_path).st_ino == socket_inode:
+            os.unlink(socket_path)
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))
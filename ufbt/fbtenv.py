@@ -0,0 +1,221 @@
+#
+# Cached toolchain environment for uFBT builds
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Environment set up by SDK's fbtenv.sh only depends on SDK, toolchain and
+# environment it is sourced in. It is captured once and kept in state dir,
+# so builds start toolchain Python directly, without a shell.
+# Used on build path, so this module only imports from the standard library.
+
+import hashlib
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+
+ENV_CACHE_FILE_NAME = "toolchain_env.json"
+# Entries for different client environments, e.g. IDE and terminal
+ENV_CACHE_MAX_ENTRIES = 8
+# Set by shell itself, not affecting the build
+VOLATILE_ENV_VARS = ("PWD", "OLDPWD", "SHLVL", "_")
+
+# On Windows, builds are run in a shell with fbtenv.cmd
+WINDOWS_COMMANDLINE_PREFIX = (
+    r'call "%UFBT_STATE_DIR%/current/scripts/toolchain/fbtenv.cmd" env & python '
+)
+
+_DUMP_ENV_SCRIPT = (
+    "import json, os, sys; "
+    "json.dump({'python': sys.executable, 'env': dict(os.environ)}, sys.stdout)"
+)
+
+
+def get_env_key(env=None) -> str:
+    items = sorted(
+        (key, value)
+        for key, value in (os.environ if env is None else env).items()
+        if key not in VOLATILE_ENV_VARS
+    )
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()[:16]
+
+
+def _stat_key(path: str):
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    return [path_stat.st_ino, path_stat.st_mtime_ns, path_stat.st_size]
+
+
+def _get_toolchain_key(state_dir: str) -> str:
+    # Changes when SDK is switched or redeployed, or toolchain is updated
+    current_sdk_dir = os.path.join(state_dir, "current")
+    toolchain_dir = os.path.join(os.environ["FBT_TOOLCHAIN_PATH"], "toolchain")
+    try:
+        toolchain_entries = sorted(
+            (entry.name, _stat_key(entry.path)) for entry in os.scandir(toolchain_dir)
+        )
+    except OSError:
+        toolchain_entries = None
+    key = [
+        os.path.realpath(current_sdk_dir),
+        _stat_key(os.path.join(current_sdk_dir, "ufbt_state.json")),
+        _stat_key(os.path.join(current_sdk_dir, "scripts", "toolchain", "fbtenv.sh")),
+        os.path.realpath(toolchain_dir),
+        toolchain_entries,
+    ]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def get_toolchain_id() -> list:
+    """
+    Identifies installed toolchains by their versions. Unlike toolchain key,
+    it does not depend on paths, so it is the same on other machines.
+    """
+    toolchain_dir = os.path.join(os.environ["FBT_TOOLCHAIN_PATH"], "toolchain")
+    versions = []
+    try:
+        entries = sorted(os.scandir(toolchain_dir), key=lambda entry: entry.name)
+    except OSError:
+        entries = []
+    for entry in entries:
+        try:
+            with open(os.path.join(entry.path, "VERSION")) as f:
+                versions.append([entry.name, f.read().strip()])
+        except OSError:
+            continue
+    return [sys.platform, versions]
+
+
+def _read_env_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_env_cache(cache_path: str, entries: dict) -> None:
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Cache is an optimization only
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _capture_toolchain_env(state_dir: str):
+    # fbtenv.sh may download toolchain and report progress - its output is
+    # passed to stderr, stdout only carries the captured environment
+    fbtenv_path = os.path.join(
+        state_dir, "current", "scripts", "toolchain", "fbtenv.sh"
+    )
+    commandline = (
+        f". {shlex.quote(fbtenv_path)} 1>&2 && " f'exec python3 -c "{_DUMP_ENV_SCRIPT}"'
+    )
+    result = subprocess.run(commandline, shell=True, stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        return None
+    try:
+        captured = json.loads(result.stdout)
+    except ValueError:
+        return None
+    for key in VOLATILE_ENV_VARS:
+        captured["env"].pop(key, None)
+    return captured
+
+
+def get_toolchain_env(state_dir: str):
+    """
+    Returns {"python": <toolchain python>, "env": <environment>} for
+    builds with SDK deployed to state_dir, or None if fbtenv.sh failed.
+    """
+    cache_path = os.path.join(state_dir, ENV_CACHE_FILE_NAME)
+    cache_key = get_env_key()
+    entries = _read_env_cache(cache_path)
+    if (entry := entries.get(cache_key)) and entry.get(
+        "toolchain_key"
+    ) == _get_toolchain_key(state_dir):
+        toolchain_env = entry
+    elif toolchain_env := _capture_toolchain_env(state_dir):
+        # Toolchain might have been deployed by fbtenv.sh, so key is
+        # computed after running it
+        toolchain_env["toolchain_key"] = _get_toolchain_key(state_dir)
+        entries.pop(cache_key, None)
+        entries[cache_key] = toolchain_env
+        while len(entries) > ENV_CACHE_MAX_ENTRIES:
+            entries.pop(next(iter(entries)))
+        _write_env_cache(cache_path, entries)
+    else:
+        return None
+    # Volatile variables are kept as they are in the caller's environment
+    env = dict(toolchain_env["env"])
+    env.update((key, os.environ[key]) for key in VOLATILE_ENV_VARS if key in os.environ)
+    return {"python": toolchain_env["python"], "env": env}
+
+
+def get_scons_args(state_dir: str, app_dir: str, args: list) -> list:
+    return [
+        "-Q",
+        "--warn=target-not-built",
+        "-C",
+        os.path.join(state_dir, "current", "scripts", "ufbt"),
+        f"UFBT_APP_DIR={app_dir}",
+        *args,
+    ]
+
+
+def run_python(toolchain_env: dict, args: list, cwd=None, output=None) -> int:
+    """
+    Runs toolchain Python with args, returns its exit code.
+    Like a shell, reports termination by signal N as 128+N.
+    With output file given, stdout and stderr of the child are written to it.
+    """
+    env = toolchain_env["env"] if cwd is None else dict(toolchain_env["env"], PWD=cwd)
+    with subprocess.Popen(
+        [toolchain_env["python"], *args],
+        cwd=cwd,
+        env=env,
+        stdout=output,
+        stderr=subprocess.STDOUT if output else None,
+    ) as process:
+        # Terminal signals reach the whole process group, so the child
+        # handles Ctrl+C itself. Termination of uFBT is passed on to it.
+        # Handlers can only be set from main thread
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            previous_handlers = {
+                signal.SIGINT: signal.signal(signal.SIGINT, signal.SIG_IGN),
+                signal.SIGTERM: signal.signal(
+                    signal.SIGTERM, lambda signum, frame: process.send_signal(signum)
+                ),
+            }
+        try:
+            returncode = process.wait()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+    return 128 - returncode if returncode < 0 else returncode
@@ -0,0 +1,82 @@
+#
+# Inter-process file lock
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Used on build path, so this module only imports from the standard library.
+
+import logging
+import os
+import sys
+
+log = logging.getLogger(__name__)
+
+
+class FileLock:
+    """
+    Advisory inter-process lock, held on a file. Blocks until acquired.
+    Each holder opens lock file separately, so it also works between threads.
+    """
+
+    def __init__(self, lock_file_path, quiet: bool = False):
+        self.lock_file_path = lock_file_path
+        self.quiet = quiet
+        self._lock_file = None
+
+    def _log_wait(self) -> None:
+        level = logging.DEBUG if self.quiet else logging.INFO
+        log.log(level, f"Waiting for lock on {self.lock_file_path}")
+
+    def __enter__(self) -> "FileLock":
+        os.makedirs(os.path.dirname(self.lock_file_path), exist_ok=True)
+        self._lock_file = open(self.lock_file_path, "a+")
+        self._acquire()
+        return self
+
+    def _acquire(self) -> None:
+        if sys.platform == "win32":
+            import msvcrt
+
+            self._lock_file.seek(0)
+            while True:
+                try:
+                    # Retries for 10 seconds before raising
+                    msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    self._log_wait()
+        else:
+            import fcntl
+
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._log_wait()
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *args) -> None:
+        if sys.platform == "win32":
+            import msvcrt
+
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
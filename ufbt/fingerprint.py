@@ -0,0 +1,267 @@
+#
+# Build fingerprints for skipping builds of unchanged applications
+# This file is part of uFBT <https://github.com/flipperdevices/flipperzero-ufbt>
+# Copyright (C) 2022-2023 Flipper Devices Inc.
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# After a successful build, its inputs - files in app dir, build arguments,
+# SDK and environment - and outputs in dist dir are recorded. If they are
+# the same on next run, build is skipped without starting the toolchain.
+# Files are compared by size and mtime, with content hash as a fallback,
+# like git index does. Used on build path, so only uses standard library.
+
+import hashlib
+import json
+import os
+import re
+import time
+
+FINGERPRINT_SUBDIR = "fingerprints"
+OUTPUT_DIR_NAME = "dist"
+# Build invocations without side effects besides build outputs
+NOOP_TARGETS = ("faps", "build")
+# SCons options removing outputs instead of building them
+CLEAN_OPTIONS = ("-c", "--clean", "--remove")
+# Not build inputs
+SKIPPED_DIR_NAMES = (".git",)
+# Environment variables read by build scripts
+BUILD_ENV_VAR_PREFIXES = ("FBT_", "UFBT_")
+BUILD_ENV_VARS = ("PATH",)
+# Read by uFBT itself, not by build scripts
+IGNORED_ENV_VARS = ("UFBT_NOOP_CHECK",)
+# Scanning larger trees may take longer than the build itself
+MAX_INPUT_FILES = 10000
+# Files modified this recently may change again within mtime granularity
+RACY_INTERVAL_NS = 2 * 10**9
+
+
+def _is_build_only(args: list) -> bool:
+    if any(arg in CLEAN_OPTIONS for arg in args):
+        return False
+    return all(
+        arg in NOOP_TARGETS or re.match(r"\w+=|-j\d+$", arg) is not None for arg in args
+    )
+
+
+def _scan_tree(root_dir: str, skip_dirs=()):
+    """
+    Returns {relative path: [size, mtime_ns]} for files in root_dir,
+    skipping VCS metadata. None if tree has links to directories, which
+    could lead outside of it, or is too large.
+    """
+    files = {}
+    pending_dirs = [""]
+    while pending_dirs:
+        rel_dir = pending_dirs.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root_dir, rel_dir)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if rel_path not in skip_dirs and entry.name not in SKIPPED_DIR_NAMES:
+                    pending_dirs.append(rel_path)
+            elif entry.is_dir():
+                return None
+            elif entry.is_file():
+                entry_stat = entry.stat()
+                files[rel_path] = [entry_stat.st_size, entry_stat.st_mtime_ns]
+                if len(files) > MAX_INPUT_FILES:
+                    return None
+    return files
+
+
+def get_build_env_key() -> str:
+    """Hash of environment variables affecting the build"""
+    items = sorted(
+        (key, value)
+        for key, value in os.environ.items()
+        if (key.startswith(BUILD_ENV_VAR_PREFIXES) or key in BUILD_ENV_VARS)
+        and key not in IGNORED_ENV_VARS
+    )
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()[:16]
+
+
+def _hash_file(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _get_sdk_info(state_dir: str) -> dict:
+    current_sdk_dir = os.path.join(state_dir, "current")
+    state_file_path = os.path.join(current_sdk_dir, "ufbt_state.json")
+    try:
+        with open(state_file_path) as f:
+            sdk_state = json.load(f)
+        state_stat = os.stat(state_file_path)
+    except (OSError, ValueError):
+        return None
+    return {
+        "dir": os.path.realpath(current_sdk_dir),
+        "state_file": [state_stat.st_ino, state_stat.st_mtime_ns],
+        "hw_target": sdk_state.get("hw_target"),
+        "mode": sdk_state.get("mode"),
+        "version": sdk_state.get("version"),
+    }
+
+
+class BuildFingerprint:
+    """
+    Fingerprint of a build of app_dir with args. Inputs are scanned on
+    creation, so a file changed while the build runs is not recorded as built.
+    """
+
+    def __init__(self, state_dir: str, app_dir: str, args: list, env_key: str):
+        self.app_dir = app_dir
+        self.file_path = os.path.join(
+            state_dir,
+            FINGERPRINT_SUBDIR,
+            hashlib.sha256(app_dir.encode()).hexdigest()[:16] + ".json",
+        )
+        self.build_key = {
+            "app_dir": app_dir,
+            "args": args,
+            "env": env_key,
+            "sdk": _get_sdk_info(state_dir),
+        }
+        self.inputs = _scan_tree(app_dir, skip_dirs=(OUTPUT_DIR_NAME,))
+        self._recorded = None
+        self._hashes = None
+
+    @classmethod
+    def create(cls, state_dir: str, app_dir: str, args: list, env_key: str):
+        # Builds with other targets, like launch or flash, always run
+        if not _is_build_only(args):
+            return None
+        fingerprint = cls(state_dir, app_dir, args, env_key)
+        if fingerprint.inputs is None or fingerprint.build_key["sdk"] is None:
+            return None
+        return fingerprint
+
+    def _load(self):
+        if self._recorded is None:
+            try:
+                with open(self.file_path) as f:
+                    self._recorded = json.load(f)
+            except (OSError, ValueError):
+                self._recorded = {}
+        return self._recorded
+
+    def get_input_hashes(self) -> dict:
+        """
+        Returns {relative path: sha256} of inputs. Files with the same
+        stats as in last recorded build are not read again.
+        """
+        if self._hashes is None:
+            recorded_inputs = self._load().get("inputs", {})
+            hashes = {}
+            for rel_path, file_stat in self.inputs.items():
+                recorded_input = recorded_inputs.get(rel_path)
+                if recorded_input and recorded_input[:2] == file_stat:
+                    hashes[rel_path] = recorded_input[2]
+                else:
+                    hashes[rel_path] = _hash_file(os.path.join(self.app_dir, rel_path))
+            self._hashes = hashes
+        return self._hashes
+
+    def get_content_key(self, toolchain_id):
+        """
+        Identifies build results by app contents, build arguments, SDK
+        version and toolchain, regardless of paths and machine. None if SDK
+        is not versioned.
+        """
+        sdk_info = self.build_key["sdk"]
+        if sdk_info["mode"] == "local" or sdk_info["version"] in (None, "unknown"):
+            return None
+        try:
+            input_hashes = self.get_input_hashes()
+        except OSError:
+            return None
+        content = {
+            "inputs": sorted(input_hashes.items()),
+            "args": self.build_key["args"],
+            "sdk": [sdk_info["mode"], sdk_info["version"], sdk_info["hw_target"]],
+            "toolchain": toolchain_id,
+        }
+        return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+    def inputs_unchanged(self) -> bool:
+        """Checks that inputs are the same as on creation"""
+        return _scan_tree(self.app_dir, skip_dirs=(OUTPUT_DIR_NAME,)) == self.inputs
+
+    def is_up_to_date(self) -> bool:
+        recorded = self._load()
+        if not recorded or recorded["build"] != self.build_key:
+            return False
+        if recorded["inputs"].keys() != self.inputs.keys():
+            return False
+        outputs = _scan_tree(os.path.join(self.app_dir, OUTPUT_DIR_NAME))
+        if not outputs or outputs != recorded["outputs"]:
+            return False
+        if any(
+            self.inputs[rel_path][0] != size
+            for rel_path, (size, _, _) in recorded["inputs"].items()
+        ):
+            return False
+
+        # Files touched, or recorded with racy mtime, are compared by content
+        try:
+            input_hashes = self.get_input_hashes()
+        except OSError:
+            return False
+        if any(
+            input_hashes[rel_path] != sha256
+            for rel_path, (_, _, sha256) in recorded["inputs"].items()
+        ):
+            return False
+        if any(
+            self.inputs[rel_path] != [size, mtime_ns]
+            for rel_path, (size, mtime_ns, _) in recorded["inputs"].items()
+        ):
+            # Next check can use file stats again
+            self.save()
+        return True
+
+    def save(self) -> None:
+        """Records fingerprint after a successful build"""
+        try:
+            input_hashes = self.get_input_hashes()
+        except OSError:
+            return
+        if not self.inputs_unchanged():
+            # Changed since build has started
+            return
+        outputs = _scan_tree(os.path.join(self.app_dir, OUTPUT_DIR_NAME))
+        if not outputs:
+            return
+
+        racy_mtime_ns = time.time_ns() - RACY_INTERVAL_NS
+        inputs = {
+            rel_path: [
+                size,
+                None if mtime_ns > racy_mtime_ns else mtime_ns,
+                input_hashes[rel_path],
+            ]
+            for rel_path, (size, mtime_ns) in self.inputs.items()
+        }
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        tmp_file_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with open(tmp_file_path, "w") as f:
+            json.dump(
+                {"build": self.build_key, "inputs": inputs, "outputs": outputs}, f
+            )
+        os.replace(tmp_file_path, self.file_path)
@@ -0,0 +1,201 @@
+#
+# Stand-ins for update server and deployed SDK, shared by tests and benchmarks
+#
+
+import gzip
+import json
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+# Local stand-in for update server, serving files from memory
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        files=None,
+        chunk_delay=0.0,
+        support_ranges=True,
+        etag=None,
+        last_modified=None,
+        support_if_range=True,
+    ):
+        super().__init__(("127.0.0.1", 0), StandInRequestHandler)
+        self.files = files or {}
+        self.chunk_delay = chunk_delay
+        self.support_ranges = support_ranges
+        self.etag = etag
+        self.last_modified = last_modified
+        # Some servers and proxies serve ranges of any file version
+        self.support_if_range = support_if_range
+        self.redirects = {}
+        # Encodings applied to full responses, if accepted by client
+        self.content_encodings = []
+        self.requests = []
+        self.connections = 0
+
+    def handle_error(self, request, client_address):
+        # Clients may close connections without reading whole response
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # As on production servers. Otherwise body sent after headers on a
+    # kept-alive connection waits for delayed ACK of the client
+    disable_nagle_algorithm = True
+    COMPRESSORS = {"gzip": gzip.compress, "deflate": zlib.compress}
+    CHUNK_SIZE = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if location := self.server.redirects.get(self.path):
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if (data := self.server.files.get(self.path)) is None:
+            self.send_error(404)
+            return
+
+        if self.server.etag and self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+
+        range_match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        accepted_encodings = self.headers.get("Accept-Encoding", "")
+        content_encoding = next(
+            (e for e in self.server.content_encodings if e in accepted_encodings), None
+        )
+        if content_encoding and not range_match:
+            data = self.COMPRESSORS[content_encoding](data)
+        else:
+            content_encoding = None
+
+        start, end = 0, len(data) - 1
+        if_range = self.headers.get("If-Range")
+        if (
+            self.server.support_ranges
+            and range_match
+            and (
+                not self.server.support_if_range
+                or if_range in (None, self.server.etag, self.server.last_modified)
+            )
+        ):
+            start = int(range_match.group(1))
+            end = int(range_match.group(2) or end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        if self.server.support_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if self.server.etag:
+            self.send_header("ETag", self.server.etag)
+        if self.server.last_modified:
+            self.send_header("Last-Modified", self.server.last_modified)
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        # Delay per chunk emulates per-connection bandwidth limit
+        for offset in range(start, end + 1, self.CHUNK_SIZE):
+            self.wfile.write(data[offset : min(offset + self.CHUNK_SIZE, end + 1)])
+            time.sleep(self.server.chunk_delay)
+
+
+def make_index(channels: dict, **version_fields) -> bytes:
+    # directory.json of update server. Maps channel id to its versions, newest
+    # first, and each version to SDK archives by target - their URLs, or file
+    # entries with extra fields like sha256
+    return json.dumps(
+        {
+            "channels": [
+                {
+                    "id": channel_id,
+                    "versions": [
+                        {
+                            "version": version,
+                            **version_fields,
+                            "files": [
+                                {
+                                    "type": "sdk_zip",
+                                    "target": target,
+                                    **(
+                                        {"url": file_entry}
+                                        if isinstance(file_entry, str)
+                                        else file_entry
+                                    ),
+                                }
+                                for target, file_entry in files.items()
+                            ],
+                        }
+                        for version, files in versions.items()
+                    ],
+                }
+                for channel_id, versions in channels.items()
+            ]
+        }
+    ).encode()
+
+
+# Minimal SDK with toolchain environment of the running interpreter
+STAND_IN_SCONSTRUCT = """
+import os
+app_dir = ARGUMENTS["UFBT_APP_DIR"]
+env = Environment(ENV=os.environ)
+copy = env.Command(
+    os.path.join(app_dir, "dist", "out.txt"),
+    os.path.join(app_dir, "in.txt"),
+    Copy("$TARGET", "$SOURCE"),
+)
+env.Alias("fail", env.Command("fail.txt", [], lambda target, source, env: 1))
+Default(copy)
+"""
+
+
+def make_stand_in_sdk(state_dir: Path, slots=("a",), mode="local") -> None:
+    # Deployed SDK slots with SCons scripts copying in.txt of the app,
+    # and toolchain environment of the running interpreter
+    for slot in slots:
+        slot_dir = state_dir / "sdk" / slot
+        (slot_dir / "scripts" / "toolchain").mkdir(parents=True)
+        (slot_dir / "scripts" / "toolchain" / "fbtenv.sh").write_text(
+            f'PATH="{Path(sys.executable).parent}:$PATH"\n'
+        )
+        (slot_dir / "scripts" / "ufbt").mkdir()
+        (slot_dir / "scripts" / "ufbt" / "SConstruct").write_text(STAND_IN_SCONSTRUCT)
+        (slot_dir / "ufbt_state.json").write_text(
+            json.dumps({"hw_target": "f7", "mode": mode, "version": slot})
+        )
+    (state_dir / "current").symlink_to(Path("sdk") / slots[0])